@@ -1,8 +1,7 @@
 import constants
-import networkx as nx
 import math
 import time 
-from shapely.geometry import Point, Polygon  
+from shapely.geometry import Point
 from navigation.fov import FieldOfView
 import  numpy as np
 import matplotlib.pyplot as plt
@@ -31,72 +30,58 @@ number_direction = 4
 
 
 class graph_2d():
+    '''
+    Exploration grid over [xMin, xMax) x [zMin, zMax) in units of AGENT_STEP_SIZE.
+    The per cell state lives in numpy bool arrays indexed by
+    (x - xMin, y - yMin); the networkx graph is only built if asked for.
+    '''
     def __init__(self):#,xMin,xMax,yMin,yMax):
-        self.graph = nx.DiGraph() 
-        '''
-        xMin = int(global xMin)
-        yMin = int(global yMin)
-        xMax = int(global xMax)
-        yMax = int(global yMax)
-        
-        xMin_local = int(xMin)
-        zMin_local = int(zMin)
-        xMax_local = int(xMax)
-        zMax_local = int(zMax)
-        '''
         self.xMin = int(xMin)
         self.yMin = int(zMin)
         self.xMax = int(xMax)
         self.yMax = int(zMax)
-        not_seen_points = []
-        #for x in range (xMin_local, xMax_local):
-        #    for y in range (xMin_local, yMax_local):
-       
+        shape = (self.xMax - self.xMin, self.yMax - self.yMin)
+        self.visited = np.zeros(shape, dtype=bool)
+        self.seen = np.zeros(shape, dtype=bool)
+        self.contains_object = np.zeros(shape, dtype=bool)
+        self._graph = None
+
+    @property
+    def graph(self):
+        '''
+        DiGraph with the grid state as node attributes, for path search.
+        Built on first use; the arrays stay the source of truth.
+        '''
+        import networkx as nx
+        if self._graph is None:
+            self._graph = nx.DiGraph()
+            for xx in range (self.xMin, self.xMax):
+                for yy in range (self.yMin, self.yMax):
+                    self._graph.add_edge((xx,yy),(xx, yy + 1), weight=1)
         for xx in range (self.xMin, self.xMax):
             for yy in range (self.yMin, self.yMax):
-                self.graph.add_node((xx,yy), visited=False, seen=False, contains_object = False)
-                curr_weight = 1
-                if yy != self.yMax:
-                    self.graph.add_edge((xx,yy),(xx, yy + 1), weight=curr_weight)
-                elif xx != self.xMax:
-                    self.graph.add_edge((xx,yy),(xx + 1, yy), weight=curr_weight)
-                elif yy != self.yMin:
-                    self.graph.add_edge((xx,yy),(xx, yy - 1), weight=curr_weight)
-                elif xx != self.xMin:
-                    self.graph.add_edge((xx,yy),(xx - 1, yy), weight=curr_weight)
-                #not_seen_points.append((x,y))    
+                i, j = xx - self.xMin, yy - self.yMin
+                self._graph.add_node((xx,yy), visited=bool(self.visited[i,j]), seen=bool(self.seen[i,j]),
+                                     contains_object=bool(self.contains_object[i,j]))
+        return self._graph
 
     def reset(self):
-        for xx in range (self.xMin, self.xMax):
-            for yy in range (self.yMin, self.yMax):
-                self.graph.nodes[(xx,yy)]['visited']=False
-                self.graph.nodes[(xx,yy)]['seem']=False
-                self.graph.nodes[(xx,yy)]['contains_object']=False
+        self.visited[:] = False
+        self.seen[:] = False
+        self.contains_object[:] = False
+
+    def explored(self):
+        return self.visited | self.seen | self.contains_object
+
+    def in_grid(self, i, j):
+        return (i >= self.xMin) & (i < self.xMax) & (j >= self.yMin) & (j < self.yMax)
 
     '''
     function to get all the unexplored points in the grid
     '''
     def get_unseen(self):#,xMin,xMax,yMin,yMax):
-
-        xMin_local = int(xMin)
-        yMin_local = int(zMin)
-        xMax_local = int(xMax)
-        yMax_local = int(zMax)
-        '''
-        xMin = int(global xMin)
-        yMin = int(global yMin)
-        xMax = int(global xMax)
-        yMax = int(global yMax)
-        '''
-        not_seen_points = []
-        for x in range (xMin_local, xMax_local):
-            for y in range (yMin_local, yMax_local):
-                node = self.graph.nodes[(x,y)]
-                #if not (node['visited']) and not(node['seen']) and not(node['contains_object']):
-                if not (node['visited'] or node['seen'] or node['contains_object']):
-                    not_seen_points.append((x,y))
-
-        return not_seen_points
+        i, j = np.nonzero(~self.explored())
+        return list(zip((i + self.xMin).tolist(), (j + self.yMin).tolist()))
 
     '''
     Function to get all the visible points from a certain point in the 2D grid
@@ -119,14 +104,17 @@ class graph_2d():
     def update_seen(self, x, z, rotation,radius, camera_field_of_view,obstacles):
         #camera_field_of_view = event.camera_field_of_view
         #radius = event.camera_clipping_planes[1]
-        visible_points = self.get_visible_points(x,z,rotation,camera_field_of_view,radius,obstacles)#,g )
-
-        for elem in visible_points :
-            self.graph.nodes[elem]['seen']= True
-        #pass
+        self.seen |= self.get_visible_mask(x,z,rotation,camera_field_of_view,radius,obstacles)
 
 
     def get_visible_points(self,x,y,rotation,camera_field_of_view,radius,scene_obstacles_dict):#,visibility_graph):
+        i, j = np.nonzero(self.get_visible_mask(x,y,rotation,camera_field_of_view,radius,scene_obstacles_dict))
+        return list(zip((i + self.xMin).tolist(), (j + self.yMin).tolist()))
+
+    '''
+    Grid mask of the unexplored cells inside the FoV wedge with a clear line of sight
+    '''
+    def get_visible_mask(self,x,y,rotation,camera_field_of_view,radius,scene_obstacles_dict):
         step_size = constants.AGENT_STEP_SIZE
         graph_x = x/constants.AGENT_STEP_SIZE
         graph_z = y/constants.AGENT_STEP_SIZE
@@ -166,43 +154,26 @@ class graph_2d():
         loop_x_min, loop_x_max = int(min(fov_poly.x_list)/constants.AGENT_STEP_SIZE), int(max(fov_poly.x_list)/constants.AGENT_STEP_SIZE)
         loop_z_min, loop_z_max = int(min(fov_poly.y_list)/constants.AGENT_STEP_SIZE), int(max(fov_poly.y_list)/constants.AGENT_STEP_SIZE)
 
-        number_ray_casted = 0
-        visible_points = []
-        possible_points_x = []
-        possible_points_y = []
-        dict_values =scene_obstacles_dict.values()
         start_time = time.time()
-        for i in range(loop_x_min, loop_x_max+1 ):
-            for j in range(loop_z_min, loop_z_max+1):
-                #goal_point = Point(i,j)
-                #if goal_point.within(poly):
-                if j==graph_z or j >= zMax or i >= xMax or i<xMin or j < zMin:
-                    continue
-                current_pt_angle =  math.degrees(math.atan((i-graph_x)/(j-graph_z)))
-                #pt_2_angle =  math.degrees(math.atan((p2_x-x)/(p2_z-z)))
-                #if visibility_graph[elem]['seen'] or
-                node = self.graph.nodes[(i,j)]#g.nodes[(x, y)]
-                # if not (node['visited']) and not(node['seen']) and not(node['contains_object']):
-                if not (node['visited'] or node['seen'] or node['contains_object']):
-                    if current_pt_angle >= lower_angle and current_pt_angle <= higher_angle :
-                        number_ray_casted += 1
-                        if castRay(graph_x,graph_z,i,j,dict_values):
-                           visible_points.append((i, j))
-                        #if ray_tracing_mult():
-                        #possible_points_x.append(i)
-                        #possible_points_y.append(j)
-                        #if ()
-                #else :
-                #    print ("already seen")
-        #if (len(possible_points_x) >= 0):
-        #    fov_ray_poly = [[x,y] for x,y in zip(fov_poly.x_list,fov_poly.y_list)]
-        #    visible_points = ray_tracing_mult(possible_points_x,possible_points_y,fov_ray_poly)
-
+        i, j = np.mgrid[loop_x_min:loop_x_max+1, loop_z_min:loop_z_max+1]
+        i, j = i.ravel(), j.ravel()
+        candidates = self.in_grid(i, j) & (j != graph_z)
+        i, j = i[candidates], j[candidates]
+        candidates = ~self.explored()[i - self.xMin, j - self.yMin]
+        i, j = i[candidates], j[candidates]
+        current_pt_angle = np.degrees(np.arctan((i-graph_x)/(j-graph_z)))
+        candidates = (current_pt_angle >= lower_angle) & (current_pt_angle <= higher_angle)
+        i, j = i[candidates], j[candidates]
+
+        edges = obstacle_edges(scene_obstacles_dict.values())
+        visible = ~rays_blocked(graph_x, graph_z, i, j, edges)
+        visible_mask = np.zeros_like(self.seen)
+        visible_mask[i[visible] - self.xMin, j[visible] - self.yMin] = True
 
         end_time = time.time()
         time_taken = end_time- start_time
         #print ("time taken for processing = " , end_time- start_time)
-        return visible_points
+        return visible_mask
 
         #poly.plot()
 
@@ -231,6 +202,44 @@ def ray_tracing_numpy(x,y,poly):
 def ray_tracing_mult(x,y,poly):
     return [ray_tracing_numpy(xi, yi, poly) for xi,yi in zip(x,y)]
 
+def obstacle_edges(obstacles):
+    '''
+    Edges between consecutive vertices of every obstacle as an (M, 4) array
+    of x1, y1, x2, y2 in grid units
+    '''
+    edges = [np.zeros((0, 4))]
+    for obs in obstacles:
+        x = np.asarray(obs.x_list, dtype=float) / constants.AGENT_STEP_SIZE
+        y = np.asarray(obs.y_list, dtype=float) / constants.AGENT_STEP_SIZE
+        edges.append(np.stack((x[:-1], y[:-1], x[1:], y[1:]), axis=1))
+    return np.concatenate(edges)
+
+def rays_blocked(graph_x, graph_y, check_x, check_y, edges, chunk_size=4096):
+    '''
+    For rays from (graph_x, graph_y) to every (check_x, check_y), whether an
+    edge crosses the ray before it reaches the target. Same test as castRay,
+    for all rays and edges at once: parallel edges never block.
+    '''
+    check_x = np.asarray(check_x, dtype=float)
+    check_y = np.asarray(check_y, dtype=float)
+    blocked = np.zeros(len(check_x), dtype=bool)
+    if len(edges) == 0:
+        return blocked
+
+    cx, cy, dx, dy = (edges[:, k] for k in range(4))
+    t_num = (graph_x - cx) * (cy - dy) - (graph_y - cy) * (cx - dx)
+    for start in range(0, len(check_x), chunk_size):
+        ray_x = (graph_x - check_x[start:start + chunk_size])[:, None]
+        ray_y = (graph_y - check_y[start:start + chunk_size])[:, None]
+        denom = ray_x * (cy - dy) - ray_y * (cx - dx)
+        u_num = ray_x * (graph_y - cy) - ray_y * (graph_x - cx)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = t_num / denom
+            u = - u_num / denom
+        hits = (denom != 0) & (t >= 0) & (t < 1) & (u >= 0) & (u <= 1)
+        blocked[start:start + chunk_size] = hits.any(axis=1)
+    return blocked
+
 def castRay(graph_x, graph_y, check_x, check_y,obstacle,clr="-g"):
     start_time = time.time()
     #p1 = Geometry.Point(float(self.agentX), float(self.agentY))
@@ -380,110 +389,38 @@ def explore_point(x, y, agent, obstacles):
 
 
 def update_seen(x,y,game_state,rotation,camera_field_of_view,obstacles):
-    #rotation = (rotation - 45)%360
-    #print (rotation)
-    rotation_rad = rotation / 180 * math.pi
-    #start_time = time.time()
-    fov = FieldOfView([x, y, rotation_rad], camera_field_of_view / 180.0 * math.pi, obstacles)
-    poly = fov.getFoVPolygon(17)
-    #print ("time taken to creat new fov" ,time.time()-start_time)
-
-    try:
-        view = Polygon(zip(poly.x_list, poly.y_list)).buffer(0) #the buffer helps eliminate intersections
-        game_state.world_poly = game_state.world_poly.union(view).buffer(0)
-    except:
-        return
-    world = game_state.world_poly
-
-    #obstacles_polygons = [ObstaclePolygon(obstacle) for obstacle in obstacles ]
+    game_state.coverage_map.update(x, y, rotation, camera_field_of_view, obstacles)
 
     show_animation = False
     if show_animation:
-        plt.cla()
-        plt.plot(x, y, "or")
-        # plt.plot(gx, gy, "ob")
-        # poly.plot("-r")
-
-        if world.geom_type == 'MultiPolygon':
-            for i in range(len(world)):
-                pts = world[i].exterior.coords
-                plt.fill([p[0] for p in pts], [p[1] for p in pts], "-b")
-        else:
-            pts = world.exterior.coords
-            plt.fill([p[0] for p in pts], [p[1] for p in pts], "-b")
-
-        #for i in range(len(obstacles)):
-        #    obstacles[i].plot("-k")
-        #for obstacle in obstacles:
-        #    obstacle.plot("-g")
-
-        plt.axis("equal")
-        plt.pause(1)
+        plot_coverage(x, y, game_state.coverage_map)
 
 
 def get_point_all_new_coverage(x,y,game_state,rotation,obstacles):
     return get_point_new_coverage(x,y,game_state,rotation,360,obstacles)
 
 def get_point_new_coverage(x,y,game_state, rotation,camera_field_of_view,obstacles):
-    #rotation = (rotation - 45)%360
-    rotation_rad = rotation / 180 * math.pi
-    fov_checker = FieldOfView([x,y,rotation_rad],camera_field_of_view/180.0*math.pi, obstacles)
-
-    checkPoly = fov_checker.getFoVPolygon(17)
-
-    intersection_free_points = [[],[]]
-
-    for x,y in zip(checkPoly.x_list,checkPoly.y_list) :
-        if len(intersection_free_points[0]) != 0:
-            if not ( abs(x - intersection_free_points[0][-1]) < 0.001 and abs(y-intersection_free_points[1][-1]) < 0.001):
-                intersection_free_points[0].append(x)
-                intersection_free_points[1].append(y)
-        else :
-            intersection_free_points[0].append(x)
-            intersection_free_points[1].append(y)
-
-    #newPoly = Polygon(zip(checkPoly.x_list, checkPoly.y_list))
-    try :
-        newPoly = Polygon(zip(intersection_free_points[0], intersection_free_points[1]))
-        newPoly = newPoly.difference(game_state.world_poly.buffer(0))
-    except:
-        return 0
-
-    world = game_state.world_poly
+    coverage_map = game_state.coverage_map
+    new_area = coverage_map.new_coverage(x, y, rotation, camera_field_of_view, obstacles)
 
     show_animation = False
-
     if show_animation:
-        plt.cla()
-        plt.plot(x, y, "or")
-        # plt.plot(gx, gy, "ob")
-        # poly.plot("-r")
-
-        if world.geom_type == 'MultiPolygon':
-            for i in range(len(world)):
-                pts = world[i].exterior.coords
-                plt.fill([p[0] for p in pts], [p[1] for p in pts], "-b")
-        else:
-            pts = world.exterior.coords
-            plt.fill([p[0] for p in pts], [p[1] for p in pts], "-b")
-
-        if newPoly.geom_type == 'MultiPolygon':
-            for i in range(len(newPoly)):
-                pts = newPoly[i].exterior.coords
-                plt.fill([p[0] for p in pts], [p[1] for p in pts], "-g")
-        else:
-            pts = newPoly.exterior.coords
-            plt.fill([p[0] for p in pts], [p[1] for p in pts], "-g")
-
-        #for i in range(len(obstacles)):
-        #    obstacles[i].plot("-k")
-        for obstacle in obstacles:
-            obstacle.plot("-g")
-
-        plt.axis("equal")
-        plt.pause(1)
-
-    return newPoly.area
+        plot_coverage(x, y, coverage_map, coverage_map.visible_mask(x, y, rotation, camera_field_of_view))
+
+    return new_area
+
+def plot_coverage(x, y, coverage_map, new_view=None):
+    image = np.zeros(coverage_map.seen.shape + (3,))
+    image[coverage_map.seen, 2] = 1
+    if new_view is not None:
+        image[new_view & ~coverage_map.seen, 1] = 1
+    image[coverage_map.occupancy] = 0.5
+    extent = [-coverage_map.half_size, coverage_map.half_size, -coverage_map.half_size, coverage_map.half_size]
+    plt.cla()
+    plt.imshow(image, origin="lower", extent=extent)
+    plt.plot(x, y, "or")
+    plt.axis("equal")
+    plt.pause(1)
 
 def get_point_between_points(p1, p2, radius):
 
@@ -793,6 +730,51 @@ def get_visible_points_v1(x,y,direction,camera_field_of_view,radius):
 
     return visible_points
 '''
+def random_box_obstacles(n, seed=0):
+    '''
+    n axis-aligned boxes inside the room, with the x_list / y_list outline
+    of the scene obstacles, for the benchmarks
+    '''
+    from types import SimpleNamespace
+    rng = np.random.RandomState(seed)
+    obstacles = []
+    for _ in range(n):
+        cx, cy = rng.uniform(-4.5, 4.5, 2)
+        w, h = rng.uniform(0.2, 1.0, 2)
+        obstacles.append(SimpleNamespace(x_list=[cx-w, cx+w, cx+w, cx-w, cx-w], y_list=[cy-h, cy-h, cy+h, cy+h, cy-h]))
+    return obstacles
+
+def benchmark_visibility(n_obstacles=15, n_headings=8, camera_field_of_view=42.5, seed=0):
+    '''
+    Line of sight checks for one exploration sweep over a random box scene,
+    per cell with castRay and batched with rays_blocked
+    '''
+    obstacles = random_box_obstacles(n_obstacles, seed)
+    edges = obstacle_edges(obstacles)
+
+    graph_x, graph_z = 0.5, 0.5
+    i, j = np.mgrid[int(xMin):int(xMax), int(zMin):int(zMax)]
+    i, j = i.ravel(), j.ravel()
+    angles = np.degrees(np.arctan2(i - graph_x, j - graph_z))
+    sweep = []
+    for heading in np.arange(n_headings) * 360 / n_headings:
+        in_fov = np.abs((angles - heading + 180) % 360 - 180) <= camera_field_of_view / 2
+        sweep.append((i[in_fov], j[in_fov]))
+    n_rays = sum(len(cells[0]) for cells in sweep)
+
+    start_time = time.time()
+    loop_visible = [np.array([castRay(graph_x, graph_z, ci, cj, obstacles) for ci, cj in zip(*cells)]) for cells in sweep]
+    loop_time = time.time() - start_time
+
+    start_time = time.time()
+    batch_visible = [~rays_blocked(graph_x, graph_z, ci, cj, edges) for ci, cj in sweep]
+    batch_time = time.time() - start_time
+
+    assert all(np.array_equal(a, b) for a, b in zip(loop_visible, batch_visible))
+    print ("{} rays against {} edges".format(n_rays, len(edges)))
+    print ("castRay per cell: {:.3f}s, rays_blocked: {:.3f}s".format(loop_time, batch_time))
+
+
 if __name__ == '__main__': 
     #q = flood_fill(0,0,check_validity)
     #print (len(q))
@@ -827,3 +809,4 @@ if __name__ == '__main__':
     print ("new point", new_pt )
     print ("processing time = ", end_time-start_time)
 
+    benchmark_visibility()
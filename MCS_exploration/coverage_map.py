@@ -0,0 +1,134 @@
+'''
+Floor coverage as a fixed resolution bitmap.
+
+The area seen so far is a bool raster over the room instead of a union of
+FoV polygons, so its cost does not grow with the length of the
+exploration. Views are rasterized by marching rays through an occupancy
+raster of the obstacles (a simple shadow cast): every cell up to the
+first occupied one along a ray is visible. Coverage queries are then
+popcounts over masks.
+'''
+import math
+import cv2
+import numpy as np
+
+import constants
+
+ROOM_HALF_SIZE = 5.0
+
+
+class CoverageMap:
+
+    def __init__(self, half_size=ROOM_HALF_SIZE, resolution=constants.AGENT_STEP_SIZE):
+        self.half_size = half_size
+        self.resolution = resolution
+        self.size = int(round(2 * half_size / resolution))
+        self.seen = np.zeros((self.size, self.size), dtype=bool)
+        self.occupancy = np.zeros((self.size, self.size), dtype=bool)
+        self._obstacles = []
+
+    def reset(self):
+        self.seen[:] = False
+        self.occupancy[:] = False
+        self._obstacles = []
+
+    @property
+    def cell_area(self):
+        return self.resolution ** 2
+
+    @property
+    def max_range(self):
+        return 2 * math.sqrt(2) * self.half_size
+
+    @property
+    def area(self):
+        '''
+        Seen floor area in m^2, in place of world_poly.area
+        '''
+        return np.count_nonzero(self.seen) * self.cell_area
+
+    @property
+    def free_area(self):
+        '''
+        Floor area in m^2 not covered by the known obstacles, the most that
+        can ever be seen
+        '''
+        return np.count_nonzero(~self.occupancy) * self.cell_area
+
+    def to_cell(self, x, y):
+        '''
+        (row, col) of the cell containing world (x, z)
+        '''
+        col = np.floor((np.asarray(x) + self.half_size) / self.resolution).astype(int)
+        row = np.floor((np.asarray(y) + self.half_size) / self.resolution).astype(int)
+        return row, col
+
+    def set_obstacles(self, obstacles):
+        '''
+        Rasterizes polygons with x_list / y_list in world coordinates. Skipped
+        if the obstacles are the same objects as last time.
+        '''
+        obstacles = list(obstacles)
+        if len(obstacles) == len(self._obstacles) and all(a is b for a, b in zip(obstacles, self._obstacles)):
+            return
+        self._obstacles = obstacles
+        self.occupancy[:] = False
+        canvas = np.zeros((self.size, self.size), dtype=np.uint8)
+        for obs in obstacles:
+            pts = np.stack([
+                (np.asarray(obs.x_list, dtype=float) + self.half_size) / self.resolution,
+                (np.asarray(obs.y_list, dtype=float) + self.half_size) / self.resolution
+            ], axis=1)
+            cv2.fillPoly(canvas, [np.round(pts - 0.5).astype(np.int32)], 1)
+        self.occupancy |= canvas.astype(bool)
+
+    def ray_angles(self, rotation, camera_field_of_view, max_range):
+        fov = math.radians(min(camera_field_of_view, 360))
+        n_rays = max(2, int(math.ceil(fov * max_range / self.resolution)))
+        if camera_field_of_view >= 360:
+            return np.linspace(0, 2 * math.pi, n_rays, endpoint=False)
+        return math.radians(rotation) + np.linspace(-fov / 2, fov / 2, n_rays)
+
+    def cast(self, x, y, angles, max_range):
+        '''
+        Marches rays at `angles` from (x, y), which may be arrays broadcasting
+        against `angles`. Returns the flat index of the cell under every
+        sample (-1 outside the room), which samples are visible and which is
+        the first blocked sample of each ray.
+        '''
+        dists = np.arange(0, max_range, self.resolution / 2)
+        angles = np.asarray(angles)[..., None]
+        rows, cols = self.to_cell(np.asarray(x)[..., None] + np.sin(angles) * dists,
+                                  np.asarray(y)[..., None] + np.cos(angles) * dists)
+        inside = (rows >= 0) & (rows < self.size) & (cols >= 0) & (cols < self.size)
+        cells = np.where(inside, rows * self.size + cols, -1)
+        blocked = ~inside
+        blocked[inside] = self.occupancy.ravel()[cells[inside]]
+        # Everything behind the first occupied sample of a ray is in its shadow
+        visible = ~np.logical_or.accumulate(blocked, axis=-1)
+        return cells, visible, np.argmax(blocked, axis=-1)
+
+    def visible_mask(self, x, y, rotation, camera_field_of_view, obstacles=None, max_range=None):
+        '''
+        Cells visible from world (x, z) looking along `rotation` (degrees, 0 along +z,
+        clockwise towards +x) with a horizontal FoV of `camera_field_of_view` degrees
+        '''
+        if obstacles is not None:
+            self.set_obstacles(obstacles)
+        if max_range is None:
+            max_range = self.max_range
+
+        cells, visible, _ = self.cast(x, y, self.ray_angles(rotation, camera_field_of_view, max_range), max_range)
+        mask = np.zeros_like(self.seen)
+        mask.ravel()[cells[visible]] = True
+        return mask
+
+    def update(self, x, y, rotation, camera_field_of_view, obstacles=None):
+        self.seen |= self.visible_mask(x, y, rotation, camera_field_of_view, obstacles)
+
+    def new_coverage(self, x, y, rotation, camera_field_of_view, obstacles=None):
+        '''
+        Unseen area in m^2 that a view from (x, z) would add
+        '''
+        mask = self.visible_mask(x, y, rotation, camera_field_of_view, obstacles)
+        return np.count_nonzero(mask & ~self.seen) * self.cell_area
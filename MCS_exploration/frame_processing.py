@@ -1,4 +1,5 @@
 import numpy as np
+import cv2
 from scipy.spatial.transform import Rotation
 #from MCS_exploration.obstacle import Obstacle
 
@@ -173,6 +174,48 @@ def occupancy_to_polygons(occupancy, scale, displacement):
         polygons.append(box(i*scale-d, minX*scale-d, (i+1)*scale-d, maxX*scale-d))
     return unary_union(polygons)
 
+def bitmap_to_polygons(bits, origin, scale, displacement, upsample=4):
+    '''
+    Same outline as occupancy_to_polygons for a bool grid whose cell [0, 0]
+    is at grid index `origin`, from a single contour trace instead of a box
+    per run. The grid is upsampled so that the traced pixel centres snap
+    back to cell corners.
+    '''
+    k = upsample
+    bits = np.pad(np.asarray(bits, dtype=bool), 1)
+    up = np.kron(bits.astype(np.uint8), np.ones((k, k), dtype=np.uint8))
+
+    # cells touching only at a corner would be traced as one ring, cut them apart
+    c, u, l, ul = bits[1:, 1:], bits[:-1, 1:], bits[1:, :-1], bits[:-1, :-1]
+    rows, cols = np.nonzero((c & ul & ~u & ~l) | (u & l & ~c & ~ul))
+    rows, cols = (rows + 1) * k, (cols + 1) * k
+    for dr, dc in ((-1, -1), (-1, 0), (0, -1), (0, 0)):
+        up[rows + dr, cols + dc] = 0
+
+    contours, hierarchy = cv2.findContours(up, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)[-2:]
+    if hierarchy is None:
+        return MultiPolygon()
+
+    def ring(contour):
+        # contour points are (col, row) pixels of the padded, upsampled grid
+        cells = np.round((contour[:, 0, ::-1] + 0.5) / k) - 1 + np.asarray(origin)
+        return cells * scale - displacement
+
+    polygons = []
+    hierarchy = hierarchy[0]
+    for i, contour in enumerate(contours):
+        if hierarchy[i][3] != -1:
+            continue
+        holes = []
+        child = hierarchy[i][2]
+        while child != -1:
+            holes.append(ring(contours[child]))
+            child = hierarchy[child][0]
+        polygon = Polygon(ring(contour), holes)
+        # snapping can make a ring touch itself at a corner
+        polygons.append(polygon if polygon.is_valid else polygon.buffer(0))
+    return unary_union(polygons)
+
 def get_max_height(points):
     return np.max(points[:,1])
 
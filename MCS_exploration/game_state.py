@@ -11,13 +11,13 @@ from machine_common_sense import StepMetadata
 from machine_common_sense import ObjectMetadata
 from machine_common_sense import Util
 from cover_floor import *
-import shapely.geometry.polygon as sp
+from coverage_map import CoverageMap
 from MCS_exploration.navigation.visibility_road_map import ObstaclePolygon,IncrementalVisibilityRoadMap
 from MCS_exploration.frame_processing import *
 from shapely.geometry import Point, MultiPoint
 from MCS_exploration.obstacle import Obstacle
 import copy
-from vision.instSeg.inference import MaskAndClassPredictor
+from vision import model_registry
 from vision.instSeg.data.config_mcsVideo3_inter import MCSVIDEO_INTER_CLASSES_BG, MCSVIDEO_INTER_CLASSES_FG
 
 TROPHY_INDEX = MCSVIDEO_INTER_CLASSES_FG.index('trophy') + 1
@@ -91,7 +91,7 @@ class GameState(object):
         self.add_obstacle_func_eval3 = None
         self.goals_found = False
         self.goals = []
-        self.world_poly = None
+        self.coverage_map = CoverageMap()
         self.new_found_objects = []
         self.new_object_found = False
         self.goal_in_hand = False
@@ -131,9 +131,9 @@ class GameState(object):
         self.img_seg_occupancy_map_points = {}
         self.current_frame_img_obstacles = []
         self.img_channels = None
-        self.mask_predictor = MaskAndClassPredictor(dataset='mcsvideo3_inter',
-                                                   config='plus_resnet50_config_depth_MC',
-                                                   weights='./vision/instSeg/dvis_resnet50_mc.pth')
+        self.mask_predictor = model_registry.get_mask_predictor(dataset='mcsvideo3_inter',
+                                                                config='plus_resnet50_config_depth_MC',
+                                                                weights='./vision/instSeg/dvis_resnet50_mc.pth')
 
     def occupancy_map_init(self):
         #rows = int(self.map_width//self.grid_size)
@@ -178,8 +178,7 @@ class GameState(object):
 
         else:
             # Do full reset
-            #self.world_poly = fov.FieldOfView([0, 0, 0], 0, [])
-            self.world_poly = sp.Polygon()
+            self.coverage_map.reset()
             self.scene_name = scene_name
             self.number_actions = 0
             self.id_goal_in_hand = None
@@ -527,7 +526,7 @@ class GameState(object):
     
                         #print ("in contains making a separate object ")
                         #print ("occupancy map size b4", len(curr_frame_obstacle.get_occupancy_map_points()))
-                        curr_frame_obstacle.expand_obstacle(obstacle.get_occupancy_map_points(),self.occupancy_map.shape,self.grid_size,self.displacement)
+                        curr_frame_obstacle.expand_obstacle(obstacle.occupancy,self.occupancy_map.shape,self.grid_size,self.displacement)
                         curr_frame_obstacle.id = self.objs
                         self.global_obstacles.append(copy.deepcopy(curr_frame_obstacle))
                         #print ("occupancy map after b4", len(curr_frame_obstacle.get_occupancy_map_points()))
@@ -557,7 +556,7 @@ class GameState(object):
                 intersect_area = curr_frame_obstacle.get_bounding_box().intersection(obstacle.get_bounding_box()).area
                 height_ratio = abs(curr_frame_obstacle.height-obstacle.height ) / (max(obstacle.height,curr_frame_obstacle.height))
                 if (intersect_area > 0.00001 and height_ratio < 0.7) or containment:
-                    self.global_obstacles[i].expand_obstacle(curr_frame_obstacle.get_occupancy_map_points(),self.occupancy_map.shape,self.grid_size,self.displacement)
+                    self.global_obstacles[i].expand_obstacle(curr_frame_obstacle.occupancy,self.occupancy_map.shape,self.grid_size,self.displacement)
                     self.global_obstacles[i].current_frame_id = curr_frame_obstacle.current_frame_id
                     self.global_obstacles[i].is_goal =  curr_frame_obstacle.is_goal or self.global_obstacles[i].is_goal
                     self.global_obstacles[i].set_height(max(self.global_obstacles[i].height,curr_frame_obstacle.height))
@@ -593,7 +592,7 @@ class GameState(object):
                 intersect_area = obstacle1.get_bounding_box().intersection(obstacle2.get_bounding_box()).area
                 height_ratio = abs(obstacle1.height-obstacle2.height ) / (max(obstacle1.height,obstacle2.height))
                 if intersect_area > 0.00001 and height_ratio < 0.7:
-                    obstacle1.expand_obstacle(obstacle2.get_occupancy_map_points(),self.occupancy_map.shape,self.grid_size,self.displacement)
+                    obstacle1.expand_obstacle(obstacle2.occupancy,self.occupancy_map.shape,self.grid_size,self.displacement)
                     obstacle1.set_height(max(obstacle1.height,obstacle2.height))
                     if len(obstacle2.trophy_prob_per_frame) != 0 : 
                         for trophy_prob in obstacle2.trophy_prob_per_frame :
@@ -652,7 +651,7 @@ class GameState(object):
                 #    print ("intersect area,height_ratio ", intersect_area,height_ratio)
                 
                 if (intersect_area > 0.00001 and height_ratio < 0.7) or containment == True:
-                    obstacle1.expand_obstacle(obstacle2.get_occupancy_map_points(),self.occupancy_map.shape,self.grid_size,self.displacement)
+                    obstacle1.expand_obstacle(obstacle2.occupancy,self.occupancy_map.shape,self.grid_size,self.displacement)
                     obstacle1.set_height(max(obstacle1.height,obstacle2.height))
                     obstacle1.is_goal = obstacle1.is_goal or obstacle2.is_goal
                     obstacle1.is_contained = obstacle1.is_contained or obstacle2.is_contained
@@ -993,7 +992,7 @@ class GameState(object):
                 if intersect_area > 0.00001 and height_ratio < 0.7:
                 #print ("Intersection area : ", intersect_area)
                 #if intersect_area > 0.00001 :
-                    self.global_obstacles[i].expand_obstacle(curr_frame_obstacle.get_occupancy_map_points(),self.occupancy_map.shape,self.grid_size,self.displacement)
+                    self.global_obstacles[i].expand_obstacle(curr_frame_obstacle.occupancy,self.occupancy_map.shape,self.grid_size,self.displacement)
                     self.global_obstacles[i].current_frame_id = curr_frame_obstacle.current_frame_id
                     #self.global_obstacles[i].is_goal =  curr_frame_obstacle.is_goal
                     self.global_obstacles[i].set_height(max(self.global_obstacles[i].height,curr_frame_obstacle.height))
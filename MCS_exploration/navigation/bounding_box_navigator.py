@@ -13,6 +13,7 @@ from descartes import PolygonPatch
 import constants
 
 SHOW_ANIMATION = False
+LOG_PLANNING_TIME = False
 LIMIT_STEPS = 350
 
 class BoundingBoxNavigator:
@@ -31,6 +32,7 @@ class BoundingBoxNavigator:
 		self.radius = robot_radius
 		self.maxStep = maxStep
 		self.current_nav_steps = 0
+		self.planning_times = []
 
 	
 
@@ -204,6 +206,7 @@ class BoundingBoxNavigator:
 		# create initial plan
 		roadmap = DiscreteActionPlanner(self.radius*1.1, self.scene_obstacles_dict.values(), self.epsilon)
 		plan = []
+		self.planning_times = []
 
 		while True:
 			start_time = time.time()
@@ -213,8 +216,8 @@ class BoundingBoxNavigator:
 			if dis_to_goal < self.epsilon:
 				break
 			
-			#refresh obstacle map
-			roadmap.resetObstacles(self.scene_obstacles_dict.values())
+			#refresh obstacle map, only the obstacles that changed since the last step need checking
+			added, removed = roadmap.resetObstacles(self.scene_obstacles_dict.values())
 
 			
 			#check if agent is stuck given the new map
@@ -236,8 +239,12 @@ class BoundingBoxNavigator:
 				executeUnstick = False
 				collision = False
 
-			#check if the plan is still valid / exists and replan if not
-			if not roadmap.validPlan(plan, (self.agentX, self.agentY)):
+			#check if the plan is still valid / exists and replan if not. Removed obstacles
+			#can't block it and added ones only the segments near them. The planner keeps
+			#its search tree minus the branches the new obstacles block, so replanning
+			#repairs the plan from there rather than starting over
+			replanned = not roadmap.validPlan(plan, (self.agentX, self.agentY), added)
+			if replanned:
 				
 
 				plan_x, plan_y = roadmap.planning(self.agentX, self.agentY, gx, gy, returnNearest=True)
@@ -249,6 +256,12 @@ class BoundingBoxNavigator:
 				if len(plan) == 0:
 					return 
 
+			planning_time = time.time() - start_time
+			self.planning_times.append(planning_time)
+			if LOG_PLANNING_TIME:
+				print("nav step {}: planning {:.4f}s{}, {} obstacles added, {} removed".format(
+					len(self.planning_times), planning_time, " (replanned)" if replanned else "", len(added), len(removed)))
+
 			#take action if the plan provides one
 			if len(plan) > 0:
 				x,y = plan.pop(0)
@@ -1,8 +1,9 @@
 import math
+import cv2
+import numpy as np
 import shapely.geometry as sp
-from shapely.prepared import prep
 from shapely.ops import unary_union, nearest_points
-from heapq import heappush, heappop
+from heapq import heappush, heappop, heapify
 from shapely import speedups
 if speedups.available:
     speedups.enable()
@@ -23,12 +24,12 @@ class Node(object):
 
     def __hash__(self):
         #hash up to 4 decimals
-        return hash( (int(round(self.x*20)), int(round(self.y*20)) ) )
+        return hash( latticeKey(self.x, self.y) )
 
     def __eq__(self, other):
         #fuzzy notion of equality based on hash
         return self.__hash__() == other.__hash__()
-        
+
     def __ne__(self, other):
         return not self.__eq__(other)
 
@@ -38,31 +39,344 @@ class Node(object):
     def __str__(self):
         return "Node({:.3f}, {:.3f}, {:.3f}, {:.3f}, {:.3f})".format(self.x, self.y, self.h, self.g, self.f)
 
-class DiscreteActionPlanner:
 
-    def __init__(self, robot_radius, obstacles, eps=0.2, step=0.1, turn=10):
+def obstacleKey(obstacle):
+    # outline rounded to the millimetre, counter-clockwise from its lowest
+    # vertex so that a rebuilt polygon gets the same key wherever its ring starts
+    ring = np.round(np.asarray(obstacle.exterior.coords)[:-1, :2], 3)
+    if len(ring) == 0:
+        return ()
+    x, y = ring[:, 0], ring[:, 1]
+    if np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y) < 0:
+        ring = ring[::-1]
+    start = np.lexsort((ring[:, 0], ring[:, 1]))[0]
+    return tuple(np.roll(ring, -start, axis=0).ravel().tolist())
+
+
+def latticeKey(x, y):
+    # nodes closer than 0.05 are the same search node
+    return (int(round(x*20)), int(round(y*20)))
+
+
+# furthest apart two points with the same lattice key can be
+LATTICE_SHIFT = math.sqrt(2) / 20
+
+
+class ClearanceMap:
+    '''
+    Distance from every cell of a raster to the nearest obstacle boundary,
+    so that a capsule check is a lookup along its segment. The raster covers
+    the obstacles plus `margin`, anything outside it is further than that.
+    '''
+
+    def __init__(self, obstacles, resolution=0.02, margin=1.0):
+        self.resolution = resolution
+        self.margin = margin
+        lines = []
+        for o in obstacles:
+            boundary = o.boundary
+            lines.extend(np.asarray(line.coords)[:, :2] for line in getattr(boundary, 'geoms', [boundary]))
+        lines = [l for l in lines if len(l) > 0]
+
+        if len(lines) == 0:
+            self.clearance = None
+            return
+
+        points = np.concatenate(lines)
+        # on the resolution grid, so that obstacles rasterize the same whatever the extent
+        self.origin = np.floor((points.min(axis=0) - margin) / resolution) * resolution
+        size = np.ceil((points.max(axis=0) + margin - self.origin) / resolution).astype(int) + 1
+        canvas = np.full((size[1], size[0]), 255, dtype=np.uint8)
+        # 4 bits of sub-pixel precision for the line end points
+        cv2.polylines(canvas, [np.round((l - self.origin) / resolution * 16).astype(np.int32) for l in lines],
+                      False, 0, 1, cv2.LINE_8, 4)
+        self.clearance = cv2.distanceTransform(canvas, cv2.DIST_L2, cv2.DIST_MASK_PRECISE) * resolution
+
+    def lookup(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        if self.clearance is None:
+            return np.full(x.shape, np.inf)
+        col = np.round((x - self.origin[0]) / self.resolution).astype(int)
+        row = np.round((y - self.origin[1]) / self.resolution).astype(int)
+        inside = (row >= 0) & (row < self.clearance.shape[0]) & (col >= 0) & (col < self.clearance.shape[1])
+        dist = np.full(x.shape, np.inf)
+        dist[inside] = self.clearance[row[inside], col[inside]]
+        return dist
+
+    def segmentsClear(self, x1, y1, x2, y2, radius):
+        '''
+        Whether the segments (x1, y1)-(x2, y2), arrays that broadcast, stay
+        further than `radius` from every boundary
+        '''
+        x1, y1, x2, y2 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (x1, y1, x2, y2)))
+        if self.clearance is None:
+            return np.ones(x1.shape, dtype=bool)
+        # samples at most a cell apart, the same for a segment whichever batch it is in
+        n = np.maximum(np.ceil(np.hypot(x2 - x1, y2 - y1) / self.resolution), 1)
+        t = np.minimum(np.arange(int(n.max()) + 1 if n.size else 1) / n[..., None], 1)
+        xs = x1[..., None] + (x2 - x1)[..., None] * t
+        ys = y1[..., None] + (y2 - y1)[..., None] * t
+        return self.lookup(xs, ys).min(axis=-1) > radius
+
+
+class DiscreteActionPlanner:
+    '''
+    Plans over the lattice of positions reached by steps of `step` in
+    `turn` degree increments. Edges are checked against a ClearanceMap that
+    is rasterized once per set of obstacles.
+
+    planning searches backwards from the goal region. The tree is kept while
+    the goal and obstacles stay the same, so the next call from a point the
+    agent moved to usually finishes at once. New obstacles only prune the
+    branches they block. If the start cannot be reached, a forward search
+    returns the path to the nearest reachable point when returnNearest is set.
+    '''
+
+    def __init__(self, robot_radius, obstacles, eps=0.2, step=0.1, turn=10, resolution=0.02):
         self.robot_radius = robot_radius
-        self.obstacles = (unary_union([o.boundary for o in obstacles]))
         self.eps = eps
         self.step = step
         self.turn = turn
+        self.resolution = resolution
         self.offsets = [ (math.sin(a)*self.step, math.cos(a)*self.step) for a in [self.turn*x/180.0*math.pi for x in range(0,360//self.turn)]]
+        self.offset_xy = np.array(self.offsets)
         self.existing_plan = []
-        
+        self.tree = None
+        self.expansions = 0
+        self.resetObstacles(obstacles)
+
+    @property
+    def obstacles(self):
+        # only needed for the nearest point queries
+        if self._obstacles is None:
+            if self.obstacle_list:
+                self._obstacles = unary_union([o.boundary for o in self.obstacle_list])
+            else:
+                self._obstacles = sp.MultiPolygon()
+        return self._obstacles
 
     def addObstacle(self, obstacle):
-        self.obstacles = (self.obstacles.union(obstacle.boundary))
-        
+        self.resetObstacles(self.obstacle_list + [obstacle])
+
     def resetObstacles(self, obstacles=None):
-        if obstacles:
-            self.obstacles = unary_union([o.boundary for o in obstacles])
-        else:
-            self.obstacles = MultiPolygon()
+        '''
+        Replaces the obstacles and returns the ones that were added and
+        removed. Obstacles are compared by their outline, since the
+        navigator rebuilds its obstacle polygons every step. An obstacle
+        that grew over old ones is returned as added, by its new part only.
+        '''
+        obstacles = list(obstacles) if obstacles else []
+        keys = [obstacleKey(o) for o in obstacles]
+        old = getattr(self, 'obstacle_keys', None)
+        old_keys = set(old) if old is not None else set()
+        added = [o for o, k in zip(obstacles, keys) if k not in old_keys]
+        removed = [o for k, o in (old or {}).items() if k not in set(keys)]
+        if old is not None and len(added) == 0 and len(removed) == 0:
+            return added, removed
+
+        # outlines are only kept to the millimetre
+        for i, o in enumerate(added):
+            covered = o.buffer(1e-3)
+            inside = [r for r in removed if covered.covers(r)]
+            if inside:
+                removed = [r for r in removed if not any(r is c for c in inside)]
+                added[i] = o.difference(unary_union(inside))
+        added = [o for o in added if not o.is_empty]
+
+        self.obstacle_list = obstacles
+        self.obstacle_keys = dict(zip(keys, obstacles))
+        self._obstacles = None
+        self.clearance = ClearanceMap(obstacles, self.resolution, self.robot_radius + self.step + 2*self.resolution)
+
+        # the tree survives obstacles being added but not removed
+        if self.tree is not None:
+            if len(removed) == 0:
+                self.pruneTree(added)
+            else:
+                self.tree = None
+        return added, removed
+
+    def validEdges(self, x1, y1, x2, y2):
+        # half a cell of slack for the raster, whose distances can be a few mm long
+        return self.clearance.segmentsClear(x1, y1, x2, y2, self.robot_radius + self.resolution / 2)
+
+    def validEdge(self, p1, p2):
+        return bool(self.validEdges(p1[0], p1[1], p2[0], p2[1]))
 
     def planning(self, start_x, start_y, goal_x, goal_y, returnNearest=False, max_exp = 5000):
-        #get optimized polygon to make comparisons quicker
-        poly = prep(self.obstacles)
+        path = self.searchBackward(start_x, start_y, goal_x, goal_y, max_exp)
+        if path is not None:
+            return [p[0] for p in path], [p[1] for p in path]
+        return self.searchForward(start_x, start_y, goal_x, goal_y, returnNearest, max_exp)
+
+    def resetTree(self, goal_x, goal_y):
+        '''
+        Roots the backward search at the free lattice points within eps of the
+        goal, less the shift a path can get when it is moved onto the start
+        '''
+        self.tree = {
+            "goal": (goal_x, goal_y, self.eps),
+            "pos": {},
+            "g": {},
+            "parent": {},
+            "open": set(),
+            "closed": set()
+        }
+        n = int(math.ceil(self.eps*20))
+        gk = latticeKey(goal_x, goal_y)
+        kx, ky = np.meshgrid(np.arange(gk[0]-n, gk[0]+n+1), np.arange(gk[1]-n, gk[1]+n+1))
+        xs, ys = np.append(kx.ravel() / 20.0, goal_x), np.append(ky.ravel() / 20.0, goal_y)
+        roots = (np.hypot(xs - goal_x, ys - goal_y) <= max(self.eps - LATTICE_SHIFT, 0)) & \
+            (self.clearance.lookup(xs, ys) > self.robot_radius + self.resolution / 2)
+        for x, y in zip(xs[roots], ys[roots]):
+            key = latticeKey(x, y)
+            self.tree["pos"][key] = (x, y)
+            self.tree["g"][key] = 0.0
+            self.tree["parent"][key] = None
+            self.tree["open"].add(key)
+
+    def pruneTree(self, changed=None):
+        '''
+        Drops the tree nodes whose edge to their parent is now blocked, with
+        everything below them, and reopens the nodes next to them. With a list
+        of `changed` obstacles only the edges near them are checked.
+        '''
+        tree = self.tree
+        keys = list(tree["pos"])
+        if len(keys) == 0:
+            return
+        xy = np.array([tree["pos"][k] for k in keys])
+        parent_xy = np.array([tree["pos"][tree["parent"][k]] if tree["parent"][k] is not None else tree["pos"][k] for k in keys])
+        check = np.ones(len(keys), dtype=bool)
+        if changed is not None:
+            check[:] = False
+            lo, hi = np.minimum(xy, parent_xy) - self.robot_radius, np.maximum(xy, parent_xy) + self.robot_radius
+            for o in changed:
+                min_x, min_y, max_x, max_y = o.bounds
+                check |= (lo[:, 0] <= max_x) & (hi[:, 0] >= min_x) & (lo[:, 1] <= max_y) & (hi[:, 1] >= min_y)
+        idx = np.flatnonzero(check)
+        valid = self.validEdges(xy[idx, 0], xy[idx, 1], parent_xy[idx, 0], parent_xy[idx, 1])
+        blocked = [keys[i] for i in idx[~valid]]
+        if len(blocked) == 0:
+            return
+
+        children = {}
+        for key, parent in tree["parent"].items():
+            if parent is not None:
+                children.setdefault(parent, []).append(key)
+        pruned = set(blocked)
+        stack = list(blocked)
+        while stack:
+            for child in children.get(stack.pop(), []):
+                if child not in pruned:
+                    pruned.add(child)
+                    stack.append(child)
+        for key in pruned:
+            for d in ("pos", "g", "parent"):
+                del tree[d][key]
+            tree["open"].discard(key)
+            tree["closed"].discard(key)
+
+        # closed nodes that had a pruned node among their successors expand again
+        n = int(math.ceil(self.step*20)) + 1
+        for kx, ky in pruned:
+            for i in range(-n, n+1):
+                for j in range(-n, n+1):
+                    key = (kx+i, ky+j)
+                    if key in tree["closed"]:
+                        tree["closed"].discard(key)
+                        tree["open"].add(key)
+
+    def searchBackward(self, start_x, start_y, goal_x, goal_y, max_exp):
+        '''
+        Grows the tree from the goal region until it closes a successor of the
+        start. Returns the waypoints after the start, or None if the start
+        was not reached within max_exp expansions.
+        '''
+        if self.tree is None or self.tree["goal"] != (goal_x, goal_y, self.eps):
+            self.resetTree(goal_x, goal_y)
+        tree = self.tree
+        pos, g, parent, closed = tree["pos"], tree["g"], tree["parent"], tree["closed"]
+
+        def heuristic(key):
+            x, y = pos[key]
+            return math.sqrt( (x - start_x)**2 + (y - start_y)**2)
+
+        # the start joins the tree through its own successors, so that the first
+        # waypoint is one step of one of the discrete headings away
+        first = np.array([start_x, start_y]) + self.offset_xy
+        first_ok = self.validEdges(start_x, start_y, first[:, 0], first[:, 1])
+        entry = {}
+        for j, key in enumerate(map(tuple, np.round(first*20).astype(int).tolist())):
+            if first_ok[j]:
+                entry.setdefault(key, j)
+
+        def stitch(key):
+            # the tree path from key, shifted onto the start's successor that
+            # shares its lattice cell, so every waypoint is a discrete step
+            # from the one before. None if the shifted path is blocked or
+            # ends outside eps of the goal.
+            delta = first[entry[key]] - pos[key]
+            path = [first[entry[key]]]
+            while math.sqrt( (path[-1][0] - goal_x)**2 + (path[-1][1] - goal_y)**2) > self.eps:
+                key = parent[key]
+                if key is None:
+                    return None
+                path.append(np.asarray(pos[key]) + delta)
+            tp = np.array([(start_x, start_y)] + path)
+            if not self.validEdges(tp[:-1, 0], tp[:-1, 1], tp[1:, 0], tp[1:, 1]).all():
+                return None
+            return [tuple(p) for p in tp[1:]]
+
+        def connect(keys):
+            for key in sorted((k for k in keys if k in entry), key=lambda k: g[k]):
+                path = stitch(key)
+                if path is not None:
+                    return path
+            return None
+
+        end = connect(closed.intersection(entry))
+        untried = set(entry) - closed
+
+        # the heuristic changes with the start, so the open list is re-keyed
+        openList = [ ((1.01)*heuristic(k)+g[k], k) for k in tree["open"] ]
+        heapify(openList)
+
+        i = 0
+        while end is None and openList and i < max_exp:
+            _, curr = heappop(openList)
+            tree["open"].remove(curr)
+            closed.add(curr)
+            i += 1
 
+            end = connect([curr])
+            if end is not None:
+                break
+            untried.discard(curr)
+            if not untried:
+                # every successor of the start is in the tree and none connects
+                break
+
+            x, y = pos[curr]
+            succ = np.array([x, y]) + self.offset_xy
+            new = [(j, tuple(k)) for j, k in enumerate(np.round(succ*20).astype(int).tolist())]
+            new = [(j, k) for j, k in new if k not in pos]
+            if len(new) == 0:
+                continue
+            idx = [j for j, _ in new]
+            valid = self.validEdges(x, y, succ[idx, 0], succ[idx, 1])
+            for (j, key), ok in zip(new, valid):
+                if ok and key not in pos:
+                    pos[key] = (succ[j, 0], succ[j, 1])
+                    g[key] = g[curr] + self.step
+                    parent[key] = curr
+                    tree["open"].add(key)
+                    heappush(openList, ((1.01)*heuristic(key)+g[key], key))
+
+        self.expansions = i
+        return end
+
+    def searchForward(self, start_x, start_y, goal_x, goal_y, returnNearest=False, max_exp = 5000):
         #use a max heap for the open set ordered by heuristic
         openList = [  Node(start_x, start_y, self.heurstic(start_x, start_y, goal_x, goal_y), 0, None) ]
 
@@ -85,14 +399,15 @@ class DiscreteActionPlanner:
                 nearest = curr
 
             i += 1
-            
+
 
             # add any successors that arent already in the open/closed set
-            for s in filter( lambda s: self.validEdge( (curr.x, curr.y), (s.x, s.y), poly, self.robot_radius),  filter(lambda x: x not in openSet and x not in closedSet, self.successors(curr, goal))): #filter(lambda x: x not in openSet and x not in closedSet, self.validSuccessors(curr, goal, poly)):
-                heappush(openList, s)
-                openSet.add(s)
+            for s in self.validSuccessors(curr, goal, lambda x: x not in openSet and x not in closedSet):
+                if s not in openSet:
+                    heappush(openList, s)
+                    openSet.add(s)
             #print(len(openSet), i, i*36)
-            
+
         if openList and openList[0].h <= self.eps:
             path = [openList[0]]
         else:
@@ -104,38 +419,47 @@ class DiscreteActionPlanner:
         while path[-1].prev:
             path.append(path[-1].prev)
         path.reverse()
-        
+
         return [p.x for p in path[1:]], [p.y for p in path[1:]]
-    
-    def validEdge(self, p1, p2, poly, robot_radius):
-        radiusPolygon = sp.LineString([p1, p2]).buffer(robot_radius)
-        return not poly.intersects(radiusPolygon)
 
     def successors(self, loc, goal):
         return [ Node(loc.x+x, loc.y+y, self.heurstic(loc.x+x, loc.y+y, goal.x, goal.y), loc.g+self.step, loc) for x,y in self.offsets]
-    
 
-    def validSuccessors(self, loc, goal, poly):
-        return [ Node(loc.x+x, loc.y+y, self.heurstic(loc.x+x, loc.y+y, goal.x, goal.y), loc.g+self.step, loc) for x,y in self.offsets if self.validEdge( (loc.x, loc.y), (loc.x+x, loc.y+y), poly, self.robot_radius) ]
-       
+
+    def validSuccessors(self, loc, goal, keep=None):
+        succ = self.successors(loc, goal)
+        if keep is not None:
+            succ = [s for s in succ if keep(s)]
+        if len(succ) == 0:
+            return succ
+        valid = self.validEdges(loc.x, loc.y, np.array([s.x for s in succ]), np.array([s.y for s in succ]))
+        return [s for s, ok in zip(succ, valid) if ok]
+
     def heurstic(self,loc_x,loc_y, goal_x, goal_y):
         return math.sqrt( (loc_x - goal_x)**2 + (loc_y - goal_y)**2)
 
     def isStuck(self, pos):
-        poly = prep(self.obstacles)
-        return not any([ self.validEdge( (pos[0], pos[1]), (pos[0]+x, pos[1]+y), poly, self.robot_radius) for x,y in self.offsets ])
-
-    def validPlan(self, path, cur):
+        return not self.validEdges(pos[0], pos[1], pos[0] + self.offset_xy[:, 0], pos[1] + self.offset_xy[:, 1]).any()
+
+    def validPlan(self, path, cur, changed=None):
+        '''
+        Whether the path from cur clears every obstacle. With a list of
+        `changed` obstacles, the path is assumed to have been valid before
+        them and only the segments near them (and the one from cur) are checked.
+        '''
         if len(path) == 0:
             return False
-        tp = path.copy()
-
-        tp.insert(0, cur)
-        planPoly = sp.LineString(tp).buffer(self.robot_radius)
-
-        poly = prep(self.obstacles)
-
-        return not poly.intersects(planPoly)
+        tp = np.array([cur] + list(path), dtype=float)
+        p1, p2 = tp[:-1], tp[1:]
+        if changed is not None:
+            affected = np.zeros(len(p1), dtype=bool)
+            affected[0] = True
+            lo, hi = np.minimum(p1, p2) - self.robot_radius, np.maximum(p1, p2) + self.robot_radius
+            for o in changed:
+                min_x, min_y, max_x, max_y = o.bounds
+                affected |= (lo[:, 0] <= max_x) & (hi[:, 0] >= min_x) & (lo[:, 1] <= max_y) & (hi[:, 1] >= min_y)
+            p1, p2 = p1[affected], p2[affected]
+        return bool(self.validEdges(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1]).all())
 
     def distToNearest(self, x, y):
         cur, nearest = nearest_points(sp.Point( (x,y) ), self.obstacles)
@@ -160,4 +484,4 @@ class DiscreteActionPlanner:
 
         return x_path, y_path
 
-    
\ No newline at end of file
+
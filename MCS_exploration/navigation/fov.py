@@ -3,9 +3,11 @@
 from MCS_exploration.navigation.visibility_road_map import ObstaclePolygon
 from MCS_exploration.navigation.geometry import Geometry
 import math
+import sys
 import numpy as np
 import random
 import itertools
+import heapq
 import matplotlib.pyplot as plt
 import shapely.geometry as sp
 from shapely.prepared import prep
@@ -28,10 +30,107 @@ class FieldOfView:
 		self.agentH = pose[2]
 		self.HVoF = hvof
 		self.obstacle = obs
-		self.poly = unary_union([o.boundary for o in obs])
-		
+		self.poly = None
+		self.edges = None
+
+
+	def obstacleEdges(self):
+		# every obstacle boundary segment as a row of x1, y1, x2, y2
+		if self.edges is None:
+			segments = [np.zeros((0, 4))]
+			for o in self.obstacle:
+				for ring in [o.exterior] + list(o.interiors):
+					xy = np.asarray(ring.coords)[:, :2]
+					segments.append(np.hstack((xy[:-1], xy[1:])))
+			self.edges = np.concatenate(segments)
+		return self.edges
+
 
 	def getFoVPolygon(self, maxLen=15, eps=0.01):
+		# Visibility polygon of the FoV wedge from an angular sweep over the obstacle edges.
+		# Rays are cast at the wedge sides and arc, at every obstacle vertex and eps either
+		# side of it, and where an edge leaves the maxLen circle. A ray is only tested
+		# against the edges whose angular interval contains it.
+		edges = self.obstacleEdges()
+		ox, oy = float(self.agentX), float(self.agentY)
+		px, py = edges[:, 0] - ox, edges[:, 1] - oy
+		qx, qy = edges[:, 2] - ox, edges[:, 3] - oy
+
+		# angles are counter clockwise from the wedge's right side, in [0, 2pi)
+		start = math.pi/2 - self.agentH - self.HVoF/2
+		width = min(self.HVoF, 2*math.pi)
+		relP = (np.arctan2(py, px) - start) % (2*math.pi)
+		relQ = (np.arctan2(qy, qx) - start) % (2*math.pi)
+		span = (relQ - relP + math.pi) % (2*math.pi) - math.pi
+		lo = np.where(span >= 0, relP, relQ)
+		hi = lo + np.abs(span)
+		# intervals past 2pi also cover the start of the next turn
+		wrap = hi > 2*math.pi
+		edge_ids = np.concatenate((np.arange(len(edges)), np.flatnonzero(wrap)))
+		lo = np.concatenate((lo, lo[wrap] - 2*math.pi))
+		hi = np.concatenate((hi, hi[wrap] - 2*math.pi))
+
+		events = [np.linspace(0, width, 11)]
+		distP = np.hypot(px, py)
+		near = distP <= maxLen
+		events.extend([relP[near] - eps, relP[near], relP[near] + eps])
+		# edge / arc crossings: |P + s(Q-P)| = maxLen for s in [0, 1]
+		dx, dy = qx - px, qy - py
+		a = dx**2 + dy**2
+		b = 2*(px*dx + py*dy)
+		c = distP**2 - maxLen**2
+		disc = b**2 - 4*a*c
+		valid = (a > 0) & (disc >= 0)
+		for sign in (-1, 1):
+			sol = (-b[valid] + sign*np.sqrt(disc[valid])) / (2*a[valid])
+			on_edge = (sol >= 0) & (sol <= 1)
+			cx = px[valid][on_edge] + sol[on_edge]*dx[valid][on_edge]
+			cy = py[valid][on_edge] + sol[on_edge]*dy[valid][on_edge]
+			events.append((np.arctan2(cy, cx) - start) % (2*math.pi))
+		events = np.concatenate(events)
+		events = np.unique(events[(events >= 0) & (events <= width)])
+
+		# sweep: intervals enter in order of lo and leave, through a heap, in order of hi
+		order = np.argsort(lo)
+		lo_sorted = lo[order]
+		active = set()
+		leaving = []
+		next_in = 0
+		poly_X = [ox]
+		poly_Y = [oy]
+		for rel in events:
+			while next_in < len(order) and lo_sorted[next_in] <= rel:
+				idx = order[next_in]
+				active.add(idx)
+				heapq.heappush(leaving, (hi[idx], idx))
+				next_in += 1
+			while leaving and leaving[0][0] < rel:
+				active.discard(heapq.heappop(leaving)[1])
+
+			theta = start + rel
+			rx, ry = math.cos(theta), math.sin(theta)
+			dist = maxLen
+			if active:
+				ids = edge_ids[list(active)]
+				ex, ey = dx[ids], dy[ids]
+				denom = rx*ey - ry*ex
+				with np.errstate(divide='ignore', invalid='ignore'):
+					t = (px[ids]*ey - py[ids]*ex) / denom
+					u = (px[ids]*ry - py[ids]*rx) / denom
+				t = t[(denom != 0) & (t >= 0) & (u >= 0) & (u <= 1)]
+				if len(t):
+					dist = min(dist, t.min())
+			poly_X.append(ox + dist*rx)
+			poly_Y.append(oy + dist*ry)
+
+		return ObstaclePolygon(poly_X, poly_Y)
+
+
+	def getFoVPolygonShapely(self, maxLen=15, eps=0.01):
+		# Previous implementation: casts shapely rays at the fan and at the
+		# obstacle vertices found by intersecting the fan with the obstacles
+		if self.poly is None:
+			self.poly = unary_union([o.boundary for o in self.obstacle])
 		# pr = cProfile.Profile()
 		# pr.enable()
 		start_time = time.time()
@@ -268,6 +367,34 @@ def genRandomRectangle():
 
     return ObstaclePolygon(x,y)
 
+def benchmarkFoV(nScenes=100, cnt=15, maxLen=100):
+	# sweep against the previous shapely implementation on random rectangle scenes,
+	# with the area of their symmetric difference relative to the shapely polygon
+	sweepTime = shapelyTime = 0
+	diffs = []
+	for _ in range(nScenes):
+		x, y = random.randrange(-25,25), random.randrange(-25,25)
+		h = (2*random.random()-1)*math.pi
+		obstacles = [genRandomRectangle() for i in range(cnt)]
+		obstacles.append(ObstaclePolygon([150,-150,-150,150],[150,150,-150,-150]))
+		fov = FieldOfView( [x,y,h], 40/180.0*math.pi, obstacles)
+
+		start_time = time.time()
+		sweepPoly = fov.getFoVPolygon(maxLen)
+		sweepTime += time.time() - start_time
+
+		start_time = time.time()
+		shapelyPoly = fov.getFoVPolygonShapely(maxLen)
+		shapelyTime += time.time() - start_time
+
+		a = sp.Polygon(zip(sweepPoly.x_list, sweepPoly.y_list)).buffer(0)
+		b = sp.Polygon(zip(shapelyPoly.x_list, shapelyPoly.y_list)).buffer(0)
+		diffs.append(a.symmetric_difference(b).area / b.area)
+
+	print("angular sweep: {:.2f} ms, shapely rays: {:.2f} ms per polygon".format(1000*sweepTime/nScenes, 1000*shapelyTime/nScenes))
+	print("symmetric difference: median {:.3f}, max {:.3f}".format(np.median(diffs), np.max(diffs)))
+
+
 def main():
 	print(__file__ + " start!!")
 	for i in range(100000):
@@ -301,4 +428,7 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmarkFoV()
+    else:
+        main()
@@ -19,146 +19,169 @@ from descartes import PolygonPatch
 import shapely.geometry as sp
 from shapely.prepared import prep
 from MCS_exploration.navigation.dijkstra_search import DijkstraSearch
-import ray
-import psutil
+import multiprocessing
 
 from shapely.ops import unary_union
+from shapely.strtree import STRtree
 
 show_animation = True
 
 
-@ray.remote    
-def getValidEdges(src_node_idx, obs_nodes, poly, radius):
-    return [ node_id for node_id, node in enumerate(obs_nodes) if validEdge(obs_nodes[src_node_idx], node, poly, radius)]
-
-
-def validEdge(p1, p2, poly, robot_radius):
-    if math.sqrt( (p1.x - p2.x)**2 + (p1.y - p2.y)**2) <= 0.01:
-             return False
-
-    radiusPolygon = sp.LineString([[p1.x,p1.y], [p2.x,p2.y]]).buffer(robot_radius)
-    return not radiusPolygon.intersects(poly)
-
-class ParallelVisibilityRoadmap:
-
-    def __init__(self, robot_radius, obstacles, do_plot=False):
-        self.robot_radius = robot_radius
-        self.do_plot = do_plot
-        self.obs_nodes = []
-        self.obs_roadmap_adj = []
-        self.obstacles = obstacles
-        self.poly = sp.MultiPolygon()
-        for obs in obstacles:
-            self.poly = self.poly.union(sp.polygon.orient(sp.Polygon(obs),sign=1))
-
-        if not ray.is_initialized():
-            num_cpus = psutil.cpu_count(logical=False)
-            ray.init(num_cpus=num_cpus,ignore_reinit_error=True)
-
-        self.buildMap()
-        
-        
-
-    def buildMap(self):
-
-        self.obs_nodes = []
-
-    
-        # add every vertex as a node
-        for obj in self.obstacles:
-            x_list = [p[0] for p in obj.exterior.coords]
-            y_list = [p[1] for p in obj.exterior.coords]
-            cvx_list, cvy_list = self.calc_vertexes_in_configuration_space(x_list, y_list)
-            
-            new_nodes = [DijkstraSearch.Node(vx, vy) for vx,vy in zip(cvx_list, cvy_list)]
-            self.obs_nodes.extend(new_nodes)
-
-        # move needed objects to ray shared memory        
-        obstacle_ref = ray.put(self.poly)
-        nodes_ref = ray.put(self.obs_nodes)
-
-    
-        # check node connectivity in parallel over nodes
-        self.obs_roadmap_adj = ray.get( [getValidEdges.remote(i, nodes_ref, obstacle_ref,self.robot_radius) for i in range(len(self.obs_nodes))])
-
-        #self.obs_roadmap_adj = [getValidEdges(i, self.obs_nodes, self.poly ,self.robot_radius) for i in range(len(self.obs_nodes))]
-
-    def addObstacle(self, obstacle):
-        # add obstacle and just rebuild the map
-        self.obstacles.append(obstacle)
-        self.poly = self.poly.union(sp.polygon.orient(sp.Polygon(obstacle),sign=1))
-        self.buildMap()
-
-
-    def planning(self, start_x, start_y, goal_x, goal_y):
-
-        sg_nodes = [DijkstraSearch.Node(start_x, start_y),
-                 DijkstraSearch.Node(goal_x, goal_y)]
-
-        sg_edges = [[],[]]
-
-
-        planNodes = self.obs_nodes.copy() + sg_nodes
-        planRoadmap = self.obs_roadmap_adj.copy() + sg_edges
-        
-        for node_id in range(len(planRoadmap)):
-            if validEdge(planNodes[node_id], planNodes[-2], self.poly, self.robot_radius) and node_id != len(planRoadmap)-2:
-                planRoadmap[node_id].append(len(planNodes)-2)
-                planRoadmap[-2].append(node_id)
-            if validEdge(planNodes[node_id], planNodes[-1], self.poly, self.robot_radius) and node_id != len(planRoadmap)-1:
-                planRoadmap[node_id].append(len(planNodes)-1)
-                planRoadmap[-1].append(node_id)
-
-        rx, ry = DijkstraSearch(False).search(
-            start_x, start_y,
-            goal_x, goal_y,
-            [node.x for node in planNodes],
-            [node.y for node in planNodes],
-            planRoadmap
-        )
-
-        return rx, ry
-
-    def calc_vertexes_in_configuration_space(self, x_list, y_list):
-        x_list = x_list[0:-1]
-        y_list = y_list[0:-1]
-        cvx_list, cvy_list = [], []
-
-        n_data = len(x_list)
-
-        for index in range(n_data):
-            offset_x, offset_y = self.calc_offset_xy(
-                x_list[index - 1], y_list[index - 1],
-                x_list[index], y_list[index],
-                x_list[(index + 1) % n_data], y_list[(index + 1) % n_data],
-            )
-            cvx_list.append(offset_x)
-            cvy_list.append(offset_y)
-
-        return cvx_list, cvy_list
-
-    def calc_offset_xy(self, px, py, x, y, nx, ny):
-        p_vec = math.atan2(y - py, x - px)
-        n_vec = math.atan2(ny - y, nx - x)
-        offset_vec = math.atan2(math.sin(p_vec) + math.sin(n_vec),
-                                math.cos(p_vec) + math.cos(
-                                    n_vec)) + math.pi / 2.0
-        offset_x = x - (self.robot_radius*5) * math.cos(offset_vec)
-        offset_y = y - (self.robot_radius*5) * math.sin(offset_vec)
-        return offset_x, offset_y
-
-    @staticmethod
-    def plot_road_map(nodes, road_map_info_list):
-        for i, node in enumerate(nodes):
-            plt.plot(node.x, node.y, "+g")
-            for index in road_map_info_list[i]:
-                if index >= len(nodes)-2 or i >= len(nodes)-2:
-                    plt.plot([node.x, nodes[index].x],
-                             [node.y, nodes[index].y], "-r")
-                else:
-                    plt.plot([node.x, nodes[index].x],
-                             [node.y, nodes[index].y], "-b")
-
+def segment_distances(p1, p2, q1, q2):
+    """
+    Distances between the segments p1-p2 and q1-q2, (... x 2) arrays that broadcast together
+    """
+
+    def point_to_segment(a, b1, b2):
+        d = b2 - b1
+        length2 = (d**2).sum(-1)
+        t = np.clip(((a - b1) * d).sum(-1) / np.where(length2 > 0, length2, 1), 0, 1)
+        return np.hypot(*np.moveaxis(a - (b1 + t[..., None] * d), -1, 0))
+
+    def orientation(a, b, c):
+        return (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+
+    dist = np.minimum.reduce([point_to_segment(p1, q1, q2), point_to_segment(p2, q1, q2),
+                              point_to_segment(q1, p1, p2), point_to_segment(q2, p1, p2)])
+    crossing = (orientation(p1, p2, q1) * orientation(p1, p2, q2) < 0) & \
+               (orientation(q1, q2, p1) * orientation(q1, q2, p2) < 0)
+    dist[crossing] = 0
+    return dist
+
+
+class ObstacleStore:
+    """
+    Obstacle polygons behind an STRtree, with their boundary segments as arrays
+    so that capsules (segments grown by the robot radius) can be checked
+    against them without shapely buffers
+    """
+
+    def __init__(self):
+        self.polygons = []
+        self.tree = None
+        self.bounds = np.zeros((0, 4))
+        self.edges = np.zeros((0, 4))
+        self.edge_polygon = np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.polygons)
+
+    def add(self, polygon):
+        idx = len(self.polygons)
+        self.polygons.append(polygon)
+        self.bounds = np.vstack((self.bounds, polygon.bounds))
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            xy = np.asarray(ring.coords)[:, :2]
+            self.edges = np.vstack((self.edges, np.hstack((xy[:-1], xy[1:]))))
+            self.edge_polygon = np.concatenate((self.edge_polygon, np.full(len(xy) - 1, idx)))
+        self._build_tree()
+
+    def _build_tree(self):
+        self.tree = STRtree(self.polygons)
+        self._tree_index = {id(p): i for i, p in enumerate(self.polygons)}
+
+    def __getstate__(self):
+        # STRtrees don't pickle, workers rebuild it
+        state = self.__dict__.copy()
+        state["tree"] = None
+        state["_tree_index"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.polygons:
+            self._build_tree()
+
+    def query(self, bounds):
+        """
+        Ids of the polygons whose bounding box overlaps `bounds`
+        """
+        if self.tree is None:
+            return np.zeros(0, dtype=int)
+        hits = self.tree.query(sp.box(*bounds))
+        # shapely < 2 returns the geometries rather than their indices
+        if len(hits) and not isinstance(hits[0], (int, np.integer)):
+            hits = [self._tree_index[id(p)] for p in hits]
+        return np.asarray(hits, dtype=int)
+
+    def capsules_clear(self, p1, p2, radius, polygon_ids=None):
+        """
+        For every segment p1-p2 (N x 2 arrays), whether it stays further than
+        `radius` from the polygons in `polygon_ids` (all of them if None)
+        """
+        p1 = np.asarray(p1, dtype=float).reshape(-1, 2)
+        p2 = np.asarray(p2, dtype=float).reshape(-1, 2)
+        polygon_ids = np.arange(len(self.polygons)) if polygon_ids is None else np.unique(polygon_ids)
+        clear = np.ones(len(p1), dtype=bool)
+        if len(p1) == 0 or len(polygon_ids) == 0:
+            return clear
+
+        selected = np.isin(self.edge_polygon, polygon_ids)
+        edges = self.edges[selected]
+        # only the pairs whose bounding boxes overlap can be within radius
+        lo, hi = np.minimum(p1, p2) - radius, np.maximum(p1, p2) + radius
+        edge_lo, edge_hi = np.minimum(edges[:, :2], edges[:, 2:]), np.maximum(edges[:, :2], edges[:, 2:])
+        seg_ids, edge_ids = np.nonzero((lo[:, None] <= edge_hi[None]).all(-1) & (hi[:, None] >= edge_lo[None]).all(-1))
+        dist = segment_distances(p1[seg_ids], p2[seg_ids], edges[edge_ids, :2], edges[edge_ids, 2:])
+        near = np.zeros(len(p1), dtype=bool)
+        near[seg_ids[dist <= radius]] = True
+
+        # a segment can also lie inside a polygon without reaching its boundary,
+        # then so does its start point
+        starts, start_ids = np.unique(p1, axis=0, return_inverse=True)
+        ax, ay = starts[:, 0, None], starts[:, 1, None]
+        x1, y1, x2, y2 = (edges[:, k] for k in range(4))
+        spans = (y1 > ay) != (y2 > ay)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_x = x1 + (ay - y1) * (x2 - x1) / (y2 - y1)
+        crossings = spans & (ax < cross_x)
+        owners = np.searchsorted(polygon_ids, self.edge_polygon[selected])
+        counts = crossings.astype(int) @ (owners[:, None] == np.arange(len(polygon_ids)))
+        inside = (counts % 2 == 1).any(axis=1)[start_ids.ravel()]
+
+        return clear & ~near & ~inside
+
+    def edges_clear(self, src, targets, radius):
+        """
+        Whether each edge from src to the rows of targets is longer than 0.01
+        and clears every polygon by `radius`
+        """
+        targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+        src = np.broadcast_to(np.asarray(src, dtype=float), targets.shape)
+        valid = np.hypot(*(targets - src).T) > 0.01
+        if len(self.polygons) and valid.any():
+            bounds = np.concatenate((np.minimum(src[valid], targets[valid]).min(axis=0) - radius,
+                                     np.maximum(src[valid], targets[valid]).max(axis=0) + radius))
+            valid[valid] = self.capsules_clear(src[valid], targets[valid], radius, self.query(bounds))
+        return valid
+
+
+def valid_edge_rows(args):
+    """
+    Roadmap adjacency rows of the nodes in src_ids, for the process pool.
+    With upper_only, only the targets after each source are checked.
+    """
+    src_ids, node_xy, obstacles, radius, upper_only = args
+    rows = []
+    for i in src_ids:
+        first = i + 1 if upper_only else 0
+        rows.append((first + np.flatnonzero(obstacles.edges_clear(node_xy[i], node_xy[first:], radius))).tolist())
+    return rows
+
+
+_pool = None
+_pool_size = 0
+
+
+def get_pool(n_workers):
+    # one pool for every roadmap, started on first use
+    global _pool, _pool_size
+    if _pool is None or _pool_size != n_workers:
+        if _pool is not None:
+            _pool.close()
+        _pool = multiprocessing.Pool(n_workers)
+        _pool_size = n_workers
+    return _pool
 
 
 class IncrementalVisibilityRoadMap:
@@ -168,13 +191,14 @@ class IncrementalVisibilityRoadMap:
         self.do_plot = do_plot
         self.obs_nodes = []
         self.obs_roadmap_adj = []
-        self.obstacles = sp.MultiPolygon()
+        self.node_xy = np.zeros((0, 2))
+        self.obstacles = ObstacleStore()
 
     
     def addObstacle(self, obstacle):
         # add obstacle
-        #self.obstacles = self.obstacles.union(sp.polygon.orient(sp.Polygon(obstacle),sign=1))
-        self.obstacles = self.obstacles.union(sp.polygon.orient(sp.Polygon(obstacle),sign=1))
+        self.obstacles.add(sp.polygon.orient(sp.Polygon(obstacle),sign=1))
+        new_id = len(self.obstacles) - 1
 
         # add nodes for each vertex
         x_list = [p[0] for p in obstacle.exterior.coords]
@@ -184,37 +208,47 @@ class IncrementalVisibilityRoadMap:
 
         #new_nodes = [DijkstraSearch.Node(vx, vy) for vx,vy in zip(cvx_list, cvy_list) if self.can_node_fit_circle(DijkstraSearch.Node(vx, vy))]
         new_nodes = [DijkstraSearch.Node(vx, vy) for vx,vy in zip(cvx_list, cvy_list)]
+        n_old = len(self.obs_nodes)
         self.obs_nodes.extend(new_nodes)
+        self.node_xy = np.vstack((self.node_xy, np.column_stack((cvx_list, cvy_list)).reshape(-1, 2)))
+
+        #check old edges against this object only, and only those whose bounding box is near it
+        src, tar = self.edgeArrays(n_old)
+        if len(src):
+            p1, p2 = self.node_xy[src], self.node_xy[tar]
+            min_x, min_y, max_x, max_y = self.obstacles.bounds[new_id] + np.array([-1, -1, 1, 1]) * self.robot_radius
+            near = (np.minimum(p1[:, 0], p2[:, 0]) <= max_x) & (np.maximum(p1[:, 0], p2[:, 0]) >= min_x) & \
+                   (np.minimum(p1[:, 1], p2[:, 1]) <= max_y) & (np.maximum(p1[:, 1], p2[:, 1]) >= min_y)
+            blocked = np.flatnonzero(near)[~self.obstacles.capsules_clear(p1[near], p2[near], self.robot_radius, [new_id])]
+            removed = {}
+            for i in blocked:
+                removed.setdefault(src[i], set()).add(tar[i])
+            for src_id, tar_ids in removed.items():
+                self.obs_roadmap_adj[src_id] = [t for t in self.obs_roadmap_adj[src_id] if t not in tar_ids]
 
         #check new edges for intersection with all objects
-        for i,node in enumerate(new_nodes):
-            self.obs_roadmap_adj.append(self.getValidNodeEdges(node))
+        self.obs_roadmap_adj.extend(self.validNodeEdgeRows(range(n_old, len(self.obs_nodes))))
         
-        for i in range(len(new_nodes)):
-            idx = len(self.obs_nodes)-len(new_nodes)+i
+        for idx in range(n_old, len(self.obs_nodes)):
             for n in self.obs_roadmap_adj[idx]:
-                self.obs_roadmap_adj[n].append(idx)
-
-            
-        #check old edges for intersection with this object
-        for src_id, adj in enumerate(self.obs_roadmap_adj):
-            rm = []
-            for i,tar_id in enumerate(adj):
-                #print(len(self.obs_nodes), src_id, tar_id)
-                if not self.validEdge(self.obs_nodes[src_id], self.obs_nodes[tar_id]):
-                    rm.append(i)
-            rm.reverse()
-            for i in rm:
-                del self.obs_roadmap_adj[src_id][i]
-    
-    def validEdge(self, p1, p2):
-        if math.sqrt( (p1.x - p2.x)**2 + (p1.y - p2.y)**2) <= 0.01:
-                 return False
+                if n < n_old:
+                    self.obs_roadmap_adj[n].append(idx)
+
+    def edgeArrays(self, n_nodes=None):
+        # source and target ids of every roadmap edge between the first n_nodes nodes
+        n_nodes = len(self.obs_roadmap_adj) if n_nodes is None else n_nodes
+        src = [src_id for src_id in range(n_nodes) for _ in self.obs_roadmap_adj[src_id]]
+        tar = [tar_id for src_id in range(n_nodes) for tar_id in self.obs_roadmap_adj[src_id]]
+        return np.array(src, dtype=int), np.array(tar, dtype=int)
 
-        radiusPolygon = sp.LineString([[p1.x,p1.y], [p2.x,p2.y]]).buffer(self.robot_radius)
-        #patch2b = PolygonPatch(radiusPolygon, fc="blue", ec="blue", alpha=0.5, zorder=2)
-        #plt.gca().add_patch(patch2b)
-        return not radiusPolygon.intersects(self.obstacles)
+    def validEdges(self, src, targets):
+        return self.obstacles.edges_clear(src, targets, self.robot_radius)
+
+    def validNodeEdgeRows(self, node_ids):
+        return valid_edge_rows((node_ids, self.node_xy, self.obstacles, self.robot_radius, False))
+
+    def validEdge(self, p1, p2):
+        return bool(self.validEdges((p1.x, p1.y), [(p2.x, p2.y)])[0])
 
 
     def getValidNodeEdgesV1(self, src_node):
@@ -227,26 +261,24 @@ class IncrementalVisibilityRoadMap:
         return node_adj
         
     def getValidNodeEdges(self, src_node):
-        return [ node_id for node_id, node in enumerate(self.obs_nodes) if self.validEdge(src_node, node)]
+        return np.flatnonzero(self.validEdges((src_node.x, src_node.y), self.node_xy)).tolist()
 
     def planning(self, start_x, start_y, goal_x, goal_y):
 
         sg_nodes = [DijkstraSearch.Node(start_x, start_y),
                  DijkstraSearch.Node(goal_x, goal_y)]
 
-        sg_edges = [[],[]]
-
+        planNodes = self.obs_nodes + sg_nodes
+        planRoadmap = [list(adj) for adj in self.obs_roadmap_adj] + [[],[]]
+        plan_xy = np.vstack((self.node_xy, [[start_x, start_y], [goal_x, goal_y]]))
+        start_id, goal_id = len(planNodes)-2, len(planNodes)-1
 
-        planNodes = self.obs_nodes.copy() + sg_nodes
-        planRoadmap = self.obs_roadmap_adj.copy() + sg_edges
-        
-        for node_id in range(len(planRoadmap)):
-            if self.validEdge(planNodes[node_id], planNodes[-2]) and node_id != len(planRoadmap)-2:
-                planRoadmap[node_id].append(len(planNodes)-2)
-                planRoadmap[-2].append(node_id)
-            if self.validEdge(planNodes[node_id], planNodes[-1]) and node_id != len(planRoadmap)-1:
-                planRoadmap[node_id].append(len(planNodes)-1)
-                planRoadmap[-1].append(node_id)
+        for sg_id in (start_id, goal_id):
+            valid = self.validEdges(plan_xy[sg_id], plan_xy)
+            valid[sg_id] = False
+            for node_id in np.flatnonzero(valid).tolist():
+                planRoadmap[node_id].append(sg_id)
+                planRoadmap[sg_id].append(node_id)
 
         #print(planNodes)
         #print(planRoadmap)
@@ -304,6 +336,92 @@ class IncrementalVisibilityRoadMap:
                              [node.y, nodes[index].y], "-b")
 
 
+class ParallelVisibilityRoadmap(IncrementalVisibilityRoadMap):
+    """
+    Roadmap whose full builds are split by source node over a process pool.
+    Adding an obstacle only rebuilds the rows of its new nodes and rechecks
+    the old edges near it, like IncrementalVisibilityRoadMap. Each build
+    is recorded in build_stats.
+    """
+
+    def __init__(self, robot_radius, obstacles, do_plot=False, n_workers=None, min_parallel_nodes=64):
+        super().__init__(robot_radius, do_plot)
+        self.n_workers = n_workers if n_workers is not None else multiprocessing.cpu_count()
+        self.min_parallel_nodes = min_parallel_nodes
+        self.build_stats = []
+
+        for obstacle in obstacles:
+            self.obstacles.add(sp.polygon.orient(sp.Polygon(obstacle), sign=1))
+            cvx_list, cvy_list = self.calc_vertexes_in_configuration_space(
+                [p[0] for p in obstacle.exterior.coords], [p[1] for p in obstacle.exterior.coords])
+            self.obs_nodes.extend(DijkstraSearch.Node(vx, vy) for vx, vy in zip(cvx_list, cvy_list))
+            self.node_xy = np.vstack((self.node_xy, np.column_stack((cvx_list, cvy_list)).reshape(-1, 2)))
+
+        self.buildMap()
+
+    def validNodeEdgeRows(self, node_ids, upper_only=False):
+        node_ids = list(node_ids)
+        if self.n_workers <= 1 or len(node_ids) < self.min_parallel_nodes:
+            return valid_edge_rows((node_ids, self.node_xy, self.obstacles, self.robot_radius, upper_only))
+        # interleaved so that upper_only chunks get about the same number of edges
+        chunks = [node_ids[k::self.n_workers] for k in range(self.n_workers)]
+        results = get_pool(self.n_workers).map(
+            valid_edge_rows, [(chunk, self.node_xy, self.obstacles, self.robot_radius, upper_only) for chunk in chunks])
+        rows = {}
+        for chunk, chunk_rows in zip(chunks, results):
+            rows.update(zip(chunk, chunk_rows))
+        return [rows[i] for i in node_ids]
+
+    def buildMap(self):
+        start_time = time.time()
+        # edges are symmetric, check each pair once and mirror it
+        self.obs_roadmap_adj = self.validNodeEdgeRows(range(len(self.obs_nodes)), upper_only=True)
+        for src_id in range(len(self.obs_roadmap_adj)):
+            for tar_id in self.obs_roadmap_adj[src_id]:
+                if tar_id > src_id:
+                    self.obs_roadmap_adj[tar_id].append(src_id)
+        for adj in self.obs_roadmap_adj:
+            adj.sort()
+        self._recordBuild("build", start_time)
+
+    def addObstacle(self, obstacle):
+        start_time = time.time()
+        super().addObstacle(obstacle)
+        self._recordBuild("add", start_time)
+
+    def _recordBuild(self, kind, start_time):
+        self.build_stats.append({
+            "kind": kind,
+            "time": time.time() - start_time,
+            "nodes": len(self.obs_nodes),
+            "edges": sum(len(adj) for adj in self.obs_roadmap_adj) // 2
+        })
+        if self.do_plot:
+            print("roadmap {kind}: {time:.3f}s, {nodes} nodes, {edges} edges".format(**self.build_stats[-1]))
+
+
+def benchmark(n_obstacles=40, seed=0):
+    """
+    Builds the same random roadmap serially and on the process pool, then
+    adds one more obstacle. Run from the repo root:
+    python -m MCS_exploration.navigation.visibility_road_map
+    """
+    rng = np.random.RandomState(seed)
+    obstacles = []
+    for _ in range(n_obstacles + 1):
+        cx, cy = rng.uniform(-5, 5, 2)
+        w, h = rng.uniform(0.1, 0.5, 2)
+        obstacles.append(sp.box(cx - w, cy - h, cx + w, cy + h))
+
+    serial = ParallelVisibilityRoadmap(0.22, obstacles[:-1], n_workers=1)
+    parallel = ParallelVisibilityRoadmap(0.22, obstacles[:-1])
+    assert serial.obs_roadmap_adj == parallel.obs_roadmap_adj
+    parallel.addObstacle(obstacles[-1])
+    for name, roadmap in (("serial", serial), ("{} workers".format(parallel.n_workers), parallel)):
+        for stats in roadmap.build_stats:
+            print("{:>10} {kind}: {time:.3f}s, {nodes} nodes, {edges} edges".format(name, **stats))
+
+
 class ObstaclePolygon(sp.Polygon):
     def __init__(self, x, y):
         super().__init__(zip(x,y))
@@ -319,3 +437,7 @@ class ObstaclePolygon(sp.Polygon):
 
     def get_goal_bonding_box_polygon(self):
         return self
+
+
+if __name__ == "__main__":
+    benchmark()
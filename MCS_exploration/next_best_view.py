@@ -0,0 +1,146 @@
+'''
+Next-best-view scoring for the exploration loop.
+
+All candidate positions of a round are scored in one batched ray march
+over the shared CoverageMap, optionally split across a process pool. The
+cells a candidate would see only depend on the occupancy raster, so they
+are cached per candidate. The next round only re-counts the unseen cells
+among them. A cached view is recomputed when a changed occupancy cell
+falls inside it, or on the first blocked cell of one of its rays.
+'''
+import multiprocessing
+import time
+
+import numpy as np
+
+from coverage_map import CoverageMap
+
+
+def candidate_views(occupancy, half_size, resolution, positions, max_range=None):
+    '''
+    For every (x, z) in `positions`, the flat indices of the cells it sees
+    all around and of the occupied cells that end its rays
+    '''
+    coverage_map = CoverageMap(half_size, resolution)
+    coverage_map.occupancy = occupancy
+    if max_range is None:
+        max_range = coverage_map.max_range
+    angles = coverage_map.ray_angles(0, 360, max_range)
+
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    cells, visible, first_blocked = coverage_map.cast(positions[:, 0, None], positions[:, 1, None], angles, max_range)
+    blockers = np.take_along_axis(cells, first_blocked[..., None], axis=-1)[..., 0]
+    # argmax is 0 for rays that are never blocked, whose first sample is visible
+    blocked = ~np.take_along_axis(visible, first_blocked[..., None], axis=-1)[..., 0]
+
+    views = []
+    for i in range(len(positions)):
+        view = np.unique(cells[i][visible[i]])
+        ends = blockers[i][blocked[i] & (blockers[i] >= 0)]
+        views.append((view, np.unique(ends)))
+    return views
+
+
+def _candidate_views(args):
+    return candidate_views(*args)
+
+
+class NextBestView:
+
+    def __init__(self, coverage_map, n_workers=1, chunk_size=8):
+        self.coverage_map = coverage_map
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self._views = {}
+        self._occupancy = None
+        self._pool = None
+
+    def reset(self):
+        self._views = {}
+        self._occupancy = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def _invalidate(self):
+        '''
+        Drops the cached views that a change of the occupancy raster can affect
+        '''
+        occupancy = self.coverage_map.occupancy.ravel()
+        if self._occupancy is not None and len(self._views) != 0:
+            changed = np.flatnonzero(occupancy != self._occupancy)
+            if len(changed) != 0:
+                self._views = {
+                    candidate: (view, ends) for candidate, (view, ends) in self._views.items()
+                    if not (np.isin(changed, view).any() or np.isin(changed, ends).any())
+                }
+        self._occupancy = occupancy.copy()
+
+    def _compute_views(self, candidates):
+        chunks = [candidates[i:i + self.chunk_size] for i in range(0, len(candidates), self.chunk_size)]
+        args = [(self.coverage_map.occupancy, self.coverage_map.half_size, self.coverage_map.resolution, chunk)
+                for chunk in chunks]
+        if self.n_workers > 1 and len(chunks) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.n_workers)
+            results = self._pool.map(_candidate_views, args)
+        else:
+            results = [_candidate_views(arg) for arg in args]
+        for chunk, views in zip(chunks, results):
+            self._views.update(zip(chunk, views))
+
+    def score(self, candidates, obstacles=None):
+        '''
+        New area in m^2 a full turn at each (x, z) in `candidates` would see
+        '''
+        if obstacles is not None:
+            self.coverage_map.set_obstacles(obstacles)
+        self._invalidate()
+
+        candidates = [tuple(c) for c in candidates]
+        missing = list(dict.fromkeys(c for c in candidates if c not in self._views))
+        if len(missing) != 0:
+            self._compute_views(missing)
+
+        unseen = ~self.coverage_map.seen.ravel()
+        return np.array([np.count_nonzero(unseen[self._views[c][0]]) for c in candidates]) * self.coverage_map.cell_area
+
+
+def benchmark(n_candidates=40, n_obstacles=15, n_rounds=5, seed=0):
+    '''
+    One candidate at a time with CoverageMap.new_coverage against batched and
+    cached scoring. Run from MCS_exploration: python next_best_view.py
+    '''
+    from cover_floor import random_box_obstacles
+    obstacles = random_box_obstacles(n_obstacles, seed)
+    rng = np.random.RandomState(seed + 1)
+    candidates = [tuple(p) for p in np.round(rng.uniform(-4, 4, (n_candidates, 2)), 1)]
+    stops = rng.uniform(-4, 4, (n_rounds, 2))
+
+    coverage_map = CoverageMap()
+    start_time = time.time()
+    loop_scores = []
+    for stop in stops:
+        coverage_map.update(stop[0], stop[1], 0, 360, obstacles)
+        loop_scores.append([coverage_map.new_coverage(x, y, 0, 360, obstacles) for x, y in candidates])
+    loop_time = time.time() - start_time
+
+    for n_workers in (1, multiprocessing.cpu_count()):
+        coverage_map = CoverageMap()
+        next_best_view = NextBestView(coverage_map, n_workers)
+        start_time = time.time()
+        batch_scores = []
+        for stop in stops:
+            coverage_map.update(stop[0], stop[1], 0, 360, obstacles)
+            batch_scores.append(next_best_view.score(candidates, obstacles))
+        batch_time = time.time() - start_time
+        next_best_view.close()
+        assert np.allclose(loop_scores, batch_scores)
+        print("{} workers: {:.3f}s".format(n_workers, batch_time))
+    print("{} rounds of {} candidates, one at a time: {:.3f}s".format(n_rounds, n_candidates, loop_time))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,24 +1,71 @@
 from frame_processing import *
 from shapely.geometry import Point, MultiPoint
 
+
+class OccupancyBitmap():
+    '''
+    Occupancy map cells of one object, as a bool grid cropped to their
+    bounding box. Cell [0, 0] of bits is grid index origin.
+    '''
+    def __init__(self, points=None):
+        points = np.zeros((0, 2), dtype=int) if points is None else np.asarray(points, dtype=int).reshape(-1, 2)
+        if len(points) == 0:
+            self.origin = np.zeros(2, dtype=int)
+            self.bits = np.zeros((0, 0), dtype=bool)
+            return
+        self.origin = points.min(axis=0)
+        self.bits = np.zeros(points.max(axis=0) - self.origin + 1, dtype=bool)
+        self.bits[points[:, 0] - self.origin[0], points[:, 1] - self.origin[1]] = True
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def points(self):
+        return np.argwhere(self.bits) + self.origin
+
+    def __or__(self, other):
+        if other.bits.size == 0:
+            return self.copy()
+        if self.bits.size == 0:
+            return other.copy()
+        merged = OccupancyBitmap()
+        merged.origin = np.minimum(self.origin, other.origin)
+        end = np.maximum(self.origin + self.bits.shape, other.origin + other.bits.shape)
+        merged.bits = np.zeros(end - merged.origin, dtype=bool)
+        for bitmap in (self, other):
+            (r, c), (h, w) = bitmap.origin - merged.origin, bitmap.bits.shape
+            merged.bits[r:r+h, c:c+w] |= bitmap.bits
+        return merged
+
+    def copy(self):
+        bitmap = OccupancyBitmap()
+        bitmap.origin = self.origin.copy()
+        bitmap.bits = self.bits.copy()
+        return bitmap
+
+    def to_polygons(self, scale, displacement):
+        if self.bits.size == 0:
+            return MultiPolygon()
+        return bitmap_to_polygons(self.bits, self.origin, scale, displacement)
+
+
 class Obstacle():
     def __init__(self,obj_id,obj_height,map_points,size,scale,displacement,trophy_prob =None, number_pixel_points=0):
         self.id = obj_id
-        self.occupancy_map_points = map_points[:]
-        self.parent_occupancy_map = map_points[:]
+        self.occupancy = map_points.copy() if isinstance(map_points, OccupancyBitmap) else OccupancyBitmap(map_points)
+        self.parent_occupancy = self.occupancy.copy()
+        self.scale = scale
+        self.displacement = displacement
         self.height = obj_height
         self.is_goal = False
         self.current_frame_id = None
         self.is_container = True #initial assumption that anything can be a container
         self.is_opened = False
         self.is_contained = False #If it is contained in a different object
-        self.centre_x = None
-        self.centre_y = None
-        self.centre_z = None
-        self.bounding_box = None
-        self.calculate_bounding_box(size,scale, displacement)
-        self.parent_bounding_box = self.bounding_box
-        self.calculate_centre()
+        # outline and centre are worked out when first asked for
+        self._bounding_box = None
+        self._centre = None
+        self._parent_bounding_box = None
         self.parent_id = -1
         self.is_picked_and_not_trophy = False
         self.number_pixel_points = [number_pixel_points]
@@ -30,43 +77,77 @@ class Obstacle():
             self.trophy_prob_per_frame = [trophy_prob]
         #self.agent_pos_per_frame = [agent_pos]
 
-    def expand_obstacle(self, current_scene_map_points,size,scale,displacement):
-        obstacle_len = len(self.occupancy_map_points)
-        self.occupancy_map_points = self.union(self.occupancy_map_points, current_scene_map_points)
-        obstacle_len_updated = len(self.occupancy_map_points)
-        if obstacle_len_updated > obstacle_len :
-            self.calculate_bounding_box(size,scale,displacement)
-            self.calculate_centre()
+    @property
+    def occupancy_map_points(self):
+        return self.occupancy.points()
+
+    @property
+    def bounding_box(self):
+        if self._bounding_box is None:
+            self.calculate_bounding_box()
+        return self._bounding_box
+
+    @property
+    def parent_bounding_box(self):
+        if self._parent_bounding_box is None:
+            self.calculate_parent_bounding_box()
+        return self._parent_bounding_box
+
+    @parent_bounding_box.setter
+    def parent_bounding_box(self, polygon):
+        self._parent_bounding_box = polygon
+
+    @property
+    def centre_x(self):
+        return self.get_centre()[0]
+
+    @property
+    def centre_y(self):
+        return self.get_centre()[1]
+
+    @property
+    def centre_z(self):
+        return self.get_centre()[2]
+
+    def expand_obstacle(self, current_scene_map_points,size=None,scale=None,displacement=None):
+        # takes another obstacle's OccupancyBitmap or occupancy map points
+        if not isinstance(current_scene_map_points, OccupancyBitmap):
+            current_scene_map_points = OccupancyBitmap(current_scene_map_points)
+        obstacle_len = len(self.occupancy)
+        self.occupancy = self.occupancy | current_scene_map_points
+        if len(self.occupancy) > obstacle_len :
+            self._bounding_box = None
+            self._centre = None
 
     def set_parent_obstacle_points (self,new_occupancy_map_points):
-        obstacle_len = len(self.parent_occupancy_map_points)
-        self.parent_occupancy_map_points = self.union(self.occupancy_map_points,self.parent_occupancy_map_points)
-        self.parent_occupancy_map_points = self.union(new_occupancy_map_points,self.parent_occupancy_map_points)
-        obstacle_len_updated = len(self.parent_occupancy_map_points)
-        if obstacle_len_updated > obstacle_len :
-            self.calculate_parent_bounding_box(size,scale,displacement)
-            self.calculate_parent_centre()
-
-    def calculate_parent_bounding_box(self,size,scale_displacement):
-        obj_occ_map = get_occupancy_from_points( self.parent_occupancy_map_points,size)   
-        self.parent_bounding_box = polygon_simplify(occupancy_to_polygons(obj_occ_map,scale,displacement ))
+        if not isinstance(new_occupancy_map_points, OccupancyBitmap):
+            new_occupancy_map_points = OccupancyBitmap(new_occupancy_map_points)
+        obstacle_len = len(self.parent_occupancy)
+        self.parent_occupancy = self.parent_occupancy | self.occupancy | new_occupancy_map_points
+        if len(self.parent_occupancy) > obstacle_len :
+            self._parent_bounding_box = None
+
+    def calculate_parent_bounding_box(self):
+        self._parent_bounding_box = polygon_simplify(self.parent_occupancy.to_polygons(self.scale, self.displacement))
     
-    def calculate_bounding_box(self,size, scale,displacement):   
-        obj_occ_map = get_occupancy_from_points( self.occupancy_map_points,size)   
-        self.bounding_box = polygon_simplify(occupancy_to_polygons(obj_occ_map,scale,displacement ))
+    def calculate_bounding_box(self):   
+        self._bounding_box = polygon_simplify(self.occupancy.to_polygons(self.scale, self.displacement))
 
     def calculate_centre(self):
         exterior_coords = self.get_convex_polygon_coords()
-        self.centre_x = np.mean(np.array(exterior_coords[0],dtype=object))
-        self.centre_z = np.mean(np.array(exterior_coords[1],dtype=object))
+        # mean of the vertices without the ring's closing point, so that it
+        # doesn't depend on which vertex the ring starts at
+        centre_x = np.mean(np.array(exterior_coords[0][:-1],dtype=object))
+        centre_z = np.mean(np.array(exterior_coords[1][:-1],dtype=object))
         if self.height < 0.5 :
-            self.centre_y = self.height / 2.0
+            centre_y = self.height / 2.0
         else :
-            self.centre_y = self.height / 4.0
+            centre_y = self.height / 4.0
+        self._centre = (centre_x, centre_y, centre_z)
 
     def set_height(self,height):
         self.height = height
-        self.calculate_centre()
+        self._centre = None
 
     def get_convex_polygon_coords(self):
         if self.bounding_box.geom_type == "MultiPolygon":
@@ -99,10 +180,12 @@ class Obstacle():
             
         
     def get_occupancy_map_points(self):
-        return self.occupancy_map_points
+        return self.occupancy.points()
 
     def get_centre(self):
-        return (self.centre_x,self.centre_y,self.centre_z)
+        if self._centre is None:
+            self.calculate_centre()
+        return self._centre
 
     def get_bounding_box(self): 
         return self.bounding_box
@@ -14,6 +14,7 @@ from shapely import affinity
 #from tasks.search_object_in_receptacle.face_turner import FaceTurnerResNet
 from MCS_exploration.frame_processing import *
 from MCS_exploration.navigation.visibility_road_map import ObstaclePolygon,IncrementalVisibilityRoadMap
+from next_best_view import NextBestView
 from shapely.geometry import Point, MultiPoint
 import operator
 from functools import reduce
@@ -30,6 +31,7 @@ class SequenceGenerator(object):
         self.count = -1
         self.scene_name = None
         self.outermost_poly = None
+        self.next_best_view = NextBestView(self.game_state.coverage_map)
 
     def run_scene(self,scene_config,config_filename=None,frame_collector=None):
         try :
@@ -45,6 +47,7 @@ class SequenceGenerator(object):
         self.scene_name = 'transferral_data'
         # print('New episode. Scene %s' % self.scene_name)
         self.agent.reset(self.scene_name, config_filename=config_filename, event=event)
+        self.next_best_view.reset()
 
         self.position = self.agent.game_state.position
         self.event = self.agent.game_state.event
@@ -108,11 +111,11 @@ class SequenceGenerator(object):
         if self.agent.game_state.trophy_picked_up == True:
             return
     
-        overall_area = 102
+        coverage_map = self.agent.game_state.coverage_map
         pose = game_util.get_pose(self.game_state)[:3]
-        #print ("overall area",overall_area)
-        #print (" poly area " , self.agent.game_state.world_poly.area)
-        while overall_area * 0.85 >  self.agent.game_state.world_poly.area or len(self.agent.game_state.global_obstacles) == 0 :
+        #print ("free area",coverage_map.free_area)
+        #print (" seen area " , coverage_map.area)
+        while coverage_map.free_area * 0.85 >  coverage_map.area or len(self.agent.game_state.global_obstacles) == 0 :
             #print ("In the main for loop of executtion")
             points_checked = 0
             #z+=1
@@ -123,21 +126,18 @@ class SequenceGenerator(object):
             min_distance = 20
             while (len(max_visible_position) == 0):
                 max_visible = 0
-                for elem in exploration_routine:
-                    distance_to_point = math.sqrt((pose[0] - elem[0])**2 + (pose[1]-elem[1])**2)
-
-                    if distance_to_point > min_distance and elem not in processed_points:
-                        points_checked += 1
-                        #for obstacle_key, obstacle in self.agent.nav.scene_obstacles_dict.items():
-                        #    if obstacle.contains_goal(elem):
-                        #        continue
-
-                        new_visible_area = cover_floor.get_point_all_new_coverage(elem[0]*constants.AGENT_STEP_SIZE, elem[1]*constants.AGENT_STEP_SIZE, self.agent.game_state,self.agent.game_state.rotation,self.agent.nav.scene_obstacles_dict.values() )
-                        processed_points[elem] = new_visible_area
-                        #if max_visible < number_visible_points/math.sqrt((pose[0]-elem[0])**2 + (pose[1]-elem[1])**2):
-                        if max_visible < new_visible_area: #and abs(max_visible_points[-1][0] - elem[0]) > 2 and  :
-                            max_visible_position.append(elem)
-                            max_visible = new_visible_area
+                candidates = [elem for elem in exploration_routine
+                              if math.sqrt((pose[0] - elem[0])**2 + (pose[1]-elem[1])**2) > min_distance and elem not in processed_points]
+                new_visible_areas = self.next_best_view.score(
+                    [(elem[0]*constants.AGENT_STEP_SIZE, elem[1]*constants.AGENT_STEP_SIZE) for elem in candidates],
+                    self.agent.nav.scene_obstacles_dict.values())
+                for elem, new_visible_area in zip(candidates, new_visible_areas):
+                    points_checked += 1
+                    processed_points[elem] = new_visible_area
+                    #if max_visible < number_visible_points/math.sqrt((pose[0]-elem[0])**2 + (pose[1]-elem[1])**2):
+                    if max_visible < new_visible_area: #and abs(max_visible_points[-1][0] - elem[0]) > 2 and  :
+                        max_visible_position.append(elem)
+                        max_visible = new_visible_area
 
                 min_distance = min_distance/2
                 if min_distance < 1 :
@@ -2,14 +2,36 @@ import machine_common_sense as mcs
 import yaml
 import pickle
 import os
+import time
 import random
 import argparse, configparser
-from exploration.controller_agent import ExploreAgent
-from MCS_exploration.sequence_generator import SequenceGenerator
-from voe.voe_agent import VoeAgent
-from voe.agency_voe_agent import AgencyVoeAgent
-import physics_voe_agent
-import gravity_agent
+
+
+# Each agent (and the models / heavy libraries it pulls in) is only imported
+# and built the first time a scene of its goal type shows up.
+def make_exploration_agent(controller, level, prefix):
+    from MCS_exploration.sequence_generator import SequenceGenerator
+    return SequenceGenerator(None, controller, level)
+
+def make_agency_agent(controller, level, prefix):
+    from voe.agency_voe_agent import AgencyVoeAgent
+    return AgencyVoeAgent(controller, level)
+
+def make_gravity_agent(controller, level, prefix):
+    import gravity_agent
+    return gravity_agent.GravityAgent(controller, level)
+
+def make_physics_voe_agent(controller, level, prefix):
+    import physics_voe_agent
+    return physics_voe_agent.VoeAgent(controller, level, prefix)
+
+AGENT_FACTORIES = {
+    "exploration": make_exploration_agent,
+    "agency": make_agency_agent,
+    "gravity": make_gravity_agent,
+    "physics_voe": make_physics_voe_agent,
+}
+
 
 class Evaluation3_Agent:
 
@@ -27,23 +49,70 @@ class Evaluation3_Agent:
         config_ini = configparser.ConfigParser()
         config_ini.read(config_path)
 
+        self.startup_times = {}
+        start_time = time.time()
         self.controller = mcs.create_controller(
             os.path.join(config['unity_path']),
             config_file_path=config_path
         )
+        self.startup_times["controller"] = time.time() - start_time
 
         self.level = config_ini['MCS']['metadata']
         assert self.level in ['oracle', 'level1', 'level2']
 
-        self.exploration_agent = SequenceGenerator(None, self.controller, self.level)
+        self.prefix = prefix
         self.scene_type = scene_type
-        # self.agency_voe_agent = AgencyVoeAgent(self.controller, self.level)
-        self.gravity_agent = gravity_agent.GravityAgent(self.controller, self.level)
-        self.phys_voe = physics_voe_agent.VoeAgent(self.controller, self.level, prefix)
+        self.agents = {}
 
         if seed != -1:
             random.seed(seed)
 
+    def get_agent(self, name):
+        '''
+        Returns the agent for `name`, building it (and loading its models) on first use
+        '''
+        if name not in self.agents:
+            start_time = time.time()
+            self.agents[name] = AGENT_FACTORIES[name](self.controller, self.level, self.prefix)
+            self.startup_times[name] = time.time() - start_time
+            print("Loaded {} agent in {:.3f}s".format(name, self.startup_times[name]))
+        return self.agents[name]
+
+    @property
+    def exploration_agent(self):
+        return self.get_agent("exploration")
+
+    @property
+    def agency_voe_agent(self):
+        return self.get_agent("agency")
+
+    @property
+    def gravity_agent(self):
+        return self.get_agent("gravity")
+
+    @property
+    def phys_voe(self):
+        return self.get_agent("physics_voe")
+
+    def report_startup_times(self):
+        print("\nStartup time per component:")
+        for name, duration in self.startup_times.items():
+            print("  {:<12} {:.3f}s".format(name, duration))
+        print("  {:<12} {:.3f}s".format("total", sum(self.startup_times.values())))
+
+        if self.agents:
+            from vision import model_registry
+            model_registry.memory_report()
+
+    def close(self):
+        '''
+        Shuts down the worker pools the agents hold
+        '''
+        for agent in self.agents.values():
+            if hasattr(agent, "close"):
+                agent.close()
+        self.agents = {}
+
     def run_scene(self, one_scene):
         scene_config, status = mcs.load_scene_json_file(one_scene)
         if scene_config == {}:
@@ -91,5 +160,10 @@ if __name__ == "__main__":
     random.shuffle(all_scenes)
 
     results = {}
-    for one_scene in all_scenes:
-        voe = agent.run_scene(one_scene)
+    try:
+        for one_scene in all_scenes:
+            voe = agent.run_scene(one_scene)
+
+        agent.report_startup_times()
+    finally:
+        agent.close()
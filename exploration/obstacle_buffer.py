@@ -2,7 +2,7 @@ from exploration.roadmap.visibility_road_map import ObstaclePolygon
 from exploration.util import pre_process, depth_to_points
 import numpy as np
 import sys
-from vision.instSeg.inference import MaskAndClassPredictor
+from vision import model_registry
 import matplotlib.pyplot as plt
 from vision.instSeg.data.config_mcsVideo3_inter import MCSVIDEO_INTER_CLASSES_FG
 
@@ -48,7 +48,7 @@ class ObstacleBuffer:
         self.scene_obstacles_dict = None
         if self.level != 'oracle':
             self.occupancy_map = OccupancyMap()
-            self.mask_predictor = MaskAndClassPredictor()
+            self.mask_predictor = model_registry.get_mask_predictor()
 
     def reset(self):
         self.scene_obstacles_dict = {}
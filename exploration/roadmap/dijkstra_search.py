@@ -4,7 +4,10 @@ author: Atsushi Sakai (@Atsushi_twi)
 """
 
 import matplotlib.pyplot as plt
+import heapq
+import itertools
 import math
+import time
 import numpy as np
 
 
@@ -38,6 +41,78 @@ class DijkstraSearch:
         node_x: node x position
         node_y: node y position
         edge_ids_list: edge_list each item includes a list of edge ids
+
+        A* with a binary heap. The search starts from the first node within
+        0.1 of the start and ends at the first node within 0.1 of the goal
+        it closes. The heuristic is the distance to that goal disc, so it is
+        0 on every node that counts as the goal, and they are closed in order
+        of cost as in plain Dijkstra.
+        """
+
+        node_x = np.array(node_x, dtype=float)
+        node_y = np.array(node_y, dtype=float)
+        goal_dist = np.hypot(node_x - gx, node_y - gy)
+        heuristic = np.maximum(goal_dist - 0.1, 0.0)
+        at_goal = goal_dist <= 0.1
+
+        start_ids = np.flatnonzero(np.hypot(node_x - sx, node_y - sy) <= 0.1)
+        if len(start_ids) == 0:
+            raise ValueError("Cannot reach goal")
+        start_id = start_ids[0]
+        # the path starts from the exact start position
+        node_x[start_id], node_y[start_id] = sx, sy
+
+        cost = np.full(len(node_x), np.inf)
+        parent = np.full(len(node_x), -1)
+        closed = np.zeros(len(node_x), dtype=bool)
+        cost[start_id] = 0.0
+        counter = itertools.count()
+        open_heap = [(heuristic[start_id], next(counter), start_id)]
+
+        while open_heap:
+            _, _, current_id = heapq.heappop(open_heap)
+            if closed[current_id]:
+                continue
+            closed[current_id] = True
+
+            # show graph
+            if self.show_animation and np.count_nonzero(closed) % 2 == 0:  # pragma: no cover
+                plt.plot(node_x[current_id], node_y[current_id], "xg")
+                # for stopping simulation with the esc key.
+                plt.gcf().canvas.mpl_connect(
+                    'key_release_event',
+                    lambda event: [exit(0) if event.key == 'escape' else None])
+                plt.pause(1)
+
+            if at_goal[current_id]:
+                # the goal position takes the place of the node that reached it
+                rx, ry = [gx], [gy]
+                n_id = parent[current_id]
+                while n_id != -1:
+                    rx.append(float(node_x[n_id]))
+                    ry.append(float(node_y[n_id]))
+                    n_id = parent[n_id]
+                return rx[::-1], ry[::-1]
+
+            n_ids = np.asarray(edge_ids_list[current_id], dtype=int)
+            if len(n_ids) == 0:
+                continue
+            n_ids = n_ids[~closed[n_ids]]
+            d = cost[current_id] + np.hypot(node_x[n_ids] - node_x[current_id],
+                                            node_y[n_ids] - node_y[current_id])
+            better = d < cost[n_ids]
+            for n_id, n_cost in zip(n_ids[better].tolist(), d[better].tolist()):
+                if n_cost < cost[n_id]:
+                    cost[n_id] = n_cost
+                    parent[n_id] = current_id
+                    heapq.heappush(open_heap, (n_cost + heuristic[n_id], next(counter), n_id))
+
+        raise ValueError("Cannot reach goal")
+
+    def search_linear(self, sx, sy, gx, gy, node_x, node_y, edge_ids_list):
+        """
+        Previous Dijkstra search, scanning the open set for its cheapest node.
+        Kept as the reference for benchmark()
         """
 
         start_node = self.Node(sx, sy, 0.0, -1)
@@ -134,3 +209,39 @@ class DijkstraSearch:
         #dist = np.hypot(node_a.x - node_b.x,
         #                node_b.y - node_b.y)
         return dist <= 0.1
+
+
+def random_roadmap(n_nodes, radius=15.0, seed=0):
+    rng = np.random.RandomState(seed)
+    node_x = rng.uniform(0, 100, n_nodes)
+    node_y = rng.uniform(0, 100, n_nodes)
+    d = np.hypot(node_x[:, None] - node_x, node_y[:, None] - node_y)
+    edge_ids_list = [np.flatnonzero((row <= radius) & (row > 0)).tolist() for row in d]
+    return node_x.tolist(), node_y.tolist(), edge_ids_list
+
+
+def benchmark(sizes=(100, 300, 600), n_queries=20):
+    search = DijkstraSearch(False)
+    for n_nodes in sizes:
+        node_x, node_y, edge_ids_list = random_roadmap(n_nodes)
+        rng = np.random.RandomState(n_nodes)
+        queries = [rng.choice(n_nodes, 2, replace=False) for _ in range(n_queries)]
+        times = {}
+        paths = {}
+        for name, method in (("linear", search.search_linear), ("heap", search.search)):
+            start_time = time.time()
+            paths[name] = []
+            for s, g in queries:
+                try:
+                    paths[name].append(method(node_x[s], node_y[s], node_x[g], node_y[g], node_x, node_y, edge_ids_list))
+                except ValueError:
+                    paths[name].append(None)
+            times[name] = (time.time() - start_time) / n_queries
+        same = sum(np.allclose(a, b) if a is not None and b is not None else a is b
+                   for a, b in zip(paths["linear"], paths["heap"]))
+        print("{} nodes, {} edges: linear {:.2f} ms, heap {:.2f} ms, {}/{} identical paths".format(
+            n_nodes, sum(map(len, edge_ids_list)), 1000 * times["linear"], 1000 * times["heap"], same, n_queries))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -6,21 +6,49 @@ import numpy as np
 import os
 import json
 
-def render_in_pybullet(step_output, target, supporting, level):
-    # physicsClient = p.connect(p.GUI)#or p.DIRECT for non-graphical version
-    physicsClient = p.connect(p.DIRECT)
-
-    p.setAdditionalSearchPath(os.getcwd() + "/gravity/pybullet_objects/") #optionally
-    p.setGravity(0,0,-10)
-    planeId = p.loadURDF("plane100.urdf")
-    print(planeId)
-    
-    p.resetDebugVisualizerCamera(3, 0, -42.5, [0,0,0])
+SIM_STEPS = 750
+# Fast-forward mode: state is recorded every RECORD_EVERY steps and the
+# simulation stops once the target has been at rest for REST_STEPS steps.
+RECORD_EVERY = 5
+MIN_SIM_STEPS = 60
+REST_STEPS = 30
+REST_LIN_VEL = 1e-3
+REST_ANG_VEL = 1e-2
+
+_physics_client = None
+
+
+def get_physics_client():
+    '''
+    Returns a persistent DIRECT client, emptied with resetSimulation for every call
+    '''
+    global _physics_client
+    if _physics_client is None or not p.isConnected(_physics_client):
+        _physics_client = p.connect(p.DIRECT)
+    p.resetSimulation(physicsClientId=_physics_client)
+    p.setAdditionalSearchPath(os.getcwd() + "/gravity/pybullet_objects/", physicsClientId=_physics_client)
+    p.setGravity(0, 0, -10, physicsClientId=_physics_client)
+    return _physics_client
+
+
+def target_at_rest(body_id, client):
+    lin_vel, ang_vel = p.getBaseVelocity(body_id, physicsClientId=client)
+    return np.linalg.norm(lin_vel) < REST_LIN_VEL and np.linalg.norm(ang_vel) < REST_ANG_VEL
+
+
+def render_in_pybullet(step_output, target, supporting, level, fast_forward=True):
+    '''
+    Simulates the target being dropped on the support. With `fast_forward`
+    the simulation runs without sleeping, records every RECORD_EVERY steps
+    and stops early once the target comes to rest; otherwise every one of
+    the SIM_STEPS steps is recorded in (roughly) real time.
+    '''
+    physicsClient = get_physics_client()
+    planeId = p.loadURDF("plane100.urdf", physicsClientId=physicsClient)
     
     # get objects from output
     obj_dict = {}
-    boxId = createObjectShape(step_output["structural_object_list"][supporting])
-    print(boxId)
+    boxId = createObjectShape(step_output["structural_object_list"][supporting], physicsClient)
     if boxId == -1:
         print("trouble building supporting object")
     else:
@@ -30,11 +58,7 @@ def render_in_pybullet(step_output, target, supporting, level):
         "pos": []
         }
 
-    # print(json.dumps(step_output["object_list"][target], indent=4))
-    # print(json.dumps(step_output["structural_object_list"][supporting], indent=4))
-    # quit()
-    boxId = createObjectShape(step_output["object_list"][target])
-    print(boxId)
+    boxId = createObjectShape(step_output["object_list"][target], physicsClient)
     
     if boxId == -1:
         print("trouble building target object")
@@ -49,40 +73,48 @@ def render_in_pybullet(step_output, target, supporting, level):
             "aabbMax": []
         }
 
-    # p.setRealTimeSimulation()
-    for i in range(750):
-        p.stepSimulation()
-        time.sleep(1./400.)
-    
-        # confirm there aren't any overlaps on target object
-        aabb_min, aabb_max = p.getAABB(obj_dict[target]["boxID"])
-        overlaps = p.getOverlappingObjects(aabb_min, aabb_max)
-        # print("overlaps", overlaps)
-        
-        # get contact points between target and supporting
-        object_contact = p.getContactPoints(obj_dict[target]["boxID"], obj_dict[supporting]["boxID"])
-        floor_contact = p.getContactPoints(obj_dict[target]["boxID"], planeId)
-        # if contact != ():
-        #     print("support and target are making contact")
-        #     print(contact)
-
-        # keep track of obj position
-        for obj in obj_dict:
-            if obj == target:
-                obj_dict[obj]["support_contact"].append(object_contact)
-                obj_dict[obj]["floor_contact"].append(floor_contact)
-                obj_dict[obj]["aabbMin"].append(aabb_min)
-                obj_dict[obj]["aabbMax"].append(aabb_max)
-            cubePos, cubeOrn = p.getBasePositionAndOrientation(obj_dict[obj]["boxID"])
-            obj_dict[obj]["pos"].append(cubePos)
-            obj_dict[obj]["orn"].append(cubeOrn)
-
-    p.disconnect()
-
-    if level == "oracle":
-        return obj_dict
-    else:
-        return obj_dict
+    record_every = RECORD_EVERY if fast_forward else 1
+    rest_count = 0
+    for i in range(SIM_STEPS):
+        p.stepSimulation(physicsClientId=physicsClient)
+        if not fast_forward:
+            time.sleep(1./400.)
+
+        if fast_forward and i >= MIN_SIM_STEPS:
+            if target_at_rest(obj_dict[target]["boxID"], physicsClient):
+                rest_count += 1
+            else:
+                rest_count = 0
+        at_rest = rest_count >= REST_STEPS
+        is_last = at_rest or i == SIM_STEPS - 1
+
+        if i % record_every == 0 or is_last:
+            record_state(obj_dict, target, supporting, planeId, physicsClient)
+
+        if at_rest:
+            break
+
+    return obj_dict
+
+
+def record_state(obj_dict, target, supporting, planeId, physicsClient):
+    target_id = obj_dict[target]["boxID"]
+    aabb_min, aabb_max = p.getAABB(target_id, physicsClientId=physicsClient)
+
+    # get contact points between target and supporting
+    object_contact = p.getContactPoints(target_id, obj_dict[supporting]["boxID"], physicsClientId=physicsClient)
+    floor_contact = p.getContactPoints(target_id, planeId, physicsClientId=physicsClient)
+
+    # keep track of obj position
+    for obj in obj_dict:
+        if obj == target:
+            obj_dict[obj]["support_contact"].append(object_contact)
+            obj_dict[obj]["floor_contact"].append(floor_contact)
+            obj_dict[obj]["aabbMin"].append(aabb_min)
+            obj_dict[obj]["aabbMax"].append(aabb_max)
+        cubePos, cubeOrn = p.getBasePositionAndOrientation(obj_dict[obj]["boxID"], physicsClientId=physicsClient)
+        obj_dict[obj]["pos"].append(cubePos)
+        obj_dict[obj]["orn"].append(cubeOrn)
 
 def getDims(obj):
     dims = obj["dimensions"]
@@ -118,7 +150,7 @@ def getColor(color_vals):
     colors.append(1)
     return colors
 
-def createObjectShape(obj):
+def createObjectShape(obj, physicsClient=0):
     meshScale = getDims(obj)
     print(meshScale)
     if obj["shape"] != "structural":
@@ -153,29 +185,68 @@ def createObjectShape(obj):
     # create visual and colision shapes
     print("obj shape", obj["shape"])
     if obj["shape"] == "cube" or obj["shape"] == "structural":
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cube.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cube.obj", collisionFramePosition=shift,meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cube.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cube.obj", collisionFramePosition=shift,meshScale=meshScale, physicsClientId=physicsClient)
     elif obj["shape"] == "square frustum":
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="square_frustum.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="square_frustum.obj", collisionFramePosition=shift, meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="square_frustum.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="square_frustum.obj", collisionFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
     elif obj["shape"] == "circle frustum":
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="circle_frustum.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="circle_frustum.obj", collisionFramePosition=shift,meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="circle_frustum.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="circle_frustum.obj", collisionFramePosition=shift,meshScale=meshScale, physicsClientId=physicsClient)
     elif obj["shape"] == "cylinder":
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cylinder.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cylinder.obj", collisionFramePosition=shift,meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cylinder.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cylinder.obj", collisionFramePosition=shift,meshScale=meshScale, physicsClientId=physicsClient)
     elif "letter l" in obj["shape"]:
         meshScale = [meshScale[0], meshScale[1], meshScale[2] * 0.75] # hard coded transformations to compensate for unknown wonkiness... needs to be tested
         start_orientation = [start_orientation[0], start_orientation[1], 90, 0.011]
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="l_joint.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="l_joint.obj", collisionFramePosition=shift, meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="l_joint.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="l_joint.obj", collisionFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
     elif "triangular prism" == obj["shape"]:
         meshScale = [meshScale[1], meshScale[2], meshScale[0]]
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="triangular prism.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="triangular prism.obj", collisionFramePosition=shift, meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="triangular prism.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="triangular prism.obj", collisionFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
     else:
-        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cube.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale)
-        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cube.obj", collisionFramePosition=shift, meshScale=meshScale)
+        visualShapeId = p.createVisualShape(shapeType=p.GEOM_MESH,fileName="cube.obj", rgbaColor=rgba_color, specularColor=[0.4,.4,0], visualFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
+        collisionShapeId = p.createCollisionShape(shapeType=p.GEOM_MESH, fileName="cube.obj", collisionFramePosition=shift, meshScale=meshScale, physicsClientId=physicsClient)
     # return body
-    return p.createMultiBody(baseMass=obj["mass"], baseOrientation=start_orientation, baseInertialFramePosition=[0, 0, 0], baseCollisionShapeIndex=collisionShapeId, baseVisualShapeIndex=visualShapeId, basePosition=start_position)
+    return p.createMultiBody(baseMass=obj["mass"], baseOrientation=start_orientation, baseInertialFramePosition=[0, 0, 0], baseCollisionShapeIndex=collisionShapeId, baseVisualShapeIndex=visualShapeId, basePosition=start_position, physicsClientId=physicsClient)
     
+
+
+def _box_object(center, size, shape, mass):
+    (cx, cy, cz), (w, h, d) = center, size
+    corners = [
+        {"x": cx + sx * w / 2, "y": cy + sy * h / 2, "z": cz + sz * d / 2}
+        for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)
+    ]
+    return {
+        "dimensions": corners,
+        "position": {"x": cx, "y": cy, "z": cz},
+        "rotation": {"x": 0, "y": 0, "z": 0},
+        "color": {"r": 255, "g": 0, "b": 0},
+        "shape": shape,
+        "mass": mass
+    }
+
+
+def benchmark(n_runs=5):
+    '''
+    Times the real-time simulation against fast-forward on a cube dropped on a support.
+    Run from the repo root: python -m gravity.pybullet_utilities
+    '''
+    step_output = {
+        "structural_object_list": {"support": _box_object((0, 0.5, 1), (1, 1, 1), "cube", 100)},
+        "object_list": {"target": _box_object((0.1, 2.0, 1), (0.3, 0.3, 0.3), "cube", 4.0)}
+    }
+    for fast_forward in [False, True]:
+        start_time = time.time()
+        for _ in range(n_runs):
+            obj_dict = render_in_pybullet(step_output, "target", "support", "level2", fast_forward)
+        duration = (time.time() - start_time) / n_runs
+        print("fast_forward={}: {:.4f}s per scene, {} recorded states, final target pos {}".format(
+            fast_forward, duration, len(obj_dict["target"]["pos"]),
+            np.round(obj_dict["target"]["pos"][-1], 3).tolist()))
+
+
+if __name__ == "__main__":
+    benchmark()
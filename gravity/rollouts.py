@@ -0,0 +1,165 @@
+'''
+Batched "what-if" rollouts of the gravity scene.
+
+Instead of trusting a single guess of the target & support geometry, a
+batch of perturbed initial conditions (position jitter, dimension
+uncertainty, alternative shape kinds) is simulated in worker processes
+and summarised as a distribution of resting states.
+'''
+import copy
+import multiprocessing
+import os
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from gravity import pybullet_utilities
+
+N_ROLLOUTS = 16
+POS_JITTER = 0.05  # std dev of the target's start position, in meters
+DIM_JITTER = 0.1  # std dev of the relative error on target & support dimensions
+ALT_KIND_PROB = 0.25  # chance to swap the perceived target kind for one of `kinds`
+# Shapes render_in_pybullet has meshes for, used when the perceived kind is uncertain
+ROLLOUT_KINDS = ["cube", "cylinder", "square frustum", "circle frustum", "triangular prism"]
+
+
+@dataclass
+class RolloutResult:
+    obj_dict: dict
+    final_pos: tuple
+    on_support: bool
+    on_floor: bool
+
+
+@dataclass
+class RolloutDistribution:
+    rollouts: List[RolloutResult]
+
+    @property
+    def nominal(self):
+        '''
+        Rollout of the unperturbed initial conditions
+        '''
+        return self.rollouts[0].obj_dict
+
+    @property
+    def final_positions(self):
+        return np.array([r.final_pos for r in self.rollouts])
+
+    @property
+    def support_prob(self):
+        return np.mean([r.on_support for r in self.rollouts])
+
+    @property
+    def floor_prob(self):
+        return np.mean([r.on_floor for r in self.rollouts])
+
+    def agreement(self, unity_on_support, unity_on_floor):
+        '''
+        Fraction of rollouts whose resting state agrees with what Unity showed
+        '''
+        return np.mean([
+            not (unity_on_floor ^ r.on_floor) or not (unity_on_support ^ r.on_support)
+            for r in self.rollouts
+        ])
+
+
+def _scale_dimensions(obj, scale):
+    center = {
+        k: sum(pt[k] for pt in obj["dimensions"]) / len(obj["dimensions"])
+        for k in ["x", "y", "z"]
+    }
+    obj["dimensions"] = [
+        {k: center[k] + (pt[k] - center[k]) * s for k, s in zip(["x", "y", "z"], scale)}
+        for pt in obj["dimensions"]
+    ]
+
+
+def perturb_step_output(step_output, target, supporting, rng, kinds=None):
+    '''
+    Returns a copy of `step_output` with jittered target position and
+    target / support dimensions, and possibly an alternative target kind
+    '''
+    perturbed = copy.deepcopy(step_output)
+    target_obj = perturbed["object_list"][target]
+    support_obj = perturbed["structural_object_list"][supporting]
+
+    target_obj["position"] = {
+        k: v + rng.normal(0, POS_JITTER) for k, v in target_obj["position"].items()
+    }
+    _scale_dimensions(target_obj, 1 + rng.normal(0, DIM_JITTER, 3))
+    _scale_dimensions(support_obj, 1 + rng.normal(0, DIM_JITTER, 3))
+
+    if kinds and rng.random() < ALT_KIND_PROB:
+        target_obj["shape"] = kinds[rng.integers(len(kinds))]
+
+    return perturbed
+
+
+def _init_worker():
+    # A worker must not reuse the parent's physics client
+    pybullet_utilities._physics_client = None
+
+
+def _run_rollout(args):
+    step_output, target, supporting, level = args
+    obj_dict = pybullet_utilities.render_in_pybullet(step_output, target, supporting, level)
+
+    on_support = obj_dict[target]["support_contact"][-1] != ()
+    on_floor = obj_dict[target]["floor_contact"][-1] != ()
+    # target is on floor and touching support, not on support
+    if on_floor and on_support:
+        on_support = False
+
+    return RolloutResult(
+        obj_dict=obj_dict,
+        final_pos=obj_dict[target]["pos"][-1],
+        on_support=on_support,
+        on_floor=on_floor
+    )
+
+
+class RolloutEngine:
+    '''
+    Owns the worker pool for the whole evaluation. Workers are spawned, not
+    forked, so they don't inherit the models and threads the agents load
+    in the parent. Call `close` when done.
+    '''
+
+    def __init__(self, n_rollouts=N_ROLLOUTS, n_workers=None, seed=0):
+        self.n_rollouts = n_rollouts
+        self.n_workers = n_workers or min(os.cpu_count() or 1, n_rollouts)
+        self.rng = np.random.default_rng(seed)
+        self.pool = None
+        if self.n_workers > 1:
+            self.pool = multiprocessing.get_context("spawn").Pool(self.n_workers, initializer=_init_worker)
+
+    def run(self, step_output, target, supporting, level, kinds=None):
+        '''
+        Simulates the nominal scene plus `n_rollouts - 1` perturbed ones
+        '''
+        # Only ship the two simulated objects to the workers
+        step_output = {
+            "object_list": {target: step_output["object_list"][target]},
+            "structural_object_list": {supporting: step_output["structural_object_list"][supporting]}
+        }
+        jobs = [(step_output, target, supporting, level)]
+        jobs += [
+            (perturb_step_output(step_output, target, supporting, self.rng, kinds),
+             target, supporting, level)
+            for _ in range(self.n_rollouts - 1)
+        ]
+
+        if self.pool is None:
+            results = [_run_rollout(job) for job in jobs]
+        else:
+            results = self.pool.map(_run_rollout, jobs)
+
+        return RolloutDistribution(rollouts=results)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,113 @@
+'''
+Trajectory comparison between the physics simulator and Unity.
+
+DTW over numpy arrays: the simulator trajectory is resampled to a fixed
+number of points, and the Unity trajectory is streamed in one frame at a
+time, each frame adding one row to the cost matrix. A comparison is
+abandoned as soon as its distance can no longer end up below `threshold`.
+'''
+import numpy as np
+
+REF_SAMPLES = 100
+
+
+def resample(traj, n_samples=REF_SAMPLES):
+    '''
+    Linearly interpolates `traj` (N x D) to `n_samples` points evenly spaced in time
+    '''
+    traj = np.asarray(traj, dtype=float)
+    if len(traj) == n_samples:
+        return traj
+    t_old = np.linspace(0, 1, len(traj))
+    t_new = np.linspace(0, 1, n_samples)
+    return np.stack([np.interp(t_new, t_old, traj[:, d]) for d in range(traj.shape[1])], axis=1)
+
+
+def _dtw_row(prev_row, cost):
+    '''
+    Next row of the accumulated cost matrix.
+    D[j] = cost[j] + min(prev[j - 1], prev[j], D[j - 1]) is solved for the
+    whole row at once: with C = cumsum(cost), D = C + cummin(t - C) where t
+    holds the costs of entering each cell from the previous row.
+    '''
+    from_prev = np.minimum(prev_row, np.concatenate(([np.inf], prev_row[:-1])))
+    t = cost + from_prev
+    c = np.cumsum(cost)
+    return c + np.minimum.accumulate(t - c)
+
+
+class StreamingDTW:
+
+    def __init__(self, reference, n_samples=REF_SAMPLES, threshold=np.inf):
+        self.reference = resample(reference, n_samples)
+        self.threshold = threshold
+        self.n_frames = 0
+        self.abandoned = False
+        # Virtual row 0: the alignment has to start at the first reference point
+        self.row = np.full(len(self.reference), np.inf)
+
+    def update(self, point):
+        '''
+        Adds one Unity frame, returns the distance of the trajectory seen so far
+        '''
+        if self.abandoned:
+            return np.inf
+
+        cost = np.linalg.norm(self.reference - np.asarray(point, dtype=float), axis=1)
+        if self.n_frames == 0:
+            self.row = np.cumsum(cost)
+        else:
+            self.row = _dtw_row(self.row, cost)
+        self.n_frames += 1
+
+        # Every warping path crosses every row and costs are non-negative
+        if self.row.min() > self.threshold:
+            self.abandoned = True
+
+        return self.distance
+
+    def extend(self, points):
+        for point in points:
+            if self.update(point) == np.inf:
+                break
+        return self.distance
+
+    @property
+    def distance(self):
+        if self.abandoned or self.n_frames == 0:
+            return np.inf
+        return self.row[-1]
+
+
+def dtw_distance(reference, query, n_samples=REF_SAMPLES, threshold=np.inf):
+    '''
+    DTW distance between the resampled `reference` and `query`, `inf` once above `threshold`
+    '''
+    return StreamingDTW(reference, n_samples, threshold).extend(query)
+
+
+def benchmark(n_runs=20):
+    '''
+    Compares against fastdtw on a simulated drop. Run from the repo root: python -m gravity.trajectory
+    '''
+    import time
+    from fastdtw import fastdtw
+    from scipy.spatial.distance import euclidean
+
+    t = np.linspace(0, 1, 750)
+    pybullet_traj = np.stack([0.1 * t, np.zeros_like(t), np.maximum(2 - 5 * t ** 2, 1)], axis=1)
+    unity_traj = pybullet_traj[::15] + np.random.default_rng(0).normal(0, 0.01, (50, 3))
+
+    start_time = time.time()
+    for _ in range(n_runs):
+        distance, _ = fastdtw(pybullet_traj, unity_traj, dist=euclidean)
+    print("fastdtw: {:.5f}s, distance {:.3f}".format((time.time() - start_time) / n_runs, distance))
+
+    start_time = time.time()
+    for _ in range(n_runs):
+        distance = dtw_distance(pybullet_traj, unity_traj)
+    print("resampled DTW: {:.5f}s, distance {:.3f}".format((time.time() - start_time) / n_runs, distance))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,13 +1,17 @@
 from dataclasses import dataclass
-from gravity import pybullet_utilities
+from gravity.rollouts import RolloutEngine, ROLLOUT_KINDS
+from gravity.trajectory import StreamingDTW
 import numpy as np
-from fastdtw import fastdtw
-from scipy.spatial.distance import euclidean
-from vision.gravity import L2DataPacketV2
+from vision.gravity import L2DataPacketV2, GravityPerceptionCache
+from vision import debug_artifacts
 import sys
 import cv2
 
 DEBUG = False
+# Trajectory distance at which the step confidence, 100 * tanh(1 / distance), drops to VOE_CONFIDENCE.
+# The scene confidence, the lower of that and the rollout agreement, uses the same threshold.
+VOE_CONFIDENCE = 0.5
+VOE_DISTANCE = 1 / np.arctanh(VOE_CONFIDENCE / 100)
 
 @dataclass
 class ObjectFace:
@@ -29,6 +33,13 @@ class GravityAgent:
     def __init__(self, controller, level):
         self.controller = controller
         self.level = level
+        self.rollout_engine = RolloutEngine()
+        self.perception_cache = GravityPerceptionCache()
+        if DEBUG:
+            debug_artifacts.enable()
+
+    def close(self):
+        self.rollout_engine.close()
 
     @staticmethod
     def _determine_drop_step(pole_dimension_history):
@@ -228,6 +239,8 @@ class GravityAgent:
                         step["stepBegin"] *= 100
         '''
 
+        debug_artifacts.start_scene(config["name"])
+        self.perception_cache.reset()
         self.controller.start_scene(config)
 
         # Inputs to determine VoE
@@ -237,6 +250,9 @@ class GravityAgent:
         support_coords = None
 
         obj_traj_orn = None
+        rollouts = None
+        traj_dtw = None
+        traj_dtw_start = -1
         step_output = None
         step_output_dict = None
         drop_step = -1
@@ -251,7 +267,7 @@ class GravityAgent:
                 else:
                     step_output_dict = dict(step_output)
                     try:
-                        step_output = L2DataPacketV2(step_number=i, step_meta=step_output)
+                        step_output = L2DataPacketV2(step_number=i, step_meta=step_output, cache=self.perception_cache)
                     except Exception as e:
                         print("Couldn't process step i+{}, skipping ahead".format(i))
                         print(e)
@@ -265,7 +281,7 @@ class GravityAgent:
                     break
                 else:
                     try:
-                        step_output = L2DataPacketV2(step_number=i, step_meta=step_output)
+                        step_output = L2DataPacketV2(step_number=i, step_meta=step_output, cache=self.perception_cache)
                     except Exception as e:
                         print("Couldn't process step i+{}, skipping ahead".format(i))
                         print(e)
@@ -289,6 +305,8 @@ class GravityAgent:
                 step_output_dict["object_list"][target_object]["pixel_center"] = step_output.target.centroid_px
                 
                 targ_pos.append(step_output_dict["object_list"][target_object]["position"])
+                if traj_dtw is not None:
+                    traj_dtw.update(self.unity_point(targ_pos[-1]))
                 
                 if self.level == 'level2':
                     pole_history.append({
@@ -309,8 +327,13 @@ class GravityAgent:
             if len(pole_history) != 0:
                 drop_step = self.determine_drop_step(pole_history)
                 if drop_step != -1 and pb_state != "complete":
-                    # get physics simulator trajectory
-                    obj_traj_orn = pybullet_utilities.render_in_pybullet(step_output_dict, target_object, supporting_object, self.level)
+                    # get physics simulator trajectories for a batch of perturbed initial conditions
+                    # the perceived target kind is only a guess below oracle level
+                    kinds = None if self.level == "oracle" else ROLLOUT_KINDS
+                    rollouts = self.rollout_engine.run(step_output_dict, target_object, supporting_object, self.level, kinds)
+                    obj_traj_orn = rollouts.nominal
+                    traj_dtw = self.start_traj_comparison(obj_traj_orn[target_object]['pos'], targ_pos, drop_step)
+                    traj_dtw_start = drop_step
                     pb_state = "complete"
             
             choice = plausible_str(False)
@@ -321,15 +344,18 @@ class GravityAgent:
 
             voe_heatmap = np.ones((600, 400))
 
-            if len(pole_history) > 1 and drop_step != -1 and pb_state != "complete":
+            target_in_view = target_object in step_output_dict["object_list"]
+            if len(targ_pos) > 1 and drop_step != -1 and traj_dtw is not None and target_in_view:
                 # calc confidence:
                 unity_traj = [[x["x"], x["z"], x["y"]] for x in targ_pos]
 
-                if unity_traj[-1] != unity_traj[-2]:
+                if traj_dtw.abandoned:
+                    # the unity trajectory can no longer come close to the simulated one
+                    confidence = 0.0
+                elif unity_traj[-1] != unity_traj[-2]:
                     confidence = 1.0
-                elif obj_traj_orn != None:
-                    distance, path = self.calc_simulator_voe(obj_traj_orn[target_object]['pos'], unity_traj)
-                    confidence = 100 * np.tanh(1 / distance)
+                else:
+                    confidence = 100 * np.tanh(1 / traj_dtw.distance)
 
                 # confidence has to be bounded between 0 and 1
                 if confidence >= 1:
@@ -370,11 +396,12 @@ class GravityAgent:
         final_confidence = 0
         if obj_traj_orn != None:
             # get the inverse distance as plausability of scene
-            unity_traj = [[x["x"], x["z"], x["y"]] for x in targ_pos[drop_step:]]
-            distance, path = self.calc_simulator_voe(obj_traj_orn[target_object]['pos'], unity_traj)
-            final_confidence = 100 * np.tanh(1 / distance)
-            if final_confidence >= 1:
-                final_confidence = 1.0
+            if traj_dtw is None or traj_dtw_start != drop_step:
+                # drop step estimate moved since the comparison started
+                traj_dtw = self.start_traj_comparison(obj_traj_orn[target_object]['pos'], targ_pos, drop_step)
+            distance = traj_dtw.distance
+            print("trajectory distance: {:.3f}{}".format(distance, " (abandoned)" if traj_dtw.abandoned else ""))
+            dtw_confidence = min(100 * np.tanh(1 / distance), 1.0)
 
             # calculate if unity target object is resting on support
             target_dims = self.getMinMax(step_output_dict["object_list"][target_object])
@@ -389,25 +416,22 @@ class GravityAgent:
             unity_target_floating = False
             if not unity_target_on_floor and not unity_target_on_support:
                 unity_target_floating = True
-                final_confidence = 0
-
-            #calculate if pybullet object is resting on support
-            pb_support_position = obj_traj_orn[supporting_object]['pos'][-1]
-            pb_target_on_support = obj_traj_orn[target_object]["support_contact"][-1] != ()
-            pb_target_on_floor = obj_traj_orn[target_object]["floor_contact"][-1] != () 
-            
-            # this means target is on floor and touching support, not on support
-            if pb_target_on_floor and pb_target_on_support:
-                pb_target_on_support = not pb_target_on_support
 
             if unity_target_on_floor and unity_target_on_support:
                 unity_target_on_support = not unity_target_on_support
 
-            # if simulators are in agreement on the object being on or below the support
-            on_floor_agreement = not (unity_target_on_floor ^ pb_target_on_floor) # 1 is good
-            on_support_agreement = not (unity_target_on_support ^ pb_target_on_support) # 1 is good
+            # fraction of pybullet rollouts agreeing with unity on the object being on or below the support
+            rollout_agreement = rollouts.agreement(unity_target_on_support, unity_target_on_floor)
+            print("rollouts on support: {:.2f}, on floor: {:.2f}, agreeing with unity: {:.2f}".format(
+                rollouts.support_prob, rollouts.floor_prob, rollout_agreement))
+            if unity_target_floating:
+                final_confidence = 0
+            else:
+                # plausible only if unity both followed the simulated drop and came to
+                # rest where the rollouts did; an abandoned comparison has confidence 0
+                final_confidence = min(dtw_confidence, rollout_agreement)
 
-            if (on_floor_agreement or on_support_agreement) and not unity_target_floating:
+            if final_confidence >= VOE_CONFIDENCE and not unity_target_floating:
                 print("Physics Sim Suggests no VoE for", config['name'])
                 physics_voe_flag = False
             else:
@@ -426,6 +450,7 @@ class GravityAgent:
                 print("No violation for", config["name"])
 
         self.controller.end_scene(choice=plausible_str(voe_flag), confidence=final_confidence)
+        debug_artifacts.flush()
         return True
 
     def getIntersectionOrContact(self, obj1, obj2):
@@ -472,11 +497,18 @@ class GravityAgent:
         
         return [(min_x, max_x), (min_z, max_z), (min_y, max_y)]
     
-    def calc_simulator_voe(self, pybullet_traj, unity_traj):
-        # calculate the difference in trajectory as the sum squared distance of each point in time
-        
-        distance, path = fastdtw(pybullet_traj, unity_traj, dist=euclidean)
-        return distance, path
+    @staticmethod
+    def unity_point(position):
+        # unity is y-up, pybullet is z-up
+        return [position["x"], position["z"], position["y"]]
+
+    def start_traj_comparison(self, pybullet_traj, targ_pos, drop_step):
+        '''
+        DTW between the simulated trajectory and the unity one, fed unity frames as they arrive
+        '''
+        traj_dtw = StreamingDTW(pybullet_traj, threshold=VOE_DISTANCE)
+        traj_dtw.extend([self.unity_point(pos) for pos in targ_pos[drop_step:]])
+        return traj_dtw
 
 def plausible_str(violation_detected):
     return 'implausible' if violation_detected else 'plausible'
@@ -4,16 +4,15 @@ from physicsvoe.timer import Timer
 from physicsvoe.data.types import make_camera
 
 from tracker import track, appearence, filter_masks
-import visionmodule.inference as vision
+from vision import model_registry
 
 from pathlib import Path
 from PIL import Image
 import numpy as np
-import torch
 import pickle
 
-APP_MODEL_PATH = './tracker/model.p'
-VISION_MODEL_PATH = './visionmodule/dvis_resnet50_mc_voe.pth'
+APP_MODEL_PATH = model_registry.APP_MODEL_PATH
+VISION_MODEL_PATH = model_registry.VOE_VISION_WEIGHTS
 DEBUG = False
 
 class VoeAgent:
@@ -22,14 +21,13 @@ class VoeAgent:
         self.level = level
         if DEBUG:
             self.prefix = out_prefix
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.app_model = appearence.AppearanceMatchModel()
-        self.app_model.load_state_dict(torch.load(APP_MODEL_PATH, map_location=torch.device('cpu')))
-        self.app_model = self.app_model.to(self.device).eval()
+        self.device = model_registry.DEVICE
+        self.app_model = model_registry.get_appearance_model(APP_MODEL_PATH)
         if self.level == 'level1':
-            self.visionmodel = vision.MaskAndClassPredictor(dataset='mcsvideo3_voe',
-                                                            config='plus_resnet50_config_depth_MC',
-                                                            weights=VISION_MODEL_PATH)
+            self.visionmodel = model_registry.get_mask_predictor(dataset='mcsvideo3_voe',
+                                                                 config='plus_resnet50_config_depth_MC',
+                                                                 weights=VISION_MODEL_PATH,
+                                                                 voe_module=True)
 
     def run_scene(self, config, desc_name):
         if DEBUG:
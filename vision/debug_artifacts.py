@@ -0,0 +1,92 @@
+'''
+Debug image dumps for the perception pipeline.
+
+Disabled by default, so production runs do no image I/O. When enabled,
+images of every `sample_every`-th frame are handed to a background thread
+which writes them under `<root_dir>/<scene name>/`.
+'''
+import os
+import queue
+import threading
+import cv2
+
+ENABLED = False
+ROOT_DIR = "debug_artifacts"
+SAMPLE_EVERY = 5
+MAX_PENDING = 64
+
+
+class DebugArtifactWriter:
+
+    def __init__(self, root_dir=ROOT_DIR, sample_every=SAMPLE_EVERY, enabled=ENABLED):
+        self.root_dir = root_dir
+        self.sample_every = sample_every
+        self.enabled = enabled
+        self.scene_dir = root_dir
+        self.frame_id = 0
+        self._queue = queue.Queue(maxsize=MAX_PENDING)
+        self._thread = None
+
+    def enable(self, root_dir=None, sample_every=None):
+        self.enabled = True
+        if root_dir is not None:
+            self.root_dir = root_dir
+        if sample_every is not None:
+            self.sample_every = sample_every
+
+    def disable(self):
+        self.flush()
+        self.enabled = False
+
+    def start_scene(self, scene_name):
+        self.flush()
+        self.scene_dir = os.path.join(self.root_dir, str(scene_name))
+        self.frame_id = 0
+
+    def set_frame(self, frame_id):
+        self.frame_id = frame_id
+
+    def wants_frame(self):
+        return self.enabled and self.frame_id % self.sample_every == 0
+
+    def save(self, name, img, params=None):
+        '''
+        Queues `img` to be written as `<frame id>_<name>` for the current scene.
+        Frames are dropped rather than blocking the caller when the writer falls behind.
+        '''
+        if not self.wants_frame():
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+
+        path = os.path.join(self.scene_dir, "{:04d}_{}".format(self.frame_id, name))
+        try:
+            self._queue.put_nowait((path, img.copy(), params or []))
+        except queue.Full:
+            pass
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            path, img, params = self._queue.get()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                cv2.imwrite(path, img, params)
+            except Exception as e:
+                print("Couldn't write debug artifact {}: {}".format(path, e))
+            finally:
+                self._queue.task_done()
+
+
+writer = DebugArtifactWriter()
+
+enable = writer.enable
+disable = writer.disable
+start_scene = writer.start_scene
+set_frame = writer.set_frame
+save = writer.save
+flush = writer.flush
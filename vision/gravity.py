@@ -1,12 +1,13 @@
 import pdb
 import cv2
 import math
-import open3d as o3d
 import numpy as np
 import machine_common_sense as mcs
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import List
-from vision.obj_kind import KindClassifier
+from vision import debug_artifacts
+from vision.obj_kind import KindClassifierService
 
 OBJ_KINDS = {
     # Flat surfaces
@@ -42,6 +43,8 @@ CAM_FOV = 42.5
 CAM_HEIGHT = 1.5
 FOCAL = 30.85795
 OBJ_KIND_MODEL_NAME = "model.p"
+# Roles of objects that don't move during a gravity scene
+STATIC_ROLES = ("floor", "back-wall", "support")
 
 
 @dataclass
@@ -468,11 +471,15 @@ class ObjectV2:
     centroid: tuple = None
     centroid_px: tuple = None
 
+    mask_color: int = None
+    front_view: np.ndarray = None  # Shared by all objects of a frame
+
     def __post_init__(self):
-        self.front_view = self._estimate_obj_mask_front_view()
+        if self.front_view is None:
+            self.front_view = self._estimate_obj_mask_front_view()
 
     @staticmethod
-    def _color_prop(obj_mask, rgb_im):
+    def _color_prop(obj_mask, rgb_im, debug_name="pole.png"):
         '''
         Finds average RGB channels pixel values. Doesn't make sense for 
         objects with a texture or wide color gradient
@@ -481,7 +488,7 @@ class ObjectV2:
         masked_rgb = np.ma.masked_equal(cropped_rgb, 0)
         # Variation for wall & floor objects is a lot. 
         # So color attr doesn't make sense of these roles
-        cv2.imwrite("pole.png", masked_rgb)
+        debug_artifacts.save(debug_name, cropped_rgb)
         return masked_rgb.mean((0, 1)).astype(np.int).data.tolist()
 
     @staticmethod
@@ -493,21 +500,18 @@ class ObjectV2:
         return w, h
 
     @staticmethod
-    def depth_to_local(depth, clip_planes, fov_deg):
-        """ Calculate local offset of each pixel in a depth mask.
-        Args:
-            depth (np.ndarray): HxW depth image array with values between 0-255
-            clip_planes: Tuple of (near, far) clip plane distances.
-            fov_deg: Vertical FOV in degrees.
+    @lru_cache(maxsize=4)
+    def camera_rays(shape, fov_deg):
+        """ Direction vector of each pixel of a HxW image, at unit depth.
+        Only depends on the camera, so it is computed once per image shape.
         Returns:
-            HxWx3 np.ndarray of each pixel's local (x,y,z) offset from the camera.
+            HxWx3 np.ndarray, read-only.
         """
         """ Determine the 'UV' image-space coodinates for each pixel.
         These range from (-1, 1), with the top left pixel at index [0,0] having
         UV coords (-1, 1).
         """
-        aspect_ratio = (depth.shape[1], depth.shape[0])
-        #print ("aspect ratio" ,aspect_ratio)
+        aspect_ratio = (shape[1], shape[0])
 
         idx_grid = np.meshgrid(*[np.arange(ar) for ar in aspect_ratio])
 
@@ -516,25 +520,61 @@ class ObjectV2:
 
         uv_arr[:, :, 1] *= -1 # Each pixel's UV coords
 
-        """ Convert the depth mask values into per-pixel world-space depth
-        measurements using the provided clip plane distances.
-        """
-        z_depth = depth[:]
         """ Determine vertical & horizontal FOV in radians.
         Use the UV coordinate values and tan(fov/2) to determine the 'XY' direction
         vector for each pixel.
         """
         vfov = np.radians(fov_deg)
-        #hfov = np.radians(fov_deg*aspect_ratio[0]/aspect_ratio[1])
         hfov = 2*math.atan(math.tan(vfov/2) * (aspect_ratio[0]/aspect_ratio[1]))
         tans = np.array([np.tan(fov/2) for fov in (hfov, vfov)])
         px_dir_vec = uv_arr * tans
-        """ Add Z coordinate and scale to the pixel's known depth.  """
+        """ Add Z coordinate """
         const_zs = np.ones((px_dir_vec.shape[0:2])+(1,))
         px_dir_vec = np.concatenate((px_dir_vec, const_zs), axis=-1)
-        camera_offsets = px_dir_vec * np.expand_dims(z_depth, axis=-1)
+        px_dir_vec.setflags(write=False)
+
+        return px_dir_vec
+
+    @staticmethod
+    def depth_to_local(depth, clip_planes, fov_deg):
+        """ Calculate local offset of each pixel in a depth mask.
+        Args:
+            depth (np.ndarray): HxW depth image array with values between 0-255
+            clip_planes: Tuple of (near, far) clip plane distances.
+            fov_deg: Vertical FOV in degrees.
+        Returns:
+            HxWx3 np.ndarray of each pixel's local (x,y,z) offset from the camera.
+        """
+        px_dir_vec = ObjectV2.camera_rays(depth.shape[:2], fov_deg)
+        """ Scale each pixel's direction to its known depth. """
+        return px_dir_vec * np.expand_dims(depth, axis=-1)
+
+    @staticmethod
+    def masked_depth_to_local(depth, obj_mask, fov_deg):
+        """ Same as `depth_to_local` but only for the pixels in `obj_mask`.
+        Returns:
+            Nx3 np.ndarray of local (x,y,z) offsets, N being the object's pixel count.
+        """
+        rows, cols = np.nonzero(obj_mask.reshape(depth.shape[:2]))
+        px_dir_vec = ObjectV2.camera_rays(depth.shape[:2], fov_deg)
+        return px_dir_vec[rows, cols] * depth[rows, cols][:, None]
 
-        return camera_offsets
+    @staticmethod
+    def _aabb_corners(min_bound, max_bound):
+        '''
+        8 corners of an axis-aligned box, in open3d's `get_box_points` order
+        '''
+        (x0, y0, z0), (x1, y1, z1) = min_bound, max_bound
+        return np.array([
+            [x0, y0, z0],
+            [x1, y0, z0],
+            [x0, y1, z0],
+            [x0, y0, z1],
+            [x1, y1, z1],
+            [x0, y1, z1],
+            [x1, y0, z1],
+            [x1, y1, z0],
+        ])
 
     def _dims_prop(self, obj, visualize=False):
         '''
@@ -543,42 +583,38 @@ class ObjectV2:
         Limitations: Width & height will be slightly off and depth will be guessed
         Assumptions: Depth is assumed to be min{width, height}
         '''
-        scene_points = self.depth_to_local(
-            depth=obj.depth_map, clip_planes=CAM_CLIP_PLANES, fov_deg=CAM_FOV
+        obj_points = self.masked_depth_to_local(
+            depth=obj.depth_map, obj_mask=obj.obj_mask, fov_deg=CAM_FOV
         )
-        scene_points = scene_points.reshape(-1, 3)
+        self.obj_cloud = obj_points
 
-        scene_point_cloud = o3d.geometry.PointCloud()
-        scene_point_cloud.points = o3d.utility.Vector3dVector(scene_points)
-        
-        obj_idx = np.nonzero(obj.obj_mask.reshape(-1))[0]
-        obj_point_cloud = scene_point_cloud.select_down_sample(obj_idx)
-        self.obj_cloud = obj_point_cloud
+        assert len(obj_points) > 0, "RGB-D couldn't return a 3D object!"
 
-        assert obj_point_cloud.dimension() == 3, "RGB-D couldn't return a 3D object!"
-        
         if visualize:
+            import open3d as o3d
+            obj_point_cloud = o3d.geometry.PointCloud()
+            obj_point_cloud.points = o3d.utility.Vector3dVector(obj_points)
             o3d.visualization.draw_geometries([obj_point_cloud])
 
-        bbox = obj_point_cloud.get_axis_aligned_bounding_box()
-        bbox_corners = np.asarray(bbox.get_box_points())
+        min_bound, max_bound = obj_points.min(axis=0), obj_points.max(axis=0)
 
         dy = 1.75
-        bbox_corners = np.asarray(
-            bbox.translate([0, dy, 0], relative=True)
-                .get_box_points()
-            )
+        bbox_corners = self._aabb_corners(min_bound, max_bound) + [0, dy, 0]
         self.dims = [
             {"x": pt[0], "y": pt[1], "z": pt[2]}
             for pt in bbox_corners
         ]
-        self.w_h_d = np.abs(bbox.get_extent()).tolist()
+        self.w_h_d = np.abs(max_bound - min_bound).tolist()
 
     def extract_physical_props(self):
         '''
         Uses blob to determine `color` & `dims`
         '''
-        self.color = self._color_prop(self.obj_mask, self.rgb_im)
+        # Mask color tells apart objects sharing a role, e.g. the "default" ones
+        self.color = self._color_prop(
+            self.obj_mask, self.rgb_im,
+            debug_name="{}_{}_color.png".format(self.role, self.mask_color)
+        )
 
         self._dims_prop(self)
 
@@ -652,7 +688,7 @@ class ObjectV2:
         )
         _, obj_front_view = self._apply_good_contours(obj_front_view)
 
-        cv2.imwrite("front_view.jpg", obj_front_view)
+        debug_artifacts.save("front_view.jpg", obj_front_view)
 
         return np.expand_dims(obj_front_view > 0, axis=2)
 
@@ -730,12 +766,10 @@ class ObjectV2:
             else:
                 self.kind = "cube"
 
-    def find_obj_kind_nn(self) -> None:
-
-        if self.role != "target":
-            self.kind = "cube"
-            return
-        
+    def kind_crop(self) -> tuple:
+        '''
+        RGB & depth crops around the object, as input to the kind classifier
+        '''
         x, y, w, h = cv2.boundingRect(
             cv2.findContours(
                 (self.obj_mask * 255).astype("uint8"),
@@ -746,25 +780,64 @@ class ObjectV2:
 
         rgb_object = self.rgb_im[y : y + h, x: x + w, :]
         depth_object = self.depth_map[y : y + h, x: x + w]
-        kind_pred, conf = KindClassifier(model_name=OBJ_KIND_MODEL_NAME).run(
-            rgb_object, depth_object
-        )
 
-        self.kind = kind_pred
-        
+        return rgb_object, depth_object
+
+
+class GravityPerceptionCache:
+    '''
+    Per-scene store of the floor, back wall & support, which never move.
+    Valid as long as the set of mask colors in the frame doesn't change.
+    '''
+
+    def __init__(self):
+        self.kind_service = KindClassifierService(OBJ_KIND_MODEL_NAME)
+        self.reset()
+
+    def reset(self):
+        self.mask_colors = None
+        self.static_objects = []
+        self.kind_service.reset()
+
+    def lookup(self, mask_colors):
+        if self.mask_colors is None or mask_colors != self.mask_colors:
+            return None
+        return self.static_objects
+
+    def store(self, mask_colors, objects):
+        self.mask_colors = mask_colors
+        self.static_objects = [
+            this_ob for this_ob in objects if this_ob.role in STATIC_ROLES
+        ]
+
+
 @dataclass
 class L2DataPacketV2:
 
     step_number: int
     step_meta: mcs.StepMetadata
+    cache: GravityPerceptionCache = None
 
     def __post_init__(self):
 
+        debug_artifacts.set_frame(self.step_number)
         self.get_images_from_meta()
-        self.objects = self.segment_objects()
-        self.determine_obj_roles()
-        self.calculate_physical_props()
-        self.guess_object_kinds()
+        self._get_mask_colors()
+
+        static_objects = None
+        if self.cache is not None:
+            static_objects = self.cache.lookup(self.mask_colors)
+
+        if static_objects is None:
+            self.objects = self.segment_objects()
+            self.determine_obj_roles()
+            self.calculate_physical_props()
+            self.guess_object_kinds()
+            if self.cache is not None:
+                self.cache.store(self.mask_colors, self.objects)
+        else:
+            self.track_moving_objects(static_objects)
+
         self.load_roles_as_attr()
 
     def get_images_from_meta(self):
@@ -777,23 +850,31 @@ class L2DataPacketV2:
 
         self.depth_map = self.step_meta.depth_map_list[0]
         
-        # For debugging
-        cv2.imwrite("rgb.png", self.rgb_im, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-        cv2.imwrite("mask.png", self.obj_mask, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-        cv2.imwrite("depth.png", self.depth_map, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+        # For debugging, written in the background only when enabled
+        debug_artifacts.save("rgb.png", self.rgb_im, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+        debug_artifacts.save("mask.png", self.obj_mask, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+        debug_artifacts.save("depth.png", self.depth_map, [cv2.IMWRITE_PNG_COMPRESSION, 0])
 
-    def _get_obj_masks(self) -> List[np.ndarray]:
+    def _get_mask_colors(self) -> tuple:
         '''
-        Returns 1D masks of each object in the frame
+        Returns the (1 channel) colors of the objects in the frame
         '''
         # transform 3 channels to 1 channel
-        obj_mask = np.prod(self.obj_mask, axis=2)
-        uniq_obj_colors = np.unique(obj_mask) 
+        self.flat_mask = np.prod(self.obj_mask, axis=2)
+        self.mask_colors = tuple(np.unique(self.flat_mask).tolist())
+
+        return self.mask_colors
 
+    def _get_obj_masks(self, skip_colors=()) -> List[tuple]:
+        '''
+        Returns 1D masks of each object in the frame along with its color
+        '''
         obj_masks = []
-        for color in uniq_obj_colors:
-            mask = obj_mask == color
-            obj_masks.append(np.expand_dims(mask, axis=2))
+        for color in self.mask_colors:
+            if color in skip_colors:
+                continue
+            mask = self.flat_mask == color
+            obj_masks.append((color, np.expand_dims(mask, axis=2)))
 
         return obj_masks
 
@@ -807,23 +888,40 @@ class L2DataPacketV2:
 
         return cX, cY
 
-    def segment_objects(self):
+    def segment_objects(self, skip_colors=()):
         objects = []
-        obj_masks = self._get_obj_masks()
+        obj_masks = self._get_obj_masks(skip_colors)
 
-        # Determining floor & wall
-        floor_found, wall_found = False, False
-        for obj in obj_masks:
+        # Front view only depends on the depth map
+        front_view = None
+        for color, obj in obj_masks:
             this_ob = ObjectV2(
                 rgb_im=self.rgb_im,
                 obj_mask=obj,
-                depth_map=self.depth_map
+                depth_map=self.depth_map,
+                mask_color=color,
+                front_view=front_view
             )
+            front_view = this_ob.front_view
 
             objects.append(this_ob)
 
         return objects
 
+    def track_moving_objects(self, static_objects):
+        '''
+        Reuses cached static objects & only segments the target and pole
+        '''
+        moving_objects = self.segment_objects(
+            skip_colors={this_ob.mask_color for this_ob in static_objects}
+        )
+        self.objects = static_objects + moving_objects
+
+        self._determine_moving_roles(moving_objects)
+        for this_ob in moving_objects:
+            this_ob.extract_physical_props()
+        self.guess_object_kinds(moving_objects)
+
     def determine_obj_roles(self):
 
         assert 3 <= len(self.objects) <= 5, "Support, floor & wall should always be in scene"
@@ -868,31 +966,34 @@ class L2DataPacketV2:
 
         assert support_found, "Support should have been found by now"
 
+        self._determine_moving_roles(
+            [this_ob for this_ob in self.objects if this_ob.role not in STATIC_ROLES]
+        )
+
+    def _determine_moving_roles(self, moving_objects):
+
         # Determining target
         target_found = False
-        if len(self.objects) == 4:
-            for this_ob in self.objects:
-                if this_ob.role not in ["floor", "back-wall", "support"]:
-                    this_ob.role = "target"
-                    target_found = True
+        if len(moving_objects) == 1:
+            moving_objects[0].role = "target"
+            target_found = True
         else:
             # Find closest object to floor
             biggest_cY = -float("inf")
             target_idx = None
-            for idx, this_ob in enumerate(self.objects):
-                if this_ob.role not in ["floor", "back-wall", "support"]:
-                    _, cY = self._get_obj_moments(this_ob.obj_mask)
-                    if cY > biggest_cY:
-                        target_idx = idx
-                        biggest_cY = cY
+            for idx, this_ob in enumerate(moving_objects):
+                _, cY = self._get_obj_moments(this_ob.obj_mask)
+                if cY > biggest_cY:
+                    target_idx = idx
+                    biggest_cY = cY
             if target_idx is not None:
-                self.objects[target_idx].role = "target"
+                moving_objects[target_idx].role = "target"
                 target_found = True
 
         # Determine pole
         pole_found = False
-        if len(self.objects) == 5:
-            for this_ob in self.objects:
+        if len(moving_objects) == 2:
+            for this_ob in moving_objects:
                 if this_ob.role == "default":
                     this_ob.role = "pole"
                     pole_found = True
@@ -904,10 +1005,31 @@ class L2DataPacketV2:
         for this_ob in self.objects:
             this_ob.extract_physical_props()
 
-    def guess_object_kinds(self):
+    def guess_object_kinds(self, objects=None):
+        '''
+        Only targets go through the kind classifier, as one batch keyed by mask color
+        '''
+        objects = self.objects if objects is None else objects
 
-        for this_ob in self.objects:
-            this_ob.find_obj_kind_nn()
+        targets = {}
+        for this_ob in objects:
+            if this_ob.role == "target":
+                targets[this_ob.mask_color] = this_ob
+            else:
+                this_ob.kind = "cube"
+
+        if not targets:
+            return
+
+        kind_service = (
+            self.cache.kind_service if self.cache is not None
+            else KindClassifierService(OBJ_KIND_MODEL_NAME)
+        )
+        predictions = kind_service.classify(
+            {color: this_ob.kind_crop() for color, this_ob in targets.items()}
+        )
+        for color, this_ob in targets.items():
+            this_ob.kind, _ = predictions[color]
 
     def load_roles_as_attr(self):
 
@@ -0,0 +1,100 @@
+'''
+Process-wide registry of the networks used by the agents.
+
+Every weight file is loaded once per process and the resulting module is
+shared, in eval mode, by all callers asking for the same model.
+'''
+import time
+import torch
+
+_MODELS = {}
+_LOAD_TIMES = {}
+
+DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+INTER_VISION_WEIGHTS = './vision/instSeg/dvis_resnet50_mc.pth'
+VOE_VISION_WEIGHTS = './visionmodule/dvis_resnet50_mc_voe.pth'
+APP_MODEL_PATH = './tracker/model.p'
+OBJ_KIND_MODEL_NAME = 'model.p'
+
+
+def get_model(key, loader):
+    '''
+    Returns the model stored under `key`, calling `loader()` to build it the first time
+    '''
+    if key not in _MODELS:
+        start_time = time.time()
+        _MODELS[key] = loader()
+        _LOAD_TIMES[key] = time.time() - start_time
+        print("Loaded model {} in {:.3f}s".format(key, _LOAD_TIMES[key]))
+    return _MODELS[key]
+
+
+def get_mask_predictor(dataset='mcsvideo3_inter', config='plus_resnet50_config_depth_MC',
+                       weights=INTER_VISION_WEIGHTS, voe_module=False):
+    '''
+    DVIS mask & class predictor. `voe_module` picks the `visionmodule` copy
+    of the network (used by the physics VoE agent) over `vision.instSeg`.
+    '''
+    def _load():
+        if voe_module:
+            from visionmodule.inference import MaskAndClassPredictor
+        else:
+            from vision.instSeg.inference import MaskAndClassPredictor
+        predictor = MaskAndClassPredictor(dataset=dataset, config=config, weights=weights)
+        predictor.net.eval()
+        return predictor
+
+    module_name = 'visionmodule' if voe_module else 'instSeg'
+    return get_model(('mask_predictor', module_name, dataset, config, weights), _load)
+
+
+def get_appearance_model(model_path=APP_MODEL_PATH):
+    def _load():
+        from tracker.appearence import AppearanceMatchModel
+        model = AppearanceMatchModel()
+        model.load_state_dict(torch.load(model_path, map_location=torch.device('cpu')))
+        return model.to(DEVICE).eval()
+
+    return get_model(('appearance', model_path), _load)
+
+
+def get_kind_classifier(model_name=OBJ_KIND_MODEL_NAME):
+    def _load():
+        from vision.obj_kind import KindClassifier
+        classifier = KindClassifier(model_name=model_name)
+        classifier.model.eval()
+        return classifier
+
+    return get_model(('obj_kind', model_name), _load)
+
+
+def _torch_module(model):
+    if isinstance(model, torch.nn.Module):
+        return model
+    for attr in ['net', 'model']:
+        if isinstance(getattr(model, attr, None), torch.nn.Module):
+            return getattr(model, attr)
+    return None
+
+
+def model_memory(model):
+    '''
+    Bytes held by the parameters and buffers of a registered model
+    '''
+    module = _torch_module(model)
+    if module is None:
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def memory_report():
+    print("\nLoaded models:")
+    total = 0
+    for key, model in _MODELS.items():
+        size = model_memory(model)
+        total += size
+        print("  {:<60} {:8.1f} MB  (loaded in {:.3f}s)".format(
+            str(key), size / 2**20, _LOAD_TIMES[key]))
+    print("  {:<60} {:8.1f} MB".format("total", total / 2**20))
+    return total
@@ -1,10 +1,14 @@
 import cv2
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import pathlib
 
 ROOT_DIR = pathlib.Path(__file__).parent
+INPUT_SIZE = (64, 64)
+# Predictions below this confidence aren't remembered for the rest of the scene
+MEMO_MIN_CONF = 0.5
 
 class ShapeDepthMatchModel(nn.Module):
     def __init__(self):
@@ -54,31 +58,71 @@ class KindClassifier():
         ]
     
     def run(self, rgb, depth):
-        rgb_cropped = cv2.resize(rgb, (64,64)) # (64,64,3)
-        depth_cropped = cv2.resize(depth, (64,64)) # (64,64)
+        return self.run_batch([(rgb, depth)])[0]
+
+    @staticmethod
+    def preprocess(rgb, depth):
+        rgb_cropped = cv2.resize(rgb, INPUT_SIZE) # (64,64,3)
+        depth_cropped = cv2.resize(depth, INPUT_SIZE) # (64,64)
         gray = cv2.cvtColor(rgb_cropped, cv2.COLOR_BGR2GRAY) # (64,64)
-        mask = torch.FloatTensor(gray).unsqueeze(0).unsqueeze(0)  #(1,1,64,64)
-        depth_cropped = torch.FloatTensor(depth_cropped).unsqueeze(0).unsqueeze(0)  #(1,1,64,64)
+        return gray, depth_cropped
+
+    def run_batch(self, crops):
+        '''
+        Classifies a list of (rgb, depth) crops with a single forward pass.
+        Returns a list of (kind, confidence)
+        '''
+        grays, depths = zip(*[self.preprocess(rgb, depth) for rgb, depth in crops])
+        mask = torch.FloatTensor(np.stack(grays)).unsqueeze(1)  #(N,1,64,64)
+        depth_cropped = torch.FloatTensor(np.stack(depths)).unsqueeze(1)  #(N,1,64,64)
+
+        with torch.no_grad():
+            object_shape_logit = self.model(mask.to(self.device), depth_cropped.to(self.device))
+            predictions = F.softmax(object_shape_logit, dim=-1).cpu().numpy()
+
+        top_classes = predictions.argmax(axis=1)
+        return [
+            (self.shape_labels[top_class], probs[top_class])
+            for top_class, probs in zip(top_classes, predictions)
+        ]
 
-        predictions = self.test(mask, depth_cropped)
-        top_class = predictions.argmax()
-        
-        return self.shape_labels[top_class], predictions[top_class]
-
-    def test(self, mask, depth=False):
-            with torch.no_grad():
-                if  isinstance(depth, torch.Tensor):
-                    obj_current_image_tensor = mask.to(self.device) 
-                    obj_current_gray_image_tensor = depth.to(self.device)
-                    object_shape_logit = self.model(obj_current_image_tensor, obj_current_gray_image_tensor)
-                else:
-                    obj_current_image_tensor = mask
-                    object_shape_logit = self.model(obj_current_image_tensor)
-    
-                object_shape_logit = object_shape_logit
-                object_shape_prob = F.softmax(object_shape_logit, dim=-1)
 
-            return object_shape_prob.squeeze(0).cpu().numpy()
+class KindClassifierService:
+    '''
+    Batches crops through the resident KindClassifier and remembers the
+    kind of every tracked object, which doesn't change during a scene.
+    '''
+    def __init__(self, model_name="model.p", min_conf=MEMO_MIN_CONF):
+        self.model_name = model_name
+        self.min_conf = min_conf
+        self.known_kinds = {}
+
+    def reset(self):
+        self.known_kinds = {}
+
+    def classify(self, crops):
+        '''
+        `crops` maps a tracked object id to its (rgb, depth) crop.
+        Returns a dict of object id -> (kind, confidence)
+        '''
+        results = {
+            obj_id: self.known_kinds[obj_id]
+            for obj_id in crops if obj_id in self.known_kinds
+        }
+        new_ids = [obj_id for obj_id in crops if obj_id not in self.known_kinds]
+        if not new_ids:
+            return results
+
+        # Registry keeps a single classifier loaded for the whole process
+        from vision import model_registry
+        classifier = model_registry.get_kind_classifier(self.model_name)
+        predictions = classifier.run_batch([crops[obj_id] for obj_id in new_ids])
+        for obj_id, (kind, conf) in zip(new_ids, predictions):
+            results[obj_id] = (kind, conf)
+            if conf >= self.min_conf:
+                self.known_kinds[obj_id] = (kind, conf)
+
+        return results
 
 
 if __name__ == "__main__":
@@ -89,4 +133,4 @@ if __name__ == "__main__":
     rgb = rgb[0: 64, 0: 64, :]
     depth = depth[0: 64, 0: 64]
 
-    print(KindClassifier(model_name=MODEL_NAME).run(rgb_cropped=rgb, depth_cropped=depth))
\ No newline at end of file
+    print(KindClassifier(model_name=MODEL_NAME).run(rgb=rgb, depth=depth))
\ No newline at end of file
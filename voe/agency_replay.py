@@ -0,0 +1,231 @@
+'''
+Offline replay of agency scenes, without Unity.
+
+Scenes are recorded once with MCS (`record`), as gzipped pickles of every
+step's RGB & mask images split into trials. `replay` then feeds them to
+AgencyVoeAgent through a stand-in controller, one scene per worker process,
+and reports per trial latency, path errors and the failures that
+`run_scene` otherwise hides behind its random-prediction fallback.
+
+    python -m voe.agency_replay record --scenes <scene json dir> --out <dir>
+    python -m voe.agency_replay replay --dir <dir> --workers 4
+'''
+import gzip
+import pickle
+import time
+import multiprocessing
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+
+def record_scene(controller, config, out_path, level):
+    '''
+    Steps through the scene's action list and saves every frame
+    '''
+    controller.start_scene(config)
+    steps = []
+    trial = 0
+    for action in config['goal']['action_list']:
+        step_output = controller.step(action=action[0])
+        if step_output is None:
+            break
+        steps.append({
+            "action": action[0],
+            "trial": trial,
+            "rgb": np.array(step_output.image_list[0]),
+            "mask": np.array(step_output.object_mask_list[0])
+        })
+        if action[0] == "EndHabituation":
+            trial += 1
+    controller.end_scene(choice="expected", confidence=1.0)
+
+    with gzip.open(out_path, 'wb') as fd:
+        pickle.dump({"name": config["name"], "level": level, "config": config, "steps": steps}, fd)
+    return len(steps), trial
+
+
+class ReplayController:
+    '''
+    Serves recorded frames in place of the MCS controller and times the
+    agent between frames, attributing the time to the trial being served
+    '''
+    def __init__(self, scene):
+        self.steps = scene["steps"]
+        self.step_i = 0
+        self.extra_steps = 0
+        self.random_predictions = 0
+        self.choice = None
+        self.confidence = None
+        self.trial_times = defaultdict(float)
+        self.trial_frames = Counter(step["trial"] for step in self.steps)
+        self._last_time = None
+        self._last_trial = None
+
+    def _tick(self, trial):
+        now = time.time()
+        if self._last_time is not None:
+            self.trial_times[self._last_trial] += now - self._last_time
+        self._last_time = now
+        self._last_trial = trial
+
+    def start_scene(self, config):
+        self.step_i = 0
+
+    def step(self, action=None, **kwargs):
+        if self.step_i >= len(self.steps):
+            self.extra_steps += 1
+            return None
+        step = self.steps[self.step_i]
+        self.step_i += 1
+        self._tick(step["trial"])
+        return SimpleNamespace(image_list=[step["rgb"]], object_mask_list=[step["mask"]])
+
+    def make_step_prediction(self, choice=None, confidence=None, internal_state=None, **kwargs):
+        if internal_state and internal_state.get("info") == "runtime error":
+            self.random_predictions += 1
+
+    def end_scene(self, choice=None, confidence=None, **kwargs):
+        self._tick(None)
+        self.choice = choice
+        self.confidence = confidence
+
+
+def failure_mode(error):
+    '''
+    Last line of a traceback, e.g. "TypeError: 'NoneType' object is not subscriptable"
+    '''
+    if error is None:
+        return None
+    return error.strip().splitlines()[-1]
+
+
+def replay_scene(path):
+    from voe.agency_voe_agent import AgencyVoeAgent
+
+    with gzip.open(path, 'rb') as fd:
+        scene = pickle.load(fd)
+
+    controller = ReplayController(scene)
+    start_time = time.time()
+    try:
+        agent = AgencyVoeAgent(controller, scene["level"], debug=False)
+        agent.run_scene(scene["config"])
+        error = agent.last_error
+        trial_stats = {stats["trial"]: stats for stats in agent.trial_stats}
+    except Exception:
+        import traceback
+        error = traceback.format_exc()
+        trial_stats = {}
+
+    trials = []
+    for trial in sorted(controller.trial_frames):
+        stats = trial_stats.get(trial, {})
+        trials.append({
+            "trial": trial,
+            "frames": controller.trial_frames[trial],
+            "latency": controller.trial_times.get(trial, 0.0),
+            "avg_pos_err": stats.get("avg_pos_err"),
+            "path_len_err": stats.get("path_len_err"),
+            "completed": trial in trial_stats
+        })
+
+    return {
+        "name": scene["name"],
+        "duration": time.time() - start_time,
+        "trials": trials,
+        "failure": failure_mode(error),
+        "error": error,
+        "extra_steps": controller.extra_steps,
+        "random_predictions": controller.random_predictions,
+        "choice": controller.choice,
+        "confidence": controller.confidence
+    }
+
+
+def _fmt(value, spec="{:.3f}"):
+    return "-" if value is None else spec.format(value)
+
+
+def report(results):
+    print("{:<40} {:>5} {:>6} {:>10} {:>11} {:>12}".format(
+        "scene", "trial", "frames", "latency", "avg pos err", "path len err"))
+    for result in results:
+        for trial in result["trials"]:
+            print("{:<40} {:>5} {:>6} {:>10} {:>11} {:>12}".format(
+                result["name"][:40], trial["trial"] + 1, trial["frames"],
+                _fmt(trial["latency"]), _fmt(trial["avg_pos_err"]), _fmt(trial["path_len_err"], "{}")))
+        print("{:<40} total {:.3f}s, choice {}, {} steps past the recording, {} random predictions{}".format(
+            "", result["duration"], result["choice"], result["extra_steps"], result["random_predictions"],
+            "" if result["failure"] is None else "\n{:<40} FAILED: {}".format("", result["failure"])))
+
+    failures = Counter(result["failure"] for result in results if result["failure"] is not None)
+    print("\n{}/{} scenes failed".format(sum(failures.values()), len(results)))
+    for mode, count in failures.most_common():
+        print("  {:>4}  {}".format(count, mode))
+
+    latencies = [t["latency"] for r in results for t in r["trials"]]
+    if latencies:
+        print("trial latency: mean {:.3f}s, max {:.3f}s".format(np.mean(latencies), np.max(latencies)))
+
+
+def replay(scene_dir, n_workers=None):
+    paths = sorted(Path(scene_dir).glob('*.pkl.gz'))
+    if n_workers == 1:
+        results = [replay_scene(p) for p in paths]
+    else:
+        with multiprocessing.Pool(n_workers) as pool:
+            results = list(pool.imap_unordered(replay_scene, paths))
+    results.sort(key=lambda r: r["name"])
+    report(results)
+    return results
+
+
+def record(scene_dir, out_dir, config_path='mcs_config.ini'):
+    '''
+    Needs Unity, set up the same way as for eval.py
+    '''
+    import configparser
+    import yaml
+    import machine_common_sense as mcs
+
+    with open("./unity_path.yaml", 'r') as config_file:
+        unity_config = yaml.safe_load(config_file)
+    config_ini = configparser.ConfigParser()
+    config_ini.read(config_path)
+    level = config_ini['MCS']['metadata']
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    controller = mcs.create_controller(unity_config['unity_path'], config_file_path=config_path)
+    for scene_file in sorted(Path(scene_dir).glob('*.json')):
+        config, _ = mcs.load_scene_json_file(str(scene_file))
+        if config.get('goal', {}).get('category') != "agents":
+            continue
+        n_steps, n_trials = record_scene(controller, config, out_dir / (scene_file.stem + '.pkl.gz'), level)
+        print("{}: {} steps, {} trials".format(scene_file.stem, n_steps, n_trials))
+
+
+def make_parser():
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    record_parser = subparsers.add_parser('record')
+    record_parser.add_argument('--scenes', type=Path, required=True)
+    record_parser.add_argument('--out', type=Path, required=True)
+    record_parser.add_argument('--config', default='mcs_config.ini')
+    replay_parser = subparsers.add_parser('replay')
+    replay_parser.add_argument('--dir', type=Path, required=True)
+    replay_parser.add_argument('--workers', type=int, default=None)
+    return parser
+
+
+if __name__ == '__main__':
+    args = make_parser().parse_args()
+    if args.command == 'record':
+        record(args.scenes, args.out, args.config)
+    else:
+        replay(args.dir, args.workers)
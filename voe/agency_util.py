@@ -8,9 +8,6 @@ from copy import deepcopy
 from skimage.feature import hog
 import matplotlib as m
 import matplotlib.pyplot as plt
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
-from pathfinding.core.diagonal_movement import DiagonalMovement
 
 def random_float_with_range(low, high):
     assert high > low
@@ -81,17 +78,22 @@ def find_walls(im, arena_mat, debug=False):
         cv2.imwrite("walls_test.png", im)
     return im, arena_mat, wall_indices
 
+# (top, bottom, left, right) offsets of the camera image crop fed to each homography
+WALL_CROP = (43, -107, 67, -63)
+GND_CROP = (43, -57, 27, -63)
+# (rows, cols) of the warped image that are kept
+WALL_WARP_CROP = (slice(None, -25), slice(None, -245))
+# used opencv gui to see that each grid element had a width of ~28 pixels
+GND_WARP_CROP = (slice(22, 254), slice(22, 252))
+
 # perspective transform to the top of the walls
 def wall_trans(img, M):
-    l_offset = 67
-    r_offset = -63
-    t_offset = 43
-    b_offset = -107
+    t_offset, b_offset, l_offset, r_offset = WALL_CROP
     img = img[t_offset:b_offset, l_offset:r_offset, :]
     h, w = img.shape[:2]
     # use cv2.warpPerspective() to warp your image to a top-down view
     warped = cv2.warpPerspective(img, M, (w, h), flags=cv2.INTER_LINEAR)
-    warped = warped[:-25, :-245, :]
+    warped = warped[WALL_WARP_CROP]
     # assumes the image is square
     #grid_inc = warped.shape[0] / 8
     # draws the grid
@@ -105,18 +107,14 @@ def wall_trans(img, M):
 
 # perspective transform to the ground plane
 def gnd_trans(img, M):
-    l_offset = 27
-    r_offset = -63
-    t_offset = 43
-    b_offset = -57
+    t_offset, b_offset, l_offset, r_offset = GND_CROP
 
     img = img[t_offset:b_offset, l_offset:r_offset, :]
     h, w = img.shape[:2]
     
     # use cv2.warpPerspective() to warp your image to a top-down view
     warped = cv2.warpPerspective(img, M, (w, h), flags=cv2.INTER_NEAREST)
-    # used opencv gui to see that each grid element had a width of ~28 pixels
-    warped = warped[22:254, 22:252, :]
+    warped = warped[GND_WARP_CROP]
     # assumes the image is square
     # grid_inc = warped.shape[0] / 8
     # # draws the grid
@@ -128,6 +126,104 @@ def gnd_trans(img, M):
 
     return warped
 
+class WarpTable:
+    '''
+    Precomputed version of `gnd_trans` / `wall_trans`. The homographies are
+    fixed for the whole run, so the crop, warp, crop & mirror are turned into
+    a lookup table once per image shape:
+    - INTER_NEAREST: integer source pixel of every output pixel, applied with a single gather
+    - INTER_LINEAR: fixed-point maps for cv2.remap over the kept output pixels only
+    '''
+    def __init__(self, M, crop, warp_crop, interpolation):
+        self.M = M
+        self.crop = crop
+        self.warp_crop = warp_crop
+        self.interpolation = interpolation
+        self._tables = {}
+
+    def _crop_slices(self, shape):
+        t_offset, b_offset, l_offset, r_offset = self.crop
+        rows = range(shape[0])[t_offset:b_offset]
+        cols = range(shape[1])[l_offset:r_offset]
+        return rows, cols
+
+    def _build_nearest(self, shape):
+        rows, cols = self._crop_slices(shape)
+        h, w = len(rows), len(cols)
+        # warping the pixel indices gives exactly the pixels warpPerspective picks
+        idx = np.arange(h * w, dtype=np.float32).reshape(h, w)
+        src_idx = cv2.warpPerspective(
+            idx, self.M, (w, h), flags=cv2.INTER_NEAREST,
+            borderMode=cv2.BORDER_CONSTANT, borderValue=-1)
+        src_idx = src_idx[self.warp_crop][:, ::-1].astype(np.int64)
+        outside = src_idx < 0
+        src_y, src_x = np.divmod(np.maximum(src_idx, 0), w)
+        return src_y + rows.start, src_x + cols.start, outside
+
+    def _build_linear(self, shape):
+        rows, cols = self._crop_slices(shape)
+        h, w = len(rows), len(cols)
+        dst_x, dst_y = np.meshgrid(np.arange(w), np.arange(h))
+        dst_x, dst_y = dst_x[self.warp_crop][:, ::-1], dst_y[self.warp_crop][:, ::-1]
+        # warpPerspective samples the source at M^-1 * dst
+        src = np.linalg.inv(self.M) @ np.stack([dst_x.ravel(), dst_y.ravel(), np.ones(dst_x.size)])
+        map_x = (src[0] / src[2]).reshape(dst_x.shape).astype(np.float32)
+        map_y = (src[1] / src[2]).reshape(dst_x.shape).astype(np.float32)
+        map_1, map_2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+        return slice(rows.start, rows.stop), slice(cols.start, cols.stop), map_1, map_2
+
+    def __call__(self, img):
+        shape = img.shape[:2]
+        if shape not in self._tables:
+            if self.interpolation == cv2.INTER_NEAREST:
+                self._tables[shape] = self._build_nearest(shape)
+            else:
+                self._tables[shape] = self._build_linear(shape)
+        table = self._tables[shape]
+
+        if self.interpolation == cv2.INTER_NEAREST:
+            src_y, src_x, outside = table
+            warped = img[src_y, src_x]
+            warped[outside] = 0
+            return warped
+
+        rows, cols, map_1, map_2 = table
+        return cv2.remap(img[rows, cols], map_1, map_2, self.interpolation, borderMode=cv2.BORDER_CONSTANT)
+
+def get_warp_tables():
+    '''
+    Returns the (wall, ground) counterparts of `wall_trans` and `gnd_trans`
+    '''
+    M_wall, M_gnd = get_homographies()
+    wall_table = WarpTable(M_wall, WALL_CROP, WALL_WARP_CROP, cv2.INTER_LINEAR)
+    gnd_table = WarpTable(M_gnd, GND_CROP, GND_WARP_CROP, cv2.INTER_NEAREST)
+    return wall_table, gnd_table
+
+def benchmark_warps(n_runs=100, shape=(400, 600, 3)):
+    '''
+    Times the per-step warps against the precomputed tables.
+    Run from the repo root: python -m voe.agency_util
+    '''
+    import time
+    M_wall, M_gnd = get_homographies()
+    wall_table, gnd_table = get_warp_tables()
+    img = np.random.randint(0, 256, shape, dtype=np.uint8)[:, :, ::-1]
+
+    for name, warp, table in [("gnd", lambda im: gnd_trans(im, M_gnd), gnd_table),
+                              ("wall", lambda im: wall_trans(im, M_wall), wall_table)]:
+        table(img)  # builds the table
+        start_time = time.time()
+        for _ in range(n_runs):
+            expected = warp(img)
+        warp_time = (time.time() - start_time) / n_runs
+        start_time = time.time()
+        for _ in range(n_runs):
+            warped = table(img)
+        table_time = (time.time() - start_time) / n_runs
+        max_diff = np.abs(expected.astype(int) - warped.astype(int)).max()
+        print("{}: warpPerspective {:.5f}s, table {:.5f}s, max pixel difference {}".format(
+            name, warp_time, table_time, max_diff))
+
 def get_gnd_mask_color(im):
     '''
     Assumes the most common color of grid centers is the ground plane mask
@@ -262,18 +358,131 @@ def get_ch_avgs(im):
     #print(ch_avgs, ch_avgs.shape)
     return ch_avgs
 
+# 8-connected moves, diagonals allowed even past blocked corners (DiagonalMovement.always)
+MOVES = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dx, dy) != (0, 0)]
+MOVE_COSTS = [math.sqrt(2) if dx and dy else 1.0 for dx, dy in MOVES]
+
+class GridPlanner:
+    '''
+    Shortest paths on the arena grid from goal-rooted distance fields.
+    A field is computed once per goal and reused for every start, across
+    trials, as long as the arena doesn't change. Newly discovered walls only
+    reset the cells whose shortest path went through them.
+    '''
+    def __init__(self):
+        self.walkable = None
+        # goal -> distance of every cell to the goal
+        self.fields = {}
+
+    def update_arena(self, arena):
+        walkable = np.asarray(arena) > 0
+        if self.walkable is None or walkable.shape != self.walkable.shape:
+            self.fields = {}
+        else:
+            opened = walkable & ~self.walkable
+            blocked = ~walkable & self.walkable
+            if opened.any():
+                # distances can only shrink, recompute lazily
+                self.fields = {}
+            elif blocked.any():
+                for goal, field in self.fields.items():
+                    self.fields[goal] = self._repair(field, goal, walkable, blocked)
+        self.walkable = walkable
+
+    @staticmethod
+    def _shifted(field, dx, dy):
+        '''
+        Value of the neighbor at (x + dx, y + dy) of every cell, inf past the border
+        '''
+        h, w = field.shape
+        out = np.full_like(field, np.inf)
+        out[max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx)] = \
+            field[max(0, dy):h - max(0, -dy), max(0, dx):w - max(0, -dx)]
+        return out
+
+    def _relax(self, field, goal, walkable):
+        walkable = walkable.copy()
+        walkable[goal[1], goal[0]] = True
+        while True:
+            new_field = field.copy()
+            for (dx, dy), cost in zip(MOVES, MOVE_COSTS):
+                np.minimum(new_field, self._shifted(field, dx, dy) + cost, out=new_field)
+            new_field[~walkable] = np.inf
+            new_field[goal[1], goal[0]] = 0
+            if np.array_equal(new_field, field):
+                return field
+            field = new_field
+
+    def _parents(self, field):
+        '''
+        Index of the next move towards the goal from every cell
+        '''
+        options = np.stack([
+            self._shifted(field, dx, dy) + cost for (dx, dy), cost in zip(MOVES, MOVE_COSTS)
+        ])
+        return options.argmin(axis=0)
+
+    def _repair(self, field, goal, walkable, blocked):
+        if blocked[goal[1], goal[0]]:
+            blocked = blocked.copy()
+            blocked[goal[1], goal[0]] = False
+        # cells whose path to the goal runs through a new wall
+        parents = self._parents(field)
+        h, w = field.shape
+        ys, xs = np.mgrid[0:h, 0:w]
+        moves = np.array(MOVES)
+        parent_x = np.clip(xs + moves[parents, 0], 0, w - 1)
+        parent_y = np.clip(ys + moves[parents, 1], 0, h - 1)
+        affected = blocked.copy()
+        while True:
+            new_affected = affected | (affected[parent_y, parent_x] & np.isfinite(field))
+            new_affected[goal[1], goal[0]] = False
+            if np.array_equal(new_affected, affected):
+                break
+            affected = new_affected
+        field = field.copy()
+        field[affected] = np.inf
+        return self._relax(field, goal, walkable)
+
+    def distance_field(self, goal):
+        goal = tuple(goal)
+        if goal not in self.fields:
+            field = np.full(self.walkable.shape, np.inf)
+            field[goal[1], goal[0]] = 0
+            self.fields[goal] = self._relax(field, goal, self.walkable)
+        return self.fields[goal]
+
+    def plan(self, arena, start, goal):
+        '''
+        Same contract as calc_path(): list of (x, y) from start to goal, empty if unreachable.
+        Like calc_path(), marks start & goal as walkable in the arena.
+        '''
+        arena[start[1]][start[0]] = 1
+        arena[goal[1]][goal[0]] = 1
+        self.update_arena(arena)
+        field = self.distance_field(goal)
+        h, w = field.shape
+        x, y = start
+        if not np.isfinite(field[y, x]):
+            return []
+
+        path = [(x, y)]
+        while (x, y) != tuple(goal):
+            best = None
+            for (dx, dy), cost in zip(MOVES, MOVE_COSTS):
+                n_x, n_y = x + dx, y + dy
+                if 0 <= n_x < w and 0 <= n_y < h:
+                    d = cost + field[n_y, n_x]
+                    if best is None or d < best[0]:
+                        best = (d, n_x, n_y)
+            x, y = best[1], best[2]
+            path.append((x, y))
+        return path
+
+_planner = GridPlanner()
+
 def calc_path(m, start, goal):
-    m[start[1]][start[0]] = 1
-    m[goal[1]][goal[0]] = 1
-    grid = Grid(matrix=m)
-    #print(start,goal)
-    start = grid.node(start[0], start[1])
-    end = grid.node(goal[0], goal[1])
-    finder = AStarFinder(diagonal_movement=DiagonalMovement.always)
-    path, runs = finder.find_path(start, end, grid)
-    #print('operations:', runs, 'path length:', len(path))
-    print(grid.grid_str(path=path, start=start, end=end))
-    return path
+    return _planner.plan(m, start, goal)
 
 def px_to_arena(p, im):
     # assumes 40x40 grid
@@ -300,6 +509,124 @@ def is_wall(rgb, mask, c):
 
     return False
 
+def pack_color(c):
+    '''
+    c: (r, g, b) mask color tuple, as returned by get_mask_color()
+    '''
+    return (int(c[0]) << 16) | (int(c[1]) << 8) | int(c[2])
+
+def unpack_color(packed):
+    return ((packed >> 16) & 255, (packed >> 8) & 255, packed & 255)
+
+class MaskColorIndex:
+    '''
+    Inventory of the mask colors of one frame, built with a single pass over the image.
+    For every mask color: pixel count, bounding box, channel averages & centroid,
+    so colors can be classified without re-scanning the images for each candidate.
+    rgb, mask: opencv (BGR) images pre-processed into 8x8 grid
+    '''
+    def __init__(self, rgb, mask):
+        mask = mask.astype(np.int64)
+        self.packed = (mask[:, :, 2] << 16) | (mask[:, :, 1] << 8) | mask[:, :, 0]
+        colors, labels, counts = np.unique(self.packed.ravel(), return_inverse=True, return_counts=True)
+        n = len(colors)
+        self.labels = {c: i for i, c in enumerate(colors.tolist())}
+        self.counts = counts
+
+        h, w = self.packed.shape
+        ys, xs = np.divmod(np.arange(h * w), w)
+        self.centroids = np.stack([
+            np.bincount(labels, weights=xs, minlength=n) / counts,
+            np.bincount(labels, weights=ys, minlength=n) / counts
+        ], axis=1)
+
+        # (left, right, top, bottom) per color
+        self.bboxes = np.empty((n, 4), dtype=np.int64)
+        self.bboxes[:, [0, 2]] = np.iinfo(np.int64).max
+        self.bboxes[:, [1, 3]] = -1
+        np.minimum.at(self.bboxes[:, 0], labels, xs)
+        np.maximum.at(self.bboxes[:, 1], labels, xs)
+        np.minimum.at(self.bboxes[:, 2], labels, ys)
+        np.maximum.at(self.bboxes[:, 3], labels, ys)
+
+        # same as get_ch_avgs() on the color masked rgb: black pixels don't count
+        rgb = rgb.reshape(-1, 3)
+        non_black = np.bincount(labels, weights=rgb.sum(axis=1) > 0, minlength=n)
+        ch_sums = np.stack([
+            np.bincount(labels, weights=rgb[:, ch], minlength=n) for ch in range(3)
+        ], axis=1)
+        self.non_black = non_black
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.ch_avgs_arr = ch_sums / non_black[:, None]
+
+    def __contains__(self, c):
+        return pack_color(c) in self.labels
+
+    def _label(self, c):
+        return self.labels[pack_color(c)]
+
+    def count(self, c):
+        return int(self.counts[self._label(c)])
+
+    def non_black_count(self, c):
+        '''
+        Pixels of the color that aren't black in rgb, as cv2.countNonZero() on the masked rgb
+        '''
+        return int(self.non_black[self._label(c)])
+
+    def ch_avgs(self, c):
+        return self.ch_avgs_arr[self._label(c)]
+
+    def cardinals(self, c):
+        '''
+        Extreme L,R,T,B indices of the color's mask, as get_mask_cardinals()
+        '''
+        return tuple(self.bboxes[self._label(c)].tolist())
+
+    def centroid(self, c):
+        return tuple(self.centroids[self._label(c)].tolist())
+
+    def grid_color(self, x, y, grid_len=8):
+        '''
+        Color at the center of grid element (x, y), as get_mask_color()
+        '''
+        grid_inc = self.packed.shape[0] / grid_len
+        center_x = int(x * grid_inc + grid_inc//2)
+        center_y = int(y * grid_inc + grid_inc//2)
+        return unpack_color(int(self.packed[center_y, center_x]))
+
+    def gnd_color(self, grid_len=8):
+        '''
+        Most common color of the grid centers, as get_gnd_mask_color()
+        '''
+        colors = [self.grid_color(i % grid_len, i // grid_len, grid_len) for i in range(grid_len**2)]
+        return max(set(colors), key=colors.count)
+
+    def unknowns(self, knowns, search_len=25):
+        '''
+        Colors sampled on a search_len x search_len grid that aren't in `knowns`,
+        in the order get_unknowns() finds them
+        '''
+        grid_inc = self.packed.shape[0] / search_len
+        idx = [int((i+0.5) * grid_inc) for i in range(search_len)]
+        # get_unknowns() scans column by column
+        samples = self.packed[np.ix_(idx, idx)].T.ravel()
+        _, first = np.unique(samples, return_index=True)
+        known = {pack_color(c) for c in knowns}
+        return [
+            unpack_color(int(samples[i])) for i in sorted(first)
+            if int(samples[i]) not in known
+        ]
+
+    def is_wall(self, c):
+        '''
+        Same test as is_wall(): dark & gray
+        '''
+        ch_avgs = self.ch_avgs(c)
+        if not np.all(ch_avgs < 100):
+            return False
+        return np.std(ch_avgs) < 8
+
 def get_homographies():
     src_gnd = np.float32([(100, 90), # left
                         (272, 26),   # top
@@ -348,6 +675,112 @@ def get_obj_hog(obj):
     avg_hog_block = np.mean(flat_hog.reshape(-1, 72), axis=0)
     return avg_hog_block
 
+def batch_ch_avgs(ims):
+    '''
+    get_ch_avgs() of a stack of N same-sized images, returns Nx3
+    '''
+    ims = np.asarray(ims, dtype=float)
+    non_zero_c = (ims.sum(axis=3) > 0).sum(axis=(1, 2))
+    return ims.sum(axis=(1, 2)) / non_zero_c[:, None]
+
+def batch_obj_pos(ims):
+    '''
+    get_obj_pos() of a stack of N same-sized images, returns Nx2
+    '''
+    lit = np.asarray(ims).sum(axis=3) > 0
+    num_px = lit.sum(axis=(1, 2))
+    ys, xs = np.mgrid[0:lit.shape[1], 0:lit.shape[2]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_x = (lit * xs).sum(axis=(1, 2)) // num_px - 8
+        avg_y = (lit * ys).sum(axis=(1, 2)) // num_px + 7
+    pos = np.stack([avg_x, avg_y], axis=1)
+    # same fallback as get_obj_pos() for empty images
+    pos[num_px == 0] = 0
+    return pos
+
+def batch_obj_hog(ims, orientations=8, pixels_per_cell=8, cells_per_block=3, eps=1e-5):
+    '''
+    get_obj_hog() of a stack of N same-sized images, returns Nx72.
+    Follows skimage's hog() (L2-Hys blocks, strongest channel gradient) for all images at once.
+    '''
+    ims = np.asarray(ims, dtype=float)
+    g_row = np.zeros_like(ims)
+    g_col = np.zeros_like(ims)
+    g_row[:, 1:-1] = ims[:, 2:] - ims[:, :-2]
+    g_col[:, :, 1:-1] = ims[:, :, 2:] - ims[:, :, :-2]
+
+    # per pixel, the channel with the largest gradient
+    magnitude = np.hypot(g_row, g_col)
+    strongest = magnitude.argmax(axis=3)[..., None]
+    g_row = np.take_along_axis(g_row, strongest, 3)[..., 0]
+    g_col = np.take_along_axis(g_col, strongest, 3)[..., 0]
+    magnitude = np.take_along_axis(magnitude, strongest, 3)[..., 0]
+    orientation = np.rad2deg(np.arctan2(g_row, g_col)) % 180
+
+    # orientation histogram of every cell
+    n, h, w = magnitude.shape
+    n_cells_row, n_cells_col = h // pixels_per_cell, w // pixels_per_cell
+    magnitude = magnitude[:, :n_cells_row * pixels_per_cell, :n_cells_col * pixels_per_cell]
+    orientation = orientation[:, :n_cells_row * pixels_per_cell, :n_cells_col * pixels_per_cell]
+    bins = np.minimum((orientation / (180 / orientations)).astype(int), orientations - 1)
+    cell_row = (np.arange(n_cells_row * pixels_per_cell) // pixels_per_cell)[:, None]
+    cell_col = (np.arange(n_cells_col * pixels_per_cell) // pixels_per_cell)[None, :]
+    idx = ((np.arange(n)[:, None, None] * n_cells_row + cell_row) * n_cells_col + cell_col) * orientations + bins
+    hist = np.bincount(
+        idx.ravel(), weights=magnitude.ravel(), minlength=n * n_cells_row * n_cells_col * orientations
+    ).reshape(n, n_cells_row, n_cells_col, orientations) / pixels_per_cell**2
+
+    # L2-Hys normalized blocks, averaged like get_obj_hog()
+    n_blocks_row = n_cells_row - cells_per_block + 1
+    n_blocks_col = n_cells_col - cells_per_block + 1
+    blocks = np.stack([
+        hist[:, r:r + n_blocks_row, c:c + n_blocks_col]
+        for r in range(cells_per_block) for c in range(cells_per_block)
+    ], axis=3).reshape(n, n_blocks_row * n_blocks_col, -1)
+    blocks = blocks / np.sqrt((blocks**2).sum(axis=-1, keepdims=True) + eps**2)
+    blocks = np.minimum(blocks, 0.2)
+    blocks = blocks / np.sqrt((blocks**2).sum(axis=-1, keepdims=True) + eps**2)
+    return blocks.mean(axis=1)
+
+class TrialFeatures:
+    '''
+    Buffers the crops of both objects during a trial, features used by the
+    preference hypotheses are extracted for all of them in one batch at trial end
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.agent_pos = []
+        self.obj_1_ims = []
+        self.obj_2_ims = []
+
+    def add(self, a_pos, obj_1_im, obj_2_im):
+        self.agent_pos.append(a_pos)
+        self.obj_1_ims.append(obj_1_im)
+        self.obj_2_ims.append(obj_2_im)
+
+    def extract(self):
+        '''
+        Returns a dict of arrays with one row per buffered frame, in pref_dict keys
+        '''
+        n = len(self.agent_pos)
+        if n == 0:
+            return None
+        ims = np.stack(self.obj_1_ims + self.obj_2_ims)
+        colors = batch_ch_avgs(ims)
+        hogs = batch_obj_hog(ims)
+        dists = np.linalg.norm(batch_obj_pos(ims) - np.tile(np.asarray(self.agent_pos, dtype=float), (2, 1)), axis=1)
+        self.reset()
+        return {
+            "obj_1_color": colors[:n],
+            "obj_2_color": colors[n:],
+            "obj_1_hog": hogs[:n],
+            "obj_2_hog": hogs[n:],
+            "obj_1_dist": dists[:n],
+            "obj_2_dist": dists[n:]
+        }
+
 def dist_agent_obj(a_pos, obj):
     a_x, a_y = a_pos
     o_x, o_y = get_obj_pos(obj)
@@ -458,4 +891,7 @@ def find_and_rm_jerk_walls(g_rgb, g_mask, structural_mask_c_s, a, o_1, o_2, h):
         a["c"] = tuple(np.copy(agent_mask_color))
         return _m, g_mask, structural_mask_c_s, a, o_1, o_2
     else:
-        return None, g_mask, structural_mask_c_s, a, o_1, o_2
\ No newline at end of file
+        return None, g_mask, structural_mask_c_s, a, o_1, o_2
+
+if __name__ == "__main__":
+    benchmark_warps()
@@ -4,9 +4,6 @@ import glob
 import math
 import numpy as np
 import matplotlib.pyplot as plt
-from pathfinding.core.grid import Grid
-from pathfinding.finder.a_star import AStarFinder
-from pathfinding.core.diagonal_movement import DiagonalMovement
 from voe.agency_util import *
 
 class AgencyVoeAgent:
@@ -15,11 +12,19 @@ class AgencyVoeAgent:
         self.controller = controller
         self.level = level
         self.debug = debug
-        self.trial_num = idx
+        self.trial_num = 0
         self.trial_err = 0
+        self.trial_stats = [] # per trial path errors, read by voe.agency_replay
+        self.last_error = None
         self.step_num = 0
+        self.cam_im = None
+        self.mask_im = None
         self.arena = None
         self.path = None # our prediction of where the agent will go
+        self.path_taken = []
+        self.goal_px = (0, 0) # where we expect the agent to go, in ground image px
+        self.agent_offset = [0, 0]
+        self.planner = GridPlanner() # distance fields are reused by every trial of the scene
         self.home_side_len = 29 # home side length in px after being cropped and homographied
         self.home_side_wiggle = 10
         self.home_colors = [252, 49, 254]
@@ -34,18 +39,22 @@ class AgencyVoeAgent:
         self.gnd_mask = None
         self.gnd_rgb = None
         self.M_wall, self.M_gnd = get_homographies()
+        # same warps as wall_trans / gnd_trans with the fixed homographies, as lookup tables
+        self.wall_table, self.gnd_table = get_warp_tables()
         self.choice = None
         self.confidence = 1
         self.pref_confidence = 1
+        # one row per trial, filled from trial_features at the end of each trial
         self.pref_dict = {
-            "obj_1_color": [],
-            "obj_2_color": [],
-            "obj_1_hog": [],
-            "obj_2_hog": [],
-            "obj_1_dist": [],
-            "obj_2_dist": [],
+            "obj_1_color": np.empty((0, 3)),
+            "obj_2_color": np.empty((0, 3)),
+            "obj_1_hog": np.empty((0, 72)),
+            "obj_2_hog": np.empty((0, 72)),
+            "obj_1_dist": np.empty(0),
+            "obj_2_dist": np.empty(0),
             "chosen": []
         }
+        self.trial_features = TrialFeatures()
 
         # quick and dirty way to toggle debug printing to screen
         if not self.debug:
@@ -54,32 +63,64 @@ class AgencyVoeAgent:
 
             #print = silence_print
         
+    def start_trial(self, trial_num):
+        '''
+        Forgets what was identified in the previous trial, every trial has its own layout
+        '''
+        self.trial_num = trial_num
+        self.step_num = 0
+        self.trial_err = 0
+        self.path = None
+        self.path_taken = []
+        self.goal_px = (0, 0)
+        self.agent_offset = [0, 0]
+        self.agent_dict = {"rgb": None, "mask": None, "c": None, "ch_avgs": None, "x": None, "y": None}
+        self.home_dict = {"rgb": None, "mask": None, "c": None, "center": None}
+        self.obj_1_dict = {"rgb": None, "mask": None, "c": None}
+        self.obj_2_dict = {"rgb": None, "mask": None, "c": None}
+        self.trial_features.reset()
+
     def run_scene(self, config):
 
         self.trial_err = 0
         self.arena = create_arena()
+        self.planner = GridPlanner()
+        self.trial_stats = []
+        self.last_error = None
         self.structural_mask_colors = []
+        self.pref_confidence = 1
+        self.choice = "expected"
+        step_output = None
 
         try:
             scene_err = scene_steps = scene_path_err = scene_voe = 0
             num_trials = 9
+            trials_done = 0
+            action_list = config['goal']['action_list']
             action_i = 0
             self.controller.start_scene(config)
 
             for idx in range(num_trials):
-                self.path_taken = []
+                self.start_trial(idx)
 
-                while type(self.cam_im) != type(None) and next_action == "Pass":
-                    next_action = config['goal']['action_list'][action_i][0]
+                # a trial is the "Pass" steps up to and including its "EndHabituation"
+                next_action = "Pass"
+                while next_action == "Pass" and action_i < len(action_list):
+                    next_action = action_list[action_i][0]
                     action_i += 1
                     step_output = self.controller.step(action=next_action)
+                    if step_output is None:
+                        break
                     self.cam_im = step_output.image_list[0]
                     self.cam_im = np.array(self.cam_im)[:,:,::-1]
                     self.mask_im = step_output.object_mask_list[0]
                     self.mask_im = np.array(self.mask_im)[:,:,::-1]
-                    self.trial_num = idx
 
-                    step()
+                    self.step()
+
+                if self.step_num == 0:
+                    # the scene ended before this trial
+                    break
 
                 # if multiple object trial
                 if type(self.obj_2_dict["c"]) != type(None):
@@ -96,6 +137,7 @@ class AgencyVoeAgent:
                     else:
                         #cv2_show_im(obj_2)
                         self.pref_dict["chosen"].append(2)
+                self.store_pref_features()
 
                 
                 path_len = len(self.path)
@@ -106,10 +148,6 @@ class AgencyVoeAgent:
                     path_len = 1
                 actual_len = len(self.path_taken)
                 #print("actual path lenght:", actual_len)
-                grid = Grid(matrix=self.arena)
-                start = grid.node(self.path_taken[0][0], self.path_taken[0][1])
-                end = grid.node(self.path_taken[actual_len-1][0], self.path_taken[actual_len-1][1])
-                #print(grid.grid_str(path=self.path_taken, start=start, end=end))
                 scene_err += self.trial_err
                 scene_steps += actual_len
                 avg_trial_a_pos_err = self.trial_err/actual_len
@@ -119,8 +157,19 @@ class AgencyVoeAgent:
                 path_err = abs(actual_len - empirical_offset - path_len)
                 scene_path_err += path_err
                 print("trial #" + str(idx+1) + "'s path length difference:", path_err)
+                self.trial_stats.append({
+                    "trial": idx,
+                    "avg_pos_err": avg_trial_a_pos_err,
+                    "path_len_err": path_err,
+                    "actual_len": actual_len,
+                    "inferred_len": path_len
+                })
+                trials_done += 1
+
+            if trials_done == 0:
+                raise ValueError("No trial frames in scene {}".format(config.get("name")))
             print("avg step error over scene:", scene_err/scene_steps)
-            print("avg trial path difference:", scene_path_err/num_trials)
+            print("avg trial path difference:", scene_path_err/trials_done)
 
             voe_threshold = 6.5
             # confidence is proportional to how well the agent followed our inferred path
@@ -139,8 +188,9 @@ class AgencyVoeAgent:
 
         # end try from the beginning of run_scene(). This is better than throwing an error all the way up and breaking the agent
         except Exception as e:
+            import traceback 
+            self.last_error = traceback.format_exc()
             if self.debug:
-                import traceback 
                 traceback.print_exc()
                 print(e)
                 exit()
@@ -161,20 +211,24 @@ class AgencyVoeAgent:
             except Exception as e:
                 pass
 
-    def step():
-        self.gnd_mask = gnd_trans(self.mask_im, self.M_gnd)
-        self.gnd_rgb = gnd_trans(self.cam_im, self.M_gnd)
+    def step(self):
+        first_frame = self.step_num == 0
+        self.gnd_mask = self.gnd_table(self.mask_im)
+        self.gnd_rgb = self.gnd_table(self.cam_im)
+        
+        # every mask color of the frame is summarized once, then only queried
+        self.mask_colors = MaskColorIndex(self.gnd_rgb, self.gnd_mask)
         
-        trans_im = wall_trans(self.cam_im, M_wall)
+        trans_im = self.wall_table(self.cam_im)
         
         if self.trial_num + self.step_num == 0:
             _walls_im, self.arena, self.wall_i_s = find_walls(trans_im, self.arena)
 
-        self.structural_mask_colors.append(get_gnd_mask_color(self.gnd_mask))
+        self.structural_mask_colors.append(self.mask_colors.gnd_color())
         wall_filtered = []
         for x, y in self.wall_i_s:
-            c = get_mask_color(self.gnd_mask, x, y)
-            if is_wall(self.gnd_rgb, self.gnd_mask, c):
+            c = self.mask_colors.grid_color(x, y)
+            if self.mask_colors.is_wall(c):
                 self.structural_mask_colors.append(c)
                 wall_filtered.append((x, y))
         self.wall_i_s = wall_filtered
@@ -186,41 +240,27 @@ class AgencyVoeAgent:
 
         self.id_unknowns()
 
-        self.pref_confidence = 1
         a_pos = (self.agent_dict["x"], self.agent_dict["y"])
 
         # if the first frame of the multi-object case
         if first_frame and type(self.obj_2_dict["c"]) != type(None):
-            if info["trial_num"] == 8:
-                o_x, o_y = get_pref_obj_pos()
-                a_x, a_y, = px_to_arena(a_pos, self.home_dict["rgb"])
-                info["path"] = calc_path(arena, (a_x, a_y), px_to_arena((o_x, o_y), self.home_dict["rgb"]))
+            if self.trial_num == 8:
+                self.goal_px = self.get_pref_obj_pos()
             else:
-                self.pref_dict["obj_1_color"].append(list(get_ch_avgs(self.obj_1_dict["rgb"])))
-                self.pref_dict["obj_2_color"].append(list(get_ch_avgs(self.obj_2_dict["rgb"])))
-                self.pref_dict["obj_1_hog"].append(list(get_obj_hog(self.obj_1_dict["rgb"])))
-                self.pref_dict["obj_2_hog"].append(list(get_obj_hog(self.obj_2_dict["rgb"])))
-                self.pref_dict["obj_1_dist"].append(dist_agent_obj(a_pos, self.obj_1_dict["rgb"]))
-                self.pref_dict["obj_2_dist"].append(dist_agent_obj(a_pos, self.obj_2_dict["rgb"]))
+                # features are extracted in a batch at the end of the trial
+                self.trial_features.add(a_pos, self.obj_1_dict["rgb"], self.obj_2_dict["rgb"])
 
         a_x, a_y, = px_to_arena(a_pos, self.home_dict["rgb"])
         self.path_taken.append((a_x, a_y))
 
-        trial_err = info["trial_err"]
         i = self.step_num
-        choice = "expected"
-        confidence = 0.0
-
-        # @TODO prob remove for refactor & calc this path @ end of trial
-        if first_frame and type(self.path) == type(None):
-            if type(self.obj_2_dict["c"]) == type(None) or info["trial_num"] != 0:
-                self.path = calc_path(self.arena, (a_x, a_y), px_to_arena((o_x, o_y), self.home_dict["rgb"]))
 
         # @TODO remove outside step and loop over history lists to calculate this all at once
         if type(self.obj_2_dict["c"]) == type(None) or (type(self.obj_2_dict["c"]) != type(None)): 
             end_offset = 4
+            # planned once per trial, from where the agent starts
             if type(self.path) == type(None):
-                self.path = calc_path(self.arena, (a_x, a_y), px_to_arena((o_x, o_y), self.home_dict["rgb"]))
+                self.path = self.planner.plan(self.arena, (a_x, a_y), px_to_arena(self.goal_px, self.home_dict["rgb"]))
             if i >= len(self.path) - end_offset:
                 if (len(self.path)) == 0:
                     guess_x, guess_y = (0,0)
@@ -233,12 +273,12 @@ class AgencyVoeAgent:
             else:
                 guess_x, guess_y = self.path[i]
             euclid_err = ((guess_x - a_x)**2 + (guess_y - a_y)**2) ** 0.5
-            trial_err += euclid_err
+            self.trial_err += euclid_err
 
             # A little more than a wall piece distance between calculated and actual agent pos is voe_threshold.
             voe_threshold = 12
             self.confidence = (self.trial_err * 2 - voe_threshold) / voe_threshold
-            choice = "expected" if self.confidence < 0 else "unexpected"
+            self.choice = "expected" if self.confidence < 0 else "unexpected"
             self.confidence = abs(self.confidence)
             self.confidence *= self.pref_confidence
             if self.confidence > 1.0:
@@ -259,13 +299,23 @@ class AgencyVoeAgent:
 
         return True
 
+    def store_pref_features(self):
+        '''
+        Extracts the features of the trial's buffered object crops and appends them to pref_dict
+        '''
+        features = self.trial_features.extract()
+        if features is None:
+            return
+        for key, rows in features.items():
+            self.pref_dict[key] = np.concatenate([self.pref_dict[key], rows])
+
     def id_unknowns(self):
         '''
         Identifies what the remaining masks are. Should be agent(s), object(s), home square(s), 
         and maybe a wall occluded by an agent.
         '''
 
-        unknown_colors = get_unknowns(self.gnd_mask, self.structural_mask_colors)
+        unknown_colors = self.mask_colors.unknowns(self.structural_mask_colors)
         print("Number of yet unidentified objects:", len(unknown_colors))
 
         # finding home should be easiest. Except for edge cases the agent is the largest unknown mask
@@ -273,26 +323,30 @@ class AgencyVoeAgent:
         # can loop thru these multiple times if necessary, doesn't have to be done in a single pass.
         # Hog might make tracking the agent easier, current method suffers from shadows, lighting changes
         # while moving across the map, and when the agent is occulded by walls.
+        first_frame = self.step_num == 0
         for c in unknown_colors:
-            if is_wall(self.gnd_rgb, self.gnd_mask, c):
+            # home & objects don't move during a trial, only the agent needs tracking
+            if c in (self.home_dict["c"], self.obj_1_dict["c"], self.obj_2_dict["c"]):
+                continue
+            if self.mask_colors.is_wall(c):
                 self.structural_mask_colors.append(c)
                 print("removing possible wall piece from unknowns")
                 continue
 
             obj_im, mask = apply_color_mask(np.copy(self.gnd_rgb), np.copy(self.gnd_mask), c, show=False)
+            ch_avgs = self.mask_colors.ch_avgs(c)
 
             if type(self.agent_dict["ch_avgs"]) == type(None):
                 a_color_dist = 0
             else:
                 # color histogram different between the agent and the current unknown object
-                a_color_dist = np.absolute(self.agent_dict["ch_avgs"] - get_ch_avgs(obj_im)).sum()
+                a_color_dist = np.absolute(self.agent_dict["ch_avgs"] - ch_avgs).sum()
 
-            color_diff_to_home = np.absolute(self.home_colors - get_ch_avgs(obj_im)).sum()
-            non_zero_c = cv2.countNonZero(obj_im.sum(axis=2))
-            color_diff_to_home = color_diff_to_home / non_zero_c
+            color_diff_to_home = np.absolute(self.home_colors - ch_avgs).sum()
+            color_diff_to_home = color_diff_to_home / self.mask_colors.non_black_count(c)
 
             # home square is a certain color, height and width after homography
-            l,r,t,b = get_mask_cardinals(obj_im)
+            l,r,t,b = self.mask_colors.cardinals(c)
             width = r-l
             height = b-t
             # can change this to per channel avg if this becomes too broad a range
@@ -304,21 +358,21 @@ class AgencyVoeAgent:
                 self.home_dict["c"] = c
                 self.home_dict["center"] = (l + width//2, t + height//2)
             elif a_color_dist < self.agent_wiggle:
-                if type(agent_dict["mask"]) != type(None) and first_frame:
+                if type(self.agent_dict["mask"]) != type(None) and first_frame:
                     if type(self.obj_1_dict["mask"]) != type(None):
                         #print("Set object 2!!")
                         self.obj_2_dict["rgb"] = self.agent_dict["rgb"]
-                        self.obj_2_dict["mask"] = agent_dict["mask"]
-                        self.obj_2_dict["c"] = agent_dict["c"]
+                        self.obj_2_dict["mask"] = self.agent_dict["mask"]
+                        self.obj_2_dict["c"] = self.agent_dict["c"]
                     else:
                         #print("Set object 1!!")
                         self.obj_1_dict["rgb"] = self.agent_dict["rgb"]
-                        self.obj_1_dict["mask"] = agent_dict["mask"]
-                        self.obj_1_dict["c"] = agent_dict["c"]
+                        self.obj_1_dict["mask"] = self.agent_dict["mask"]
+                        self.obj_1_dict["c"] = self.agent_dict["c"]
                 #print("Found agent!")
                 self.agent_dict["rgb"] = obj_im
-                agent_dict["mask"] = mask
-                agent_dict["c"] = c
+                self.agent_dict["mask"] = mask
+                self.agent_dict["c"] = c
             elif type(self.obj_1_dict["mask"]) == type(None):
                 #print("Set object 1!")
                 self.obj_1_dict["rgb"] = obj_im
@@ -331,7 +385,10 @@ class AgencyVoeAgent:
                 self.obj_2_dict["c"] = c
 
         # update the agent's color histogram since moving around occludes bits of it and the lighting changes
-        self.agent_dict["ch_avgs"] = get_ch_avgs(self.agent_dict["rgb"])
+        if self.agent_dict["c"] in self.mask_colors:
+            self.agent_dict["ch_avgs"] = self.mask_colors.ch_avgs(self.agent_dict["c"])
+        else:
+            self.agent_dict["ch_avgs"] = get_ch_avgs(self.agent_dict["rgb"])
 
         h_x, h_y = get_home_pos(self.home_dict["rgb"])
         a_x, a_y = get_agent_pos(self.agent_dict["rgb"])
@@ -345,10 +402,10 @@ class AgencyVoeAgent:
         self.agent_dict["x"] = a_x
         self.agent_dict["y"] = a_y
 
-        # the default for multi-object case during trial #1 steps, but shouldn't even be used
-        o_x, o_y = 0, 0
-        if type(self.obj_2_dict["c"]) == type(None):
-            o_x, o_y = get_obj_pos(self.obj_1_dict["rgb"])
+        # with a single object that's where the agent goes, the multi-object
+        # case keeps the default until the test trial picks the preferred one
+        if first_frame and type(self.obj_2_dict["c"]) == type(None):
+            self.goal_px = get_obj_pos(self.obj_1_dict["rgb"])
 
     def get_pref_obj_pos(self):
         history = self.pref_dict
@@ -490,7 +547,7 @@ class AgencyVoeAgent:
                     o_x, o_y = get_obj_pos(o_2["rgb"])
         elif tied_count == 4:
             # All 4 would be 0.5 accurate and we divide that by 4
-            pref_confidence = 0.125
+            self.pref_confidence = 0.125
             o_x, o_y = get_obj_pos(o_2["rgb"])
         else:
             # need to calculate the best 2 and then compare predictions
@@ -554,4 +611,13 @@ class AgencyVoeAgent:
                         h_3_chosen = 2
                     # cv2_show_im(o_2["rgb"])
 
-        return o_x, o_y
\ No newline at end of file
+            # the tied hypotheses vote, disagreement lowers our confidence
+            votes = [h for h in (h_1_chosen, h_2_chosen, h_3_chosen) if type(h) != type(None)]
+            chosen_obj = max((1, 2), key=votes.count)
+            self.pref_confidence *= votes.count(chosen_obj) / len(votes)
+            if chosen_obj == 1:
+                o_x, o_y = get_obj_pos(o_1["rgb"])
+            else:
+                o_x, o_y = get_obj_pos(o_2["rgb"])
+
+        return o_x, o_y